@@ -36,11 +36,15 @@ from datetime import datetime, timedelta
 from glob import glob
 from random import shuffle
 from sys import argv
-from queue import Queue
 
 import wx, serial
 from modules.misc_funcs import GNU_notice, get_time_stamp, writeFile
-from modules.misc_funcs import get_log_file_path, show_msg, chk_msg_q
+from modules.misc_funcs import get_log_file_path, show_msg
+from modules.misc_funcs import flush_log
+from modules.trace import get_tracer
+from modules.msg_bus import MsgBus
+from modules.telemetry import TelemetryStore
+from modules.event_log import get_event_log, log_event
 
 ### load exisitng module files in module folder
 ###   (only files for running intended experiment is meant to be
@@ -58,6 +62,7 @@ for mod in MODS:
             from modules.feeder_mngr import FeederManager
         elif mod == "videoIn":
             from modules.videoIn import VideoIn
+            from modules.capture import CaptureCoordinator
         elif mod == "videoOut":
             from modules.videoOut import VideoOut
         elif mod == "audioIn":
@@ -106,10 +111,19 @@ class CATOSFrame(wx.Frame):
         self.cam_idx = [0] #[0,1,2] # webcam indices # [[TEMP]] using one 
           # webcam for testing 
         self.cam_idx_feeder = [] # webcam index for the feeder
+        self.cam_bg_model = {} # background model of each webcam
+          # (key: webcam index, value: 'frozen', 'running_avg', 'mog2' 
+          #  or 'knn'). 'frozen' is used, when a webcam index is not here.
+        self.flag_cap_coord = False # all webcams are captured together by
+          # CaptureCoordinator (synchronized frames with a common timestamp)
+        self.cap_coord = dict(videoIn=None, feeder_videoIn=None)
+        self.flag_videoIn_proc = False # run capture & analysis of each webcam
+          # in its own worker process (not used with flag_cap_coord)
         self.cam_view_pos = [50+self.w_size[0], 
                              wx.GetDisplaySize()[1]-350] # position of
           # webcam view checking windows
-        self.msg_q = Queue()
+        self.bus = MsgBus() # messages between modules
+        self.telemetry = None # sensor data store of the current session
         ##### [end] setting up attributes ----- 
         
         # init frame
@@ -247,8 +261,7 @@ class CATOSFrame(wx.Frame):
                                 ])
         self.SetAcceleratorTable(accel_tbl)
 
-        ### set timer for processing message and 
-        ###   updating the current running time
+        ### set timer for updating the current running time
         self.timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.onTimer, self.timer)
         self.timer.Start(100)
@@ -267,7 +280,7 @@ class CATOSFrame(wx.Frame):
         if DEBUG: print('CATOSFrame.start_arduino()')
         
         self.mods["arduino"] = Arduino(self, self.output_folder)
-        if self.mods["arduino"].aConn == None:
+        if self.mods["arduino"].get('feeder') == None:
             return # !!! remove for actual setup. This is for testing purpose.
             msg = "Arduino chip is not found.\nPlease connect it and retry."
             show_msg(msg, self.panel)
@@ -280,6 +293,7 @@ class CATOSFrame(wx.Frame):
     def stop_arduino(self):
         if DEBUG: print('CATOSFrame.stop_arduino()')
         
+        if self.mods["arduino"] != None: self.mods["arduino"].close()
         self.mods["arduino"] = None
         writeFile(self.log_file_path, 
                   "%s, [CATOS], arduino mod finished.\n"%(get_time_stamp()))
@@ -306,16 +320,33 @@ class CATOSFrame(wx.Frame):
                     cam_idx = self.cam_idx_feederf
                     flag_feeder = True
             pos = list(self.cam_view_pos)
+            if self.flag_cap_coord:
+                cc = CaptureCoordinator(cam_idx)
+                self.cap_coord[mod_name] = cc
             for i in range(len(cam_idx)):
-                self.mods[mod_name].append(VideoIn(self, 
-                                                   cam_idx[i], 
-                                                   tuple(pos)))
+                bg_model = self.cam_bg_model.get(cam_idx[i], 'frozen')
+                if self.flag_cap_coord:
+                    vi = VideoIn(self, 
+                                 cam_idx[i], 
+                                 tuple(pos),
+                                 bg_model,
+                                 frame_q=cc.add_worker(),
+                                 cap_pos=i,
+                                 fSize=cc.fSizes[i])
+                elif self.flag_videoIn_proc:
+                    # (imported here; it requires Python 3.8)
+                    from modules.videoIn_proc import VideoInProc
+                    vi = VideoInProc(self, cam_idx[i], tuple(pos), bg_model)
+                else:
+                    vi = VideoIn(self, cam_idx[i], tuple(pos), bg_model)
+                self.mods[mod_name].append(vi)
                 self.mods[mod_name][-1].thrd = Thread(
                                 target=self.mods[mod_name][-1].run,
                                 args=(chk_cam_view, flag_feeder,)
                                 )
                 self.mods[mod_name][-1].thrd.start()
                 pos[0] += 400
+            if self.flag_cap_coord: cc.start()
                 
         if mod == 'videoOut' or (mod == 'all' and flagMods["videoOut"]):
             self.mods["videoOut"] = VideoOut(self)
@@ -351,6 +382,7 @@ class CATOSFrame(wx.Frame):
                 self.mods['videoIn'][i].msg_q.put('main/quit/True', True, None)
                 #wx.CallLater(1000, self.mods['videoIn'][i].thrd.join)
             self.mods['videoIn'] = []
+            self.stop_cap_coord('videoIn')
             
         if mod == 'feeder_videoIn' or \
           (mod == 'all' and flagMods["feeder_mngr"]):
@@ -360,6 +392,7 @@ class CATOSFrame(wx.Frame):
                                                 )
                 #wx.CallLater(1000, self.mods['feeder_videoIn'][i].thrd.join)
             self.mods['feeder_videoIn'] = []
+            self.stop_cap_coord('feeder_videoIn')
             
         if mod == 'videoOut' or (mod == 'all' and flagMods["videoOut"]):
             if self.mods["videoOut"] != None:
@@ -394,6 +427,17 @@ class CATOSFrame(wx.Frame):
 
     # --------------------------------------------------
 
+    def stop_cap_coord(self, mod_name):
+        if DEBUG: print('CATOSFrame.stop_cap_coord()')
+        
+        cc = self.cap_coord[mod_name]
+        if cc == None: return
+        cc.log_metrics(self.log_file_path)
+        cc.stop()
+        self.cap_coord[mod_name] = None
+
+    # --------------------------------------------------
+
     def onChkWebcamView(self, event):
         ''' Turn On/Off webcam to check its views
         '''
@@ -418,6 +462,14 @@ class CATOSFrame(wx.Frame):
             if flagMods["videoIn"]:
                 self.start_mods(mod='videoIn') # start webcam 
                   # (watching over 3 screens surrounded area)
+            get_tracer().start_session(path.join(self.output_folder, 
+                                        '%s_trace.bin'%(get_time_stamp())))
+            get_event_log().start_session(path.join(self.output_folder,
+                                    '%s_events.bin'%(get_time_stamp()[:10])))
+            if self.mods["arduino"] != None: # record sensor data
+                self.telemetry = TelemetryStore(path.join(self.output_folder,
+                                        '%s_telemetry'%(get_time_stamp())))
+                self.mods["arduino"].on_msg.append(self.telemetry.ingest)
             self.start_mods( mod='all' )
             self.session_start_time = time()
             e_time = time() - self.session_start_time
@@ -430,10 +482,21 @@ class CATOSFrame(wx.Frame):
             if flagMods["videoIn"]:
                 self.stop_mods(mod='videoIn') # stop webcam
             self.stop_mods( mod='all' )
+            get_tracer().end_session()
+            get_event_log().end_session()
+            if self.telemetry != None:
+                if self.mods["arduino"] != None:
+                    self.mods["arduino"].on_msg.remove(self.telemetry.ingest)
+                self.telemetry.close()
+                writeFile(self.log_file_path, "%s, [CATOS], %s\n"%(
+                                    get_time_stamp(), self.telemetry.stat_str()))
+                self.telemetry = None
             e_time = time() - self.session_start_time
             log = "%s, [CATOS],"%(get_time_stamp())
             log += " %.3f, End of session.\n"%(e_time)
             writeFile(self.log_file_path, log)
+            writeFile(self.log_file_path, "%s, [CATOS], messages; %s\n"%(
+                                        get_time_stamp(), self.bus.stat_str()))
             self.session_start_time = -1
             self.last_play_time = -1 # time when the last stimulus was play
             self.sTxt_time.SetLabel('0:00:00')
@@ -455,14 +518,11 @@ class CATOSFrame(wx.Frame):
 
     def onTimer(self, event):
         ''' Main timer 
-        for processing messages from modules
-        and updating running time on the main window
+        for updating running time on the main window
+        (messages from modules arrive on self.bus)
         '''
         if DEBUG: print('CATOSFrame.onTimer()')
         
-        ### processing message
-        msg_src, msg_body, msg_details = chk_msg_q(self.msg_q)
-
         ### update log file path, if necessary
         lfd = path.basename(self.log_file_path)[-6:-4] # date of the current
           # log file name
@@ -496,6 +556,7 @@ class CATOSFrame(wx.Frame):
             value = self.txt_notes.GetValue()
             log = "%s, [CATOS], %s\n"%(get_time_stamp(), value)
             writeFile(self.log_file_path, log)
+            log_event('catos', 'note')
             self.show_msg_in_statbar("'%s' is written in the log."%value)
             self.txt_notes.SetValue('')
         else: # entered in txt_arduino
@@ -532,6 +593,7 @@ class CATOSFrame(wx.Frame):
         if flagMods["arduino"]: self.stop_arduino()
         writeFile(self.log_file_path, 
                   '%s, [CATOS], End of the program\n'%(get_time_stamp()))
+        flush_log()
         wx.CallLater(1000, self.Destroy)
 
 # ======================================================
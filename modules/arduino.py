@@ -3,105 +3,76 @@
 """
 This module is for sending and receiving messages
  to Arduino-chip to control sensors and actuators.
+
+Boards on the USB serial ports are found and kept by ArduinoManager
+(modules/serial_io.py) by their roles ('feeder', 'sensors', 'lights', ...);
+a board is the feeder unless a role is given for its port (or its
+firmware answers the role query, when id_query is True).
 """
 
-import serial
-from os import path
 from glob import glob
-from time import time, sleep
 from sys import platform
 
-from modules.misc_funcs import writeFile, get_time_stamp, update_log_file_path, show_msg
+from modules.misc_funcs import writeFile, get_time_stamp, show_msg
+from modules.serial_io import ArduinoManager
+
+if platform == 'darwin': ARDUINO_USB_GLOB = "/dev/cu.usbmodem*"
+else: ARDUINO_USB_GLOB = "/dev/ttyACM*"
 
 # ======================================================
 
-class Arduino:
-    def __init__(self, parent, output_folder):
+class Arduino(ArduinoManager):
+    def __init__(self, parent, output_folder, baud=9600, roles={},
+                 id_query=False):
+        ''' baud: baud rate (a number, or dict of port path and baud rate
+          with 'default' key)
+        roles: dict of port path and role of its board
+        id_query: ask the boards on other ports their roles
+        '''
         self.parent = parent
         self.output_folder = output_folder
-        self.log_file_path = ''
-        if platform == 'darwin': ARDUINO_USB_GLOB = "/dev/cu.usbmodem*"
-        elif 'linux' in platform: ARDUINO_USB_GLOB = "/dev/ttyACM*"
-        ARDUINO_PORT = ''
-        self.aConn = None
-        for aConn in self.serial_scan(ARDUINO_USB_GLOB):
-            ARDUINO_PORT = aConn.name # Note: it uses the last one (when there're multiple ARDUINO chips connected)
-        if str(ARDUINO_PORT) != '':
-            msg = str(ARDUINO_PORT) + " connected."
-            print(msg)
-            self.aConn = aConn
+        ArduinoManager.__init__(self,
+                                lambda: sorted(glob(ARDUINO_USB_GLOB)),
+                                baud,
+                                roles,
+                                id_query,
+                                log=self.log)
 
     # --------------------------------------------
-    
-    def try_open(self, port):
-        try:
-            port = serial.Serial(port, 9600, timeout = 0)
-        except serial.SerialException as e:
-            return None
-        else:
-            return port
 
-    # --------------------------------------------
-
-    def serial_scan(self, ARDUINO_USB_GLOB):
-        for fn in glob(ARDUINO_USB_GLOB):
-            port = self.try_open(fn)
-            if port is not None:
-                yield port
-    
-    # --------------------------------------------    
-
-    def send(self, msg='', flag_log=True):
-        self.aConn.write(msg) # send a message to Arduino
-        #sleep(0.1)
-        self.aConn.flush() # flush the serial connection
-        if flag_log == True:
-            if path.isfile(self.log_file_path) == False:
-                self.log_file_path = update_log_file_path(self.output_folder)
-            writeFile(self.log_file_path, "%s, [arduino], '%s' was sent to Arduino\n"%(get_time_stamp(), msg))
+    def log(self, msg):
+        writeFile(self.parent.log_file_path,
+                  "%s, [arduino], %s\n"%(get_time_stamp(), msg))
 
     # --------------------------------------------
 
-    def receive(self, header, timeout):
-        ''' receive an intended(header-matching) message from the Arduino-chip 
-        for timeout-time(in seconds)
+    def send(self, msg='', flag_log=True, cid=0, ack=None, callback=None,
+             role='feeder'):
+        ''' queue 'msg' (bytes) to send to the board of 'role';
+        returns Command (or None, when there's no such board).
+        the writer thread of the board sends it, so this doesn't block.
+        ack: header of the reply to wait for (None: no reply expected)
+        cid: correlation ID of the message for tracing (0: not traced)
+        callback: called with the Command in the writer thread,
+          when it's finished
         '''
-        startTime = time()
-        while True:
-            ### try to get the intended message only for timeout-time
-            if timeout != None:
-                currTime = time()
-                if currTime - startTime > timeout:
-                    msg = None
-                    break
-            msg = self.receive_a_msg(timeout)
-            if msg == None: break
-            else:
-                msg = msg.strip("\r\n")
-                msg = [ m.strip() for m in msg.split(",") ]
-                if header in msg: # if there's a header in the list of messages
-                    msg = msg[msg.index(header):] # store the head to end
-                    break # quit loop (otherwise keep receiving message)
-        if msg != None:
-            self.aConn.flushInput()
-            if msg[len(msg)-1] == 'EOM': msg.pop(len(msg)-1) # delete 'EOM'
-        return msg
+        def on_done(cmd):
+            if flag_log == True: self.log_cmd(cmd, role)
+            if callback is not None: callback(cmd)
+        cmd = ArduinoManager.send(self, msg, role, ack, cid, on_done)
+        if cmd is None and flag_log == True:
+            self.log("'%s' was not sent; no %s board."%(msg, role))
+        return cmd
 
     # --------------------------------------------
 
-    def receive_a_msg(self, timeout):
-        ''' receive a message from the Arduino-chip for timeout-time
+    def log_cmd(self, cmd, role):
+        ''' log a finished command (writer thread)
         '''
-        startTime = time()
-        msg = self.aConn.read()
-        while msg[-3:] != "EOM": # End Of Message
-            if timeout != None:
-                currTime = time()
-                if currTime - startTime > timeout:
-                    msg = None
-                    break
-            msg += self.aConn.read()
-        return msg
+        log = "'%s' was sent to Arduino (%s, #%i, %s"%(cmd.data, role,
+                                                       cmd.seq, cmd.status)
+        if cmd.ack != None:
+            log += ", tries: %i, RTT: %.1f ms"%(cmd.n_tries, cmd.rtt()*1000)
+        self.log(log + ")")
 
 # ======================================================
-
@@ -0,0 +1,182 @@
+# coding: UTF-8
+
+"""
+This is for background models of VideoIn, which produce a binary
+foreground mask (0 or 255) of a camera frame.
+
+'frozen': a single background image taken after camera warm-up
+'running_avg': running average of frames (cv2.accumulateWeighted)
+'mog2', 'knn': OpenCV background subtractors
+
+Models are updated only on every 'update_intv'-th frame
+to save CPU time.
+"""
+
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+BG_MODELS = ['frozen', 'running_avg', 'mog2', 'knn']
+
+# ======================================================
+
+class BGModel:
+    def __init__(self, update_intv=1, diff_th=50):
+        self.update_intv = update_intv # update model on every n-th frame
+        self.diff_th = diff_th # threshold of difference to the background
+        self.cnt = 0 # number of applied frames
+
+    # --------------------------------------------------
+
+    def init(self, img):
+        ''' initialize the model with a background image
+        '''
+        pass
+
+    # --------------------------------------------------
+
+    def apply(self, img):
+        ''' returns the foreground mask of 'img'
+        '''
+        self.cnt += 1
+        update = self.update_intv > 0 and self.cnt % self.update_intv == 0
+        return self._apply(img, update)
+
+    # --------------------------------------------------
+
+    def diff_mask(self, img, bgImg):
+        diff = cv2.absdiff(img, bgImg)
+        diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+        __, diff = cv2.threshold(diff, self.diff_th, 255, cv2.THRESH_BINARY)
+        return diff
+
+# ======================================================
+
+class FrozenBG(BGModel):
+    def init(self, img):
+        self.bgImg = img.copy()
+
+    # --------------------------------------------------
+
+    def _apply(self, img, update):
+        return self.diff_mask(img, self.bgImg)
+
+# ======================================================
+
+class RunningAvgBG(BGModel):
+    def __init__(self, update_intv=5, diff_th=50, alpha=0.02, selective=True):
+        ''' alpha: weight of a new frame in the average
+        selective: don't learn pixels in the current foreground
+          (a subject sitting still doesn't fade into the background quickly)
+        '''
+        BGModel.__init__(self, update_intv, diff_th)
+        self.alpha = alpha
+        self.selective = selective
+        self.acc = None
+
+    # --------------------------------------------------
+
+    def init(self, img):
+        self.acc = img.astype(np.float32)
+        self.bgImg = img.copy()
+
+    # --------------------------------------------------
+
+    def _apply(self, img, update):
+        if self.acc is None: self.init(img)
+        fg = self.diff_mask(img, self.bgImg)
+        if update:
+            if self.selective:
+                cv2.accumulateWeighted(img, self.acc, self.alpha,
+                                       cv2.bitwise_not(fg))
+            else:
+                cv2.accumulateWeighted(img, self.acc, self.alpha)
+            cv2.convertScaleAbs(self.acc, self.bgImg)
+        return fg
+
+# ======================================================
+
+class SubtractorBG(BGModel):
+    def __init__(self, kind='mog2', update_intv=1, diff_th=50, 
+                 learning_rate=-1, history=500, detect_shadows=True):
+        ''' learning_rate: -1 lets OpenCV choose it from 'history'
+        (diff_th is not used by subtractors)
+        '''
+        BGModel.__init__(self, update_intv, diff_th)
+        self.learning_rate = learning_rate
+        if kind == 'mog2':
+            self.sub = cv2.createBackgroundSubtractorMOG2(
+                                        history=history,
+                                        detectShadows=detect_shadows
+                                        )
+        else:
+            self.sub = cv2.createBackgroundSubtractorKNN(
+                                        history=history,
+                                        detectShadows=detect_shadows
+                                        )
+
+    # --------------------------------------------------
+
+    def init(self, img):
+        self.sub.apply(img, learningRate=1)
+
+    # --------------------------------------------------
+
+    def _apply(self, img, update):
+        if update: lr = self.learning_rate
+        else: lr = 0
+        fg = self.sub.apply(img, learningRate=lr)
+        # shadows are marked as 127. leave only the foreground (255)
+        __, fg = cv2.threshold(fg, 200, 255, cv2.THRESH_BINARY)
+        return fg
+
+# ======================================================
+
+def make_bg_model(kind='frozen', **kwargs):
+    if kind == 'frozen': return FrozenBG(**kwargs)
+    elif kind == 'running_avg': return RunningAvgBG(**kwargs)
+    elif kind in ['mog2', 'knn']: return SubtractorBG(kind, **kwargs)
+    raise ValueError("Unknown background model: %s"%(str(kind)))
+
+# ======================================================
+
+def bench(video_path, warm_up=10):
+    ''' per-frame cost and number of contours of each background model
+    over a recorded video
+    '''
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+    for kind in BG_MODELS:
+        cap = cv2.VideoCapture(video_path)
+        for i in range(warm_up): ret, img = cap.read()
+        bgm = make_bg_model(kind)
+        bgm.init(img)
+        t_bg = 0.0; t_all = 0.0; n = 0; n_cnt = []
+        while True:
+            ret, img = cap.read()
+            if ret == False: break
+            t0 = perf_counter()
+            fg = bgm.apply(img)
+            t1 = perf_counter()
+            fg = cv2.morphologyEx(fg, cv2.MORPH_OPEN, kernel, iterations=1)
+            fg = cv2.Canny(fg, 150, 150)
+            contours, hierarchy = cv2.findContours(fg,
+                                                   cv2.RETR_TREE,
+                                                   cv2.CHAIN_APPROX_SIMPLE)
+            t2 = perf_counter()
+            t_bg += t1-t0; t_all += t2-t0; n += 1
+            n_cnt.append(len(contours))
+        cap.release()
+        if n == 0: print("No frames in %s"%(video_path)); return
+        q = max(1, n//4)
+        print("%12s: %i frames, bg-model %.2f ms, whole %.2f ms per frame,"\
+              " contours (mean) first quarter %.1f, last quarter %.1f"%(kind,
+                n, t_bg/n*1000, t_all/n*1000,
+                np.mean(n_cnt[:q]), np.mean(n_cnt[-q:])))
+
+# ======================================================
+
+if __name__ == '__main__':
+    from sys import argv
+    if len(argv) < 2: print("Usage: python -m modules.bg_model video_file")
+    else: bench(argv[1])
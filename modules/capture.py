@@ -0,0 +1,203 @@
+# coding: UTF-8
+
+"""
+This is for capturing frames of all cameras of CATOS in one place.
+
+On every cycle, CaptureCoordinator calls grab() on all devices first
+and retrieve() afterwards, so frames of a set are taken as closely
+together as possible. Each set gets one monotonic timestamp
+(time.perf_counter) and is handed to analysis workers through queues.
+Inter-camera skew and per-camera latency are measured.
+
+Sources can be webcam indices or video file paths,
+so it works without webcams as well.
+"""
+
+from time import perf_counter, sleep
+from threading import Thread, Event
+from queue import Queue, Full, Empty
+from collections import deque
+
+import cv2
+import numpy as np
+
+from modules.misc_funcs import get_time_stamp, writeFile
+
+# ======================================================
+
+class FrameSet:
+    def __init__(self, seq, ts, frames, skew, lat):
+        self.seq = seq # sequence number of the set
+        self.ts = ts # monotonic timestamp of the set
+        self.frames = frames # list of frames (None, if it failed)
+        self.skew = skew # seconds between the first and the last grab
+        self.lat = lat # seconds from start of the cycle to retrieved frame
+          # of each camera
+
+# ======================================================
+
+class CaptureCoordinator:
+    def __init__(self, srcs, fps=30, pace_files=True, loop_files=True,
+                 n_metrics=300):
+        ''' srcs: list of webcam indices or video file paths
+        fps: frame rate to set on webcams (and for pacing video files)
+        pace_files: play video files at 'fps' (False: as fast as possible)
+        loop_files: rewind video files at the end
+        n_metrics: number of recent frame sets to calculate metrics with
+        '''
+        self.srcs = srcs
+        self.fps = fps
+        self.pace_files = pace_files
+        self.loop_files = loop_files
+        self.flag_file = [type(src) == str for src in srcs]
+        self.caps = []
+        self.fSizes = []
+        for i in range(len(srcs)):
+            cap = cv2.VideoCapture(srcs[i])
+            if not self.flag_file[i]: cap.set(cv2.CAP_PROP_FPS, fps)
+            ret, frame = cap.read()
+            if ret == False: self.fSizes.append(None)
+            else: self.fSizes.append((frame.shape[1], frame.shape[0]))
+            self.caps.append(cap)
+        self.workers = [] # queues of workers
+        self.dropped = [] # number of dropped frame sets for each worker
+        self.seq = 0
+        self.skew = deque(maxlen=n_metrics)
+        self.lat = [deque(maxlen=n_metrics) for i in range(len(srcs))]
+        self.ts = deque(maxlen=n_metrics)
+        self.quit_ev = Event()
+        self.thrd = None
+
+    # --------------------------------------------------
+
+    def add_worker(self, maxsize=2):
+        ''' returns a new queue, which receives FrameSets.
+        When a worker is slow, the oldest set in its queue is dropped.
+        '''
+        q = Queue(maxsize=maxsize)
+        self.workers.append(q)
+        self.dropped.append(0)
+        return q
+
+    # --------------------------------------------------
+
+    def start(self):
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def stop(self):
+        self.quit_ev.set()
+        if self.thrd != None: self.thrd.join(2)
+        for cap in self.caps: cap.release()
+
+    # --------------------------------------------------
+
+    def grab(self, i):
+        ok = self.caps[i].grab()
+        if not ok and self.flag_file[i] and self.loop_files:
+            self.caps[i].set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok = self.caps[i].grab()
+        return ok
+
+    # --------------------------------------------------
+
+    def capture(self):
+        ''' grab on every device, then retrieve. returns a FrameSet
+        '''
+        n = len(self.caps)
+        t0 = perf_counter()
+        grab_t = []
+        ok = []
+        for i in range(n):
+            ok.append(self.grab(i))
+            grab_t.append(perf_counter())
+        ts = (t0 + grab_t[-1]) / 2.0
+        frames = []
+        lat = []
+        for i in range(n):
+            if ok[i]: ret, frame = self.caps[i].retrieve()
+            else: ret = False
+            if ret == False: frame = None
+            frames.append(frame)
+            lat.append(perf_counter()-t0)
+        fs = FrameSet(self.seq, ts, frames, grab_t[-1]-grab_t[0], lat)
+        self.seq += 1
+        return fs
+
+    # --------------------------------------------------
+
+    def run(self):
+        intv = 1.0/self.fps
+        next_t = perf_counter()
+        while not self.quit_ev.is_set():
+            if self.pace_files and all(self.flag_file):
+                ### no webcam blocks on grab(); keep the frame rate
+                next_t += intv
+                _t = next_t - perf_counter()
+                if _t > 0: sleep(_t)
+                else: next_t = perf_counter()
+            fs = self.capture()
+            if all([f is None for f in fs.frames]):
+                sleep(0.1)
+                continue
+            self.skew.append(fs.skew)
+            self.ts.append(fs.ts)
+            for i in range(len(fs.lat)): self.lat[i].append(fs.lat[i])
+            for wi in range(len(self.workers)):
+                q = self.workers[wi]
+                try: q.put(fs, False)
+                except Full:
+                    try: q.get(False) # drop the oldest
+                    except Empty: pass
+                    self.dropped[wi] += 1
+                    try: q.put(fs, False)
+                    except Full: pass
+
+    # --------------------------------------------------
+
+    def get_metrics(self):
+        ''' returns metrics (time in milliseconds) over recent frame sets
+        '''
+        m = dict(fps=0.0, skew_mean=0.0, skew_max=0.0,
+                 lat_mean=[], lat_max=[], dropped=list(self.dropped))
+        ts = list(self.ts)
+        if len(ts) > 1: m["fps"] = (len(ts)-1) / (ts[-1]-ts[0])
+        skew = np.array(self.skew)
+        if len(skew) > 0:
+            m["skew_mean"] = skew.mean()*1000
+            m["skew_max"] = skew.max()*1000
+        for i in range(len(self.lat)):
+            lat = np.array(self.lat[i])
+            if len(lat) == 0: lat = np.zeros(1)
+            m["lat_mean"].append(lat.mean()*1000)
+            m["lat_max"].append(lat.max()*1000)
+        return m
+
+    # --------------------------------------------------
+
+    def log_metrics(self, log_file_path):
+        m = self.get_metrics()
+        log = "%s, [capture], FPS: %.1f,"%(get_time_stamp(), m["fps"])
+        log += " inter-camera skew (ms) mean %.2f, max %.2f,"%(m["skew_mean"],
+                                                            m["skew_max"])
+        log += " latency (ms) mean %s,"%(str([round(v, 2) for v in m["lat_mean"]]))
+        log += " max %s,"%(str([round(v, 2) for v in m["lat_max"]]))
+        log += " dropped frame sets %s\n"%(str(m["dropped"]))
+        writeFile(log_file_path, log)
+
+# ======================================================
+
+if __name__ == '__main__':
+    from sys import argv
+    if len(argv) < 2:
+        print("Usage: python -m modules.capture video_file [video_file ...]")
+    else:
+        cc = CaptureCoordinator(argv[1:], pace_files=False)
+        q = cc.add_worker()
+        cc.start()
+        t0 = perf_counter()
+        while perf_counter()-t0 < 5: q.get(True, None)
+        cc.stop()
+        print(cc.get_metrics())
@@ -0,0 +1,103 @@
+# coding: UTF-8
+
+"""
+This is for detecting colors (HSV ranges) in camera frames of CATOS.
+
+Scratch buffers are kept and reused between calls,
+and only the requested rect is converted to HSV,
+so it's cheap enough to run on every frame.
+"""
+
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+# red hue wraps around 0/180 in OpenCV HSV
+RED_HSV_RANGES = [((0,100,90), (5,255,255)), ((175,100,90), (180,255,255))]
+
+# ======================================================
+
+class ColorDetector:
+    def __init__(self):
+        self.bufs = {} # scratch buffers (flat arrays); key: name
+
+    # --------------------------------------------------
+
+    def buf(self, name, shape):
+        ''' returns a contiguous uint8 array of 'shape' on a reused buffer
+        '''
+        n = int(np.prod(shape))
+        b = self.bufs.get(name)
+        if b is None or b.size < n:
+            b = np.zeros(n, dtype=np.uint8)
+            self.bufs[name] = b
+        return b[:n].reshape(shape)
+
+    # --------------------------------------------------
+
+    def find(self, img, rect, ranges, mask=None):
+        ''' find colors in HSV 'ranges' (list of (HSV_min, HSV_max))
+        in an area('rect'; x1,y1,x2,y2) of an image('img').
+        mask: (y2-y1, x2-x1) uint8 array (or view) to write the result into.
+          When it's None, a full-frame mask (reused buffer; zero outside
+          'rect') is returned.
+        '''
+        x1, y1, x2, y2 = rect
+        h = y2-y1; w = x2-x1
+        hsv = self.buf('hsv', (h, w, 3))
+        cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2HSV, hsv)
+        res = self.buf('res', (h, w))
+        for i in range(len(ranges)):
+            if i == 0:
+                cv2.inRange(hsv, ranges[i][0], ranges[i][1], res)
+            else:
+                tmp = self.buf('tmp', (h, w))
+                cv2.inRange(hsv, ranges[i][0], ranges[i][1], tmp)
+                cv2.bitwise_or(res, tmp, res)
+        if mask is None:
+            mask = self.buf('mask', img.shape[:2])
+            if (x1, y1, x2, y2) != (0, 0, img.shape[1], img.shape[0]):
+                mask[:] = 0
+            np.copyto(mask[y1:y2, x1:x2], res)
+            return mask
+        np.copyto(mask, res)
+        return mask
+
+# ======================================================
+
+def bench(fSize=(640, 480), repeat=200):
+    ''' compare the previous VideoIn.find_color with ColorDetector.find
+    '''
+    def _find_color(rect, inImage, HSV_min, HSV_max, bgColor=(0,0,0)):
+        tmp_grey_img = np.zeros( (inImage.shape[0], inImage.shape[1]) , dtype=np.uint8 )
+        tmp_col_img = np.zeros( (inImage.shape[0], inImage.shape[1], 3), dtype=np.uint8 )
+        HSV_img = np.zeros( (inImage.shape[0], inImage.shape[1], 3), dtype=np.uint8 )
+        tmp_col_img[:,:,:] = bgColor
+        tmp_col_img[ rect[1]:rect[3], rect[0]:rect[2], : ] = inImage[ rect[1]:rect[3], rect[0]:rect[2], : ].copy()
+        cv2.cvtColor(tmp_col_img, cv2.COLOR_BGR2HSV, HSV_img)
+        cv2.inRange(HSV_img, HSV_min, HSV_max, tmp_grey_img)
+        return tmp_grey_img
+
+    img = np.random.RandomState(0).randint(0, 256, (fSize[1], fSize[0], 3))
+    img = img.astype(np.uint8)
+    cd = ColorDetector()
+    w, h = fSize
+    for r in [(0, 0, w, h), (0, h*3//4, w, h), (w//4, h//4, w//2, h//2)]:
+        t0 = perf_counter()
+        for i in range(repeat): _find_color(r, img, (175,100,90), (180,255,255))
+        t_old = (perf_counter()-t0)/repeat
+        t0 = perf_counter()
+        for i in range(repeat): cd.find(img, r, RED_HSV_RANGES[1:])
+        t_new = (perf_counter()-t0)/repeat
+        mask = np.zeros((r[3]-r[1], r[2]-r[0]), dtype=np.uint8)
+        t0 = perf_counter()
+        for i in range(repeat): cd.find(img, r, RED_HSV_RANGES, mask)
+        t_new2 = (perf_counter()-t0)/repeat
+        print("rect %s: find_color %.3f ms, ColorDetector %.3f ms,"\
+              " ColorDetector (2 ranges, into rect mask) %.3f ms"%(
+                str(r), t_old*1000, t_new*1000, t_new2*1000))
+
+# ======================================================
+
+if __name__ == '__main__': bench()
@@ -0,0 +1,371 @@
+# coding: UTF-8
+
+"""
+This is a structured binary event log, written alongside the text log.
+
+An event is a fixed-size record (EVENT_DTYPE); monotonic time in ns,
+module ID (MODS), event type (EVENTS) and a numeric payload of 3 values.
+Records are appended to one file per day (yyyy_mm_dd_events.bin, after
+a short header). Session and trial boundaries are also appended to
+a sidecar index (<file>.idx; INDEX_DTYPE) with the record number,
+so a reader finds a session, a trial or a time range by looking at
+the small index and binary search in the memory-mapped records,
+instead of scanning log lines.
+
+Payload of some events:
+  session_start: wall-clock time (sec since epoch) at the start;
+    t_ns of records can be converted with it (monotonic time restarts
+    when the computer restarts)
+  touch: x, y, hit (0/1)
+  stim_touched, feed: trace correlation ID
+
+Usage: python -m modules.event_log events_file [events_file ...]
+  prints sessions and trials of event log files
+  (without a file, runs a self check)
+"""
+
+import sys
+from os import path, getpid
+from threading import Lock
+from time import time, perf_counter_ns
+
+import numpy as np
+
+EVENT_MAGIC = b'CATOSEV1'
+INDEX_MAGIC = b'CATOSIX1'
+EVENT_DTYPE = np.dtype([('t_ns', '<i8'), ('mod', 'u1'), ('evt', 'u1'),
+                        ('payload', '<f8', (3,))])
+INDEX_DTYPE = np.dtype([('evt', 'u1'), ('t_ns', '<i8'), ('rec', '<i8')])
+MODS = ['catos', 'session_mngr', 'videoOut', 'videoIn', 'arduino',
+        'audioOut']
+EVENTS = ['session_start', 'session_end', 'trial_init', 'trial_start',
+          'trial_end', 'touch', 'stim_touched', 'feed', 'close_to_screen',
+          'note']
+MOD_ID = dict([(m, i) for i, m in enumerate(MODS)])
+EVT_ID = dict([(e, i) for i, e in enumerate(EVENTS)])
+BOUNDARY_EVTS = [EVT_ID[e] for e in ['session_start', 'session_end',
+                                     'trial_start', 'trial_end']]
+
+# ======================================================
+
+class EventLog:
+    def __init__(self, buf_records=256):
+        ''' buf_records: number of records to buffer before writing
+        '''
+        self.pid = getpid()
+        self.buf_records = buf_records
+        self.lock = Lock()
+        self.f = None # events file of the current session
+        self.f_idx = None # its index file
+        self.file_path = ''
+        self.buf = np.zeros(buf_records, dtype=EVENT_DTYPE)
+        self.n_buf = 0
+        self.n_rec = 0 # number of records in the file
+
+    # --------------------------------------------------
+
+    def start_session(self, file_path):
+        ''' start appending events to 'file_path' and log 'session_start'
+        '''
+        with self.lock:
+            self._close()
+            flag_new = not path.isfile(file_path)
+            self.f = open(file_path, 'ab')
+            if flag_new:
+                self.f.write(EVENT_MAGIC)
+                self.n_rec = 0
+            else:
+                size = path.getsize(file_path) - len(EVENT_MAGIC)
+                self.n_rec = size // EVENT_DTYPE.itemsize
+                if size % EVENT_DTYPE.itemsize != 0: # a cut-off record
+                    self.f.truncate(len(EVENT_MAGIC) + \
+                                    self.n_rec*EVENT_DTYPE.itemsize)
+            self._repair_index(file_path + '.idx')
+            self.f_idx = open(file_path + '.idx', 'ab')
+            self.file_path = file_path
+        self.log('catos', 'session_start', time())
+
+    # --------------------------------------------------
+
+    def _repair_index(self, fp):
+        ''' make the index file 'fp' consistent with the n_rec records
+        after a crash; a cut-off last entry is truncated and entries
+        of records which are not in the file are dropped.
+        (an index without the header is started again)
+        '''
+        if not path.isfile(fp): data = None
+        else:
+            with open(fp, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC: data = None
+                else: data = f.read()
+        if data is None:
+            with open(fp, 'wb') as f: f.write(INDEX_MAGIC)
+            return
+        k = len(data) // INDEX_DTYPE.itemsize
+        idx = np.frombuffer(data[:k*INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+        ok = idx['rec'] < self.n_rec
+        if k*INDEX_DTYPE.itemsize == len(data) and ok.all(): return
+        with open(fp, 'r+b') as f:
+            if ok.all(): # only a cut-off entry
+                f.truncate(len(INDEX_MAGIC) + k*INDEX_DTYPE.itemsize)
+            else:
+                f.seek(len(INDEX_MAGIC))
+                f.write(idx[ok].tobytes())
+                f.truncate()
+
+    # --------------------------------------------------
+
+    def end_session(self):
+        self.log('catos', 'session_end')
+        with self.lock: self._close()
+
+    # --------------------------------------------------
+
+    def _close(self):
+        if self.f is None: return
+        self._write_buf()
+        self.f.close()
+        self.f_idx.close()
+        self.f = None
+        self.f_idx = None
+
+    # --------------------------------------------------
+
+    def _write_buf(self):
+        if self.n_buf > 0:
+            recs = self.buf[:self.n_buf]
+            bi = np.isin(recs['evt'], BOUNDARY_EVTS)
+            if bi.any():
+                idx = np.zeros(bi.sum(), dtype=INDEX_DTYPE)
+                idx['evt'] = recs['evt'][bi]
+                idx['t_ns'] = recs['t_ns'][bi]
+                idx['rec'] = self.n_rec + np.where(bi)[0]
+                self.f.write(recs.tobytes())
+                self.f.flush() # records before the index
+                self.f_idx.write(idx.tobytes())
+                self.f_idx.flush()
+            else:
+                self.f.write(recs.tobytes())
+            self.n_rec += self.n_buf
+            self.n_buf = 0
+        self.f.flush()
+
+    # --------------------------------------------------
+
+    def log(self, mod, evt, *payload):
+        ''' append an event; mod and evt are names in MODS and EVENTS.
+        does nothing without a session.
+        (boundary events are written to the file immediately)
+        '''
+        t_ns = perf_counter_ns()
+        if self.f is None: return
+        p = (tuple(payload) + (0.0, 0.0, 0.0))[:3]
+        with self.lock:
+            if self.f is None: return
+            self.buf[self.n_buf] = (t_ns, MOD_ID[mod], EVT_ID[evt], p)
+            self.n_buf += 1
+            if self.n_buf == self.buf_records or \
+              EVT_ID[evt] in BOUNDARY_EVTS:
+                self._write_buf()
+
+    # --------------------------------------------------
+
+    def flush(self):
+        with self.lock:
+            if self.f is not None: self._write_buf()
+
+# ======================================================
+
+_EVENT_LOG = None
+_lock = Lock()
+
+def get_event_log():
+    ''' returns the event log of the current process
+    '''
+    global _EVENT_LOG
+    with _lock:
+        if _EVENT_LOG is None or _EVENT_LOG.pid != getpid():
+            _EVENT_LOG = EventLog()
+    return _EVENT_LOG
+
+# --------------------------------------------------
+
+def log_event(mod, evt, *payload):
+    get_event_log().log(mod, evt, *payload)
+
+# ======================================================
+
+class EventReader:
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as f:
+            if f.read(len(EVENT_MAGIC)) != EVENT_MAGIC:
+                raise ValueError("Not an events file: %s"%(file_path))
+        n = (path.getsize(file_path)-len(EVENT_MAGIC)) // EVENT_DTYPE.itemsize
+        if n > 0:
+            self.rec = np.memmap(file_path, dtype=EVENT_DTYPE, mode='r',
+                                 offset=len(EVENT_MAGIC), shape=(n,))
+        else:
+            self.rec = np.zeros(0, dtype=EVENT_DTYPE)
+        self.idx = np.zeros(0, dtype=INDEX_DTYPE)
+        fp = file_path + '.idx'
+        if path.isfile(fp):
+            with open(fp, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) == INDEX_MAGIC:
+                    data = f.read()
+                    m = len(data) // INDEX_DTYPE.itemsize
+                    self.idx = np.frombuffer(data[:m*INDEX_DTYPE.itemsize],
+                                             dtype=INDEX_DTYPE)
+        self.idx = self.idx[self.idx['rec'] < n]
+        self._sessions = self._spans('session_start', 'session_end', 0, n)
+
+    # --------------------------------------------------
+
+    def _spans(self, start_evt, end_evt, r1, r2):
+        ''' (start rec, end rec (exclusive)) of spans in records [r1, r2)
+        by the index. a span without its end (such as after a crash)
+        ends at the next start or r2
+        '''
+        i_s, i_e = EVT_ID[start_evt], EVT_ID[end_evt]
+        idx = self.idx[(self.idx['rec'] >= r1) & (self.idx['rec'] < r2)]
+        spans = []
+        for k in range(len(idx)):
+            if idx['evt'][k] != i_s: continue
+            end = r2
+            for j in range(k+1, len(idx)):
+                if idx['evt'][j] == i_e: end = int(idx['rec'][j])+1; break
+                if idx['evt'][j] == i_s: end = int(idx['rec'][j]); break
+            spans.append((int(idx['rec'][k]), end))
+        return spans
+
+    # --------------------------------------------------
+
+    def sessions(self):
+        ''' list of (start rec, end rec, wall-clock time at the start)
+        '''
+        return [(r1, r2, float(self.rec['payload'][r1][0]))
+                for r1, r2 in self._sessions]
+
+    # --------------------------------------------------
+
+    def trials(self, session):
+        ''' list of (start rec, end rec) of trials in a session (index)
+        '''
+        r1, r2 = self._sessions[session]
+        return self._spans('trial_start', 'trial_end', r1, r2)
+
+    # --------------------------------------------------
+
+    def session_records(self, session):
+        r1, r2 = self._sessions[session]
+        return self.rec[r1:r2]
+
+    # --------------------------------------------------
+
+    def time_range(self, t1_ns, t2_ns, session=None):
+        ''' records with t_ns in [t1_ns, t2_ns]; binary search in
+        each session (monotonic time doesn't continue over sessions
+        after a restart of the computer)
+        '''
+        if session is None: spans = self._sessions
+        else: spans = [self._sessions[session]]
+        if len(spans) == 0: spans = [(0, len(self.rec))]
+        out = []
+        for r1, r2 in spans:
+            t = self.rec['t_ns'][r1:r2]
+            a = np.searchsorted(t, t1_ns, 'left')
+            b = np.searchsorted(t, t2_ns, 'right')
+            if b > a: out.append(np.asarray(self.rec[r1+a:r1+b]))
+        if len(out) == 0: return np.zeros(0, dtype=EVENT_DTYPE)
+        return np.concatenate(out)
+
+    # --------------------------------------------------
+
+    def events(self, evt, mod=None, session=None):
+        ''' records of an event type (name); of 'mod', in 'session'
+        '''
+        if session is None: recs = self.rec
+        else: recs = self.session_records(session)
+        m = recs['evt'] == EVT_ID[evt]
+        if mod is not None: m &= recs['mod'] == MOD_ID[mod]
+        return np.asarray(recs[m])
+
+# ======================================================
+
+def summarize(file_path):
+    er = EventReader(file_path)
+    print("%s: %i records, %i sessions"%(file_path, len(er.rec),
+                                         len(er.sessions())))
+    for i, (r1, r2, wall) in enumerate(er.sessions()):
+        t = er.rec['t_ns']
+        dur = (t[r2-1]-t[r1])/1e9 if r2 > r1 else 0
+        trials = er.trials(i)
+        n_touch = len(er.events('stim_touched', session=i))
+        print("  session %i: %s, %.1f sec, %i records, %i trials,"\
+              " %i stimulus touches"%(i, np.datetime64(int(wall), 's'),
+                                      dur, r2-r1, len(trials), n_touch))
+
+# --------------------------------------------------
+
+def self_check():
+    ''' write two sessions and read them back
+    '''
+    import tempfile, shutil
+    tmp_dir = tempfile.mkdtemp()
+    fp = path.join(tmp_dir, '2016_01_01_events.bin')
+    el = EventLog(buf_records=16)
+    for s in range(2):
+        el.start_session(fp) # (the second session is appended)
+        for k in range(5):
+            el.log('session_mngr', 'trial_init')
+            el.log('session_mngr', 'trial_start')
+            for i in range(40): el.log('videoIn', 'close_to_screen', i % 3)
+            el.log('videoOut', 'touch', 100, 200, 1)
+            el.log('videoOut', 'stim_touched', k+1)
+            el.log('session_mngr', 'trial_end')
+            el.log('arduino', 'feed', k+1)
+        el.log('catos', 'note')
+        el.end_session()
+    ### a crash in the third session (no end, a cut-off record)
+    el.start_session(fp)
+    el.log('session_mngr', 'trial_start')
+    el.flush()
+    with open(fp, 'ab') as f: f.write(b'\x00'*5)
+    er = EventReader(fp)
+    assert len(er.sessions()) == 3, er.sessions()
+    assert len(er.trials(0)) == 5 and len(er.trials(1)) == 5
+    assert len(er.trials(2)) == 1
+    assert len(er.events('stim_touched')) == 10
+    assert list(er.events('feed', session=1)['payload'][:,0]) == [1,2,3,4,5]
+    r1, r2 = er.trials(1)[2]
+    assert er.rec['evt'][r1] == EVT_ID['trial_start']
+    assert er.rec['evt'][r2-1] == EVT_ID['trial_end']
+    t = er.rec['t_ns']
+    rng = er.time_range(t[r1], t[r2-1])
+    assert len(rng) == r2-r1 and (rng['t_ns'] == t[r1:r2]).all()
+    assert abs(er.sessions()[0][2] - time()) < 60
+    ### appending after the crash
+    el.start_session(fp)
+    el.end_session()
+    assert len(EventReader(fp).sessions()) == 4
+    ### a cut-off index entry (and an entry of a lost record)
+    with open(fp + '.idx', 'ab') as f:
+        idx = np.zeros(1, dtype=INDEX_DTYPE)
+        idx['evt'] = EVT_ID['trial_start']
+        idx['rec'] = 10**6
+        f.write(idx.tobytes() + b'\x00'*3)
+    el.start_session(fp)
+    el.end_session()
+    er = EventReader(fp)
+    assert len(er.sessions()) == 5, er.sessions()
+    assert er.rec['evt'][er.sessions()[4][0]] == EVT_ID['session_start']
+    assert (path.getsize(fp + '.idx') - len(INDEX_MAGIC)) % \
+      INDEX_DTYPE.itemsize == 0
+    summarize(fp)
+    shutil.rmtree(tmp_dir)
+    print("EventLog self check passed.")
+
+# ======================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2: self_check()
+    for fp in sys.argv[1:]: summarize(fp)
@@ -0,0 +1,281 @@
+# coding: UTF-8
+
+"""
+This is for drawing floating objects (FO) of VideoOut
+into a persistent off-screen bitmap.
+
+Only the union of the previous and the current bounds of objects
+is cleared and redrawn on each frame, and only that rect needs
+to be refreshed on the screen. Pens and brushes are created once
+and reused; outline colors are picked from a fixed random palette.
+
+Each distinct circle (radius, fill color, outline color of the palette)
+is rendered once into a bitmap with alpha (sprite), and drawn with
+DrawBitmap afterwards. Sprites are kept in an LRU cache of bounded size.
+"""
+
+from random import randint
+from time import perf_counter
+from collections import OrderedDict
+
+import wx
+import numpy as np
+
+# ======================================================
+
+class FORenderer:
+    def __init__(self, size, bgCol, n_pens=64, pen_width=2, 
+                 use_sprites=True, max_sprites=1024):
+        ''' size: size of the drawing area (width, height)
+        bgCol: background color
+        n_pens: number of random outline colors in the palette
+        use_sprites: draw circles with cached bitmaps (False: DrawCircle)
+        max_sprites: max. number of sprites in the cache
+        '''
+        self.size = (int(size[0]), int(size[1]))
+        self.buffer_ = wx.Bitmap(self.size[0], self.size[1])
+        self.bg_brush = wx.Brush(bgCol)
+        self.pen_width = pen_width
+        self.pens = []
+        self.pen_cols = [] # (r,g,b) of pens
+        for i in range(n_pens):
+            col = (randint(0,255), randint(0,255), randint(0,255))
+            self.pen_cols.append(col)
+            self.pens.append(wx.Pen(wx.Colour(*col), pen_width))
+        self.brushes = {} # key: fill color, value: wx.Brush
+        self.use_sprites = use_sprites
+        self.max_sprites = max_sprites
+        self.sprites = OrderedDict() # key: (radius, fill color, pen index), 
+          # value: (wx.Bitmap, half size). the least recently used first.
+        self.sprite_stats = dict(hits=0, misses=0, evicted=0)
+        self.prev_bounds = None # rect of objects drawn on the previous frame
+        self.clear()
+
+    # --------------------------------------------------
+
+    def brush(self, col):
+        ''' col: color string or (r,g,b) tuple
+        '''
+        if col not in self.brushes:
+            if isinstance(col, tuple): self.brushes[col] = wx.Brush(wx.Colour(*col))
+            else: self.brushes[col] = wx.Brush(col)
+        return self.brushes[col]
+
+    # --------------------------------------------------
+
+    def sprite(self, rad, col, pen_i):
+        ''' returns a bitmap of a circle with alpha and its half size
+        rad: radius, col: (r,g,b) fill color, pen_i: index of outline color
+        '''
+        key = (rad, col, pen_i)
+        spr = self.sprites.get(key)
+        if spr is not None:
+            self.sprites.move_to_end(key)
+            self.sprite_stats['hits'] += 1
+            return spr
+        self.sprite_stats['misses'] += 1
+        ### render the circle with NumPy (anti-aliased coverage)
+        w2 = self.pen_width/2.0 # outline is centered on the radius
+        half = int(np.ceil(rad + w2)) + 1
+        yy, xx = np.mgrid[-half:half+1, -half:half+1]
+        d = np.sqrt(xx*xx + yy*yy)
+        outer = np.clip(rad + w2 + 0.5 - d, 0.0, 1.0) # coverage of circle
+        inner = np.clip(rad - w2 + 0.5 - d, 0.0, 1.0)[:,:,None] # fill
+        rgb = inner * np.array(col) + (1.0-inner) * np.array(self.pen_cols[pen_i])
+        img = wx.Image(2*half+1, 2*half+1)
+        img.SetData(np.ascontiguousarray(rgb, dtype=np.uint8).tobytes())
+        img.SetAlpha(np.ascontiguousarray(outer*255, dtype=np.uint8).tobytes())
+        spr = (wx.Bitmap(img), half)
+        self.sprites[key] = spr
+        if len(self.sprites) > self.max_sprites:
+            self.sprites.popitem(last=False)
+            self.sprite_stats['evicted'] += 1
+        return spr
+
+    # --------------------------------------------------
+
+    def clear(self):
+        ''' clear the whole buffer. returns the rect to refresh
+        '''
+        mdc = wx.MemoryDC(self.buffer_)
+        mdc.SetBackground(self.bg_brush)
+        mdc.Clear()
+        mdc.SelectObject(wx.NullBitmap)
+        self.prev_bounds = None
+        return wx.Rect(0, 0, self.size[0], self.size[1])
+
+    # --------------------------------------------------
+
+    def bounds(self, pos, rad):
+        ''' rect bounding all circles (including outlines)
+        '''
+        if len(pos) == 0: return None
+        pos = np.asarray(pos).reshape(-1, 2)
+        rad = np.asarray(rad)
+        m = self.pen_width + 1
+        x1, y1 = (pos - rad[:,None]).min(axis=0) - m
+        x2, y2 = (pos + rad[:,None]).max(axis=0) + m
+        return wx.Rect(int(x1), int(y1), int(x2-x1)+1, int(y2-y1)+1)
+
+    # --------------------------------------------------
+
+    def dirty_rect(self, rect):
+        ''' union of 'rect' and the previous bounds, clipped to the buffer
+        '''
+        if self.prev_bounds is not None:
+            if rect is None: rect = wx.Rect(self.prev_bounds)
+            else: rect = rect.Union(self.prev_bounds)
+        if rect is None: return None
+        return rect.Intersect(wx.Rect(0, 0, self.size[0], self.size[1]))
+
+    # --------------------------------------------------
+
+    def draw_fo(self, pos, rad, col):
+        ''' draw circles; pos: (n, 2) array of (x,y), rad: (n,) radii,
+        col: (n, 3) array of RGB fill colors.
+        returns the rect to refresh (or None)
+        '''
+        new_bounds = self.bounds(pos, rad)
+        dirty = self.dirty_rect(new_bounds)
+        self.prev_bounds = new_bounds
+        if dirty is None or dirty.IsEmpty(): return None
+        mdc = wx.MemoryDC(self.buffer_)
+        mdc.SetClippingRegion(dirty)
+        mdc.SetPen(wx.TRANSPARENT_PEN)
+        mdc.SetBrush(self.bg_brush)
+        mdc.DrawRectangle(dirty)
+        n_pens = len(self.pens)
+        pos = np.asarray(pos).reshape(-1, 2).tolist()
+        rad = np.asarray(rad).tolist()
+        col = [tuple(c) for c in np.asarray(col).reshape(-1, 3).tolist()]
+        if self.use_sprites:
+            for i in range(len(pos)):
+                bmp, half = self.sprite(int(rad[i]), col[i], randint(0, n_pens-1))
+                mdc.DrawBitmap(bmp, int(pos[i][0])-half, int(pos[i][1])-half, True)
+        else:
+            for i in range(len(pos)):
+                mdc.SetPen(self.pens[randint(0, n_pens-1)])
+                mdc.SetBrush(self.brush(col[i]))
+                mdc.DrawCircle(int(pos[i][0]), int(pos[i][1]), int(rad[i]))
+        mdc.DestroyClippingRegion()
+        mdc.SelectObject(wx.NullBitmap)
+        return dirty
+
+    # --------------------------------------------------
+
+    def draw_rect(self, rect, penCol=wx.BLACK, brushCol='#333333'):
+        ''' draw a rectangle (static image). returns the rect to refresh
+        '''
+        self.clear()
+        mdc = wx.MemoryDC(self.buffer_)
+        mdc.SetPen(wx.Pen(penCol, 1))
+        mdc.SetBrush(self.brush(brushCol))
+        mdc.DrawRectangle(*rect)
+        mdc.SelectObject(wx.NullBitmap)
+        return wx.Rect(0, 0, self.size[0], self.size[1])
+
+    # --------------------------------------------------
+
+    def blit(self, dc, region=None):
+        ''' copy the buffer to 'dc' (only rects in 'region', if given)
+        '''
+        mdc = wx.MemoryDC(self.buffer_)
+        if region is None:
+            dc.Blit(0, 0, self.size[0], self.size[1], mdc, 0, 0)
+        else:
+            it = wx.RegionIterator(region)
+            while it.HaveRects():
+                r = it.GetRect()
+                dc.Blit(r.x, r.y, r.width, r.height, mdc, r.x, r.y)
+                it.Next()
+        mdc.SelectObject(wx.NullBitmap)
+
+# ======================================================
+
+def bench(n_objs=[5, 50, 500], size=(5760, 1040), n_frames=120):
+    ''' paint time per frame; full clear with new pens/brushes (previous
+    VideoOut.onPaint) vs. FORenderer (dirty rect, cached pens/brushes)
+    '''
+    app = wx.App(False)
+    screen = wx.Bitmap(size[0], size[1]) # stands for the window
+    for n in n_objs:
+        ### a group of objects, moving together
+        gx = size[0]/2; gy = size[1]/2
+        offs = [(randint(-150,150), randint(-150,150)) for i in range(n)]
+        rad = [randint(15, 25) for i in range(n)]
+        col = [(204,204,204)]*n
+        def _pos(f):
+            return [(gx+(f*8)%800-400+o[0], gy+o[1]) for o in offs]
+
+        dc = wx.MemoryDC(screen)
+        t0 = perf_counter()
+        for f in range(n_frames):
+            dc.SetBackground(wx.Brush('#777777'))
+            dc.Clear()
+            pos = _pos(f)
+            for i in range(n):
+                dc.SetPen(wx.Pen(wx.Colour(randint(0,255), randint(0,255),
+                                           randint(0,255)), 2))
+                dc.SetBrush(wx.Brush(wx.Colour(*col[i])))
+                dc.DrawCircle(int(pos[i][0]), int(pos[i][1]), rad[i])
+        t_old = (perf_counter()-t0)/n_frames
+
+        t_new = []
+        for use_sprites in [False, True]:
+            rndr = FORenderer(size, '#777777', use_sprites=use_sprites)
+            t0 = perf_counter()
+            for f in range(n_frames):
+                dirty = rndr.draw_fo(_pos(f), rad, col)
+                if dirty is not None: rndr.blit(dc, wx.Region(dirty))
+            t_new.append((perf_counter()-t0)/n_frames)
+        dc.SelectObject(wx.NullBitmap)
+        print("%4i objects: full repaint %.2f ms/frame, FORenderer"\
+              " DrawCircle %.2f ms/frame, sprites %.2f ms/frame"%(n, 
+                t_old*1000, t_new[0]*1000, t_new[1]*1000))
+    app.Destroy()
+
+# ------------------------------------------------------
+
+def bench_scatter(n_objs=[1, 5, 50], size=(5760, 1040), n_bursts=20):
+    ''' frame time during the scatter burst of VideoOut.onMouseDown
+    (each object breaks into 10 pieces flying away for 15 frames);
+    DrawCircle vs. sprites (the cache starts empty on the first burst)
+    '''
+    from modules.fo_store import FOStore, linear_tracks
+    app = wx.App(False)
+    screen = wx.Bitmap(size[0], size[1])
+    for n in n_objs:
+        res = []
+        for use_sprites in [False, True]:
+            rndr = FORenderer(size, '#777777', use_sprites=use_sprites)
+            dc = wx.MemoryDC(screen)
+            ft = []
+            for b in range(n_bursts):
+                fs = FOStore()
+                gctr = np.array((size[0]//2, size[1]//2))
+                fs.init(gctr + np.random.randint(-100, 101, (n,2)),
+                        np.random.randint(15, 26, n), [(204,204,204)]*n)
+                fs.scatter(10, 7)
+                sign = np.sign(fs.pos - gctr)
+                dest = fs.pos + sign * np.random.randint(1, 501, fs.pos.shape)
+                fs.set_tracks(linear_tracks(fs.pos, dest, 15))
+                for f in range(15):
+                    t0 = perf_counter()
+                    dirty = rndr.draw_fo(fs.pos, fs.rad, fs.col)
+                    if dirty is not None: rndr.blit(dc, wx.Region(dirty))
+                    ft.append(perf_counter()-t0)
+                    fs.advance()
+            dc.SelectObject(wx.NullBitmap)
+            res.append((np.mean(ft)*1000, np.max(ft)*1000, 
+                        np.mean(ft[:15])*1000))
+        print("%3i objects (%4i pieces): DrawCircle mean %.2f, max %.2f ms;"\
+              " sprites mean %.2f, max %.2f, first burst %.2f ms (%s)"%(n, 
+                n*10, res[0][0], res[0][1], res[1][0], res[1][1], res[1][2],
+                str(rndr.sprite_stats)))
+    app.Destroy()
+
+# ======================================================
+
+if __name__ == '__main__':
+    bench()
+    bench_scatter()
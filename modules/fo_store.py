@@ -0,0 +1,173 @@
+# coding: UTF-8
+
+"""
+This is the storage of floating objects (FO) of VideoOut
+as NumPy arrays (one array per property, one row per object).
+
+Each object has a track (array of points to move along) and a cursor
+into it; advancing moves cursors instead of popping list items.
+Radius changes and track advance are done for all objects at once.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+# ======================================================
+
+class FOStore:
+    def __init__(self):
+        self.init(np.zeros((0,2)), np.zeros(0), np.zeros((0,3)))
+
+    # --------------------------------------------------
+
+    def init(self, pos, rad, col):
+        ''' pos: (n, 2) positions, rad: (n,) radii, col: (n, 3) RGB fill colors
+        '''
+        self.pos = np.array(pos, dtype=np.int32).reshape(-1, 2)
+        self.n = len(self.pos)
+        self.rad = np.array(rad, dtype=np.int32).reshape(self.n)
+        self.rad_chg = np.zeros(self.n, dtype=np.int32) # change of radius on
+          # each drawing (-1, 0 or 1)
+        self.col = np.array(col, dtype=np.uint8).reshape(self.n, 3)
+        self.tracks = self.pos[:,None,:].copy() # (n, length, 2)
+        self.track_len = np.ones(self.n, dtype=np.int32)
+        self.cursor = np.zeros(self.n, dtype=np.int32) # index of the current
+          # point in each track
+
+    # --------------------------------------------------
+
+    def remaining(self):
+        ''' number of track points left after the current one
+        '''
+        return self.track_len - 1 - self.cursor
+
+    # --------------------------------------------------
+
+    def set_tracks(self, tracks, idx=None):
+        ''' set new tracks; (len(idx) or n, length, 2) array.
+        idx: indices of objects to set (None: all objects)
+        '''
+        tracks = np.asarray(tracks, dtype=np.int32)
+        if idx is None:
+            self.tracks = tracks.copy()
+            self.track_len = np.full(self.n, tracks.shape[1], dtype=np.int32)
+            self.cursor[:] = 0
+        else:
+            idx = np.asarray(idx)
+            L = tracks.shape[1]
+            if L > self.tracks.shape[1]:
+            # extend the track array (pad with the last point of each track)
+                _t = np.empty((self.n, L, 2), dtype=np.int32)
+                _t[:,:self.tracks.shape[1]] = self.tracks
+                _t[:,self.tracks.shape[1]:] = self.tracks[:,-1:]
+                self.tracks = _t
+            self.tracks[idx,:L] = tracks
+            self.tracks[idx,L:] = tracks[:,-1:]
+            self.track_len[idx] = L
+            self.cursor[idx] = 0
+        self.pos = self.tracks[np.arange(self.n), self.cursor]
+
+    # --------------------------------------------------
+
+    def advance(self, k=1):
+        ''' move each object 'k' points along its track
+        (stays at the last point, when the track ran out)
+        '''
+        np.minimum(self.cursor+k, self.track_len-1, out=self.cursor)
+        self.pos = self.tracks[np.arange(self.n), self.cursor]
+
+    # --------------------------------------------------
+
+    def step_rad(self, chance, min_rad, max_rad, rs=np.random):
+        ''' random radius change of each object
+        chance: chance for a resting object to start changing its radius
+        '''
+        rest = self.rad_chg == 0
+        start = rest & (rs.random_sample(self.n) < chance)
+        sign = np.where(rs.random_sample(self.n) > 0.5, 1, -1)
+        moving = ~rest
+        self.rad[moving] += self.rad_chg[moving]
+        self.rad_chg[start] = sign[start]
+        out = (self.rad < min_rad) | (self.rad > max_rad)
+        np.clip(self.rad, int(min_rad), int(max_rad), out=self.rad)
+        self.rad_chg[out] = 0
+
+    # --------------------------------------------------
+
+    def scatter(self, k, max_rad, spread=10, rs=np.random):
+        ''' replace each object with 'k' small pieces around it
+        max_rad: maximum radius of pieces
+        '''
+        pos = np.repeat(self.pos, k, axis=0)
+        pos += rs.randint(-spread, spread+1, pos.shape)
+        rad = rs.randint(1, max(1, int(max_rad))+1, len(pos))
+        col = np.repeat(self.col, k, axis=0)
+        self.init(pos, rad, col)
+
+    # --------------------------------------------------
+
+    def bounds(self):
+        ''' (min x, min y, max x, max y) of object positions
+        '''
+        if self.n == 0: return (-1,-1,-1,-1)
+        mn = self.pos.min(axis=0); mx = self.pos.max(axis=0)
+        return (int(mn[0]), int(mn[1]), int(mx[0]), int(mx[1]))
+
+# ======================================================
+
+def linear_tracks(orig, dest, steps):
+    ''' straight tracks from 'orig' to 'dest' with 'steps' points,
+    (n, steps, 2). the step size is truncated to an integer,
+    so a track may end slightly short of its destination.
+    '''
+    orig = np.asarray(orig).reshape(-1, 2)
+    dest = np.asarray(dest).reshape(-1, 2)
+    d = dest - orig
+    step = (np.abs(d) // steps) * np.sign(d)
+    j = np.arange(steps)
+    return orig[:,None,:] + step[:,None,:] * j[None,:,None]
+
+# ======================================================
+
+def bench(n_objs=[5, 50, 500, 5000], track_len=600, n_ticks=300):
+    ''' cost of a timer tick (track advance & radius change)
+    with a list of dicts (previous VideoOut.fo) and with FOStore
+    '''
+    from random import uniform, randint
+    for n in n_objs:
+        ### previous: list of dicts with list of track points
+        fo = []
+        for i in range(n):
+            track = [(randint(0,5000), randint(0,1000)) for j in range(track_len)]
+            fo.append(dict(track=track, rad=20, rad_change=0, col='#CCCCCC'))
+        t0 = perf_counter()
+        for t in range(n_ticks):
+            for i in range(n):
+                if len(fo[i]['track']) > 1: fo[i]['track'].pop(0)
+                if fo[i]['rad_change'] == 0:
+                    if uniform(0,1) < 0.3:
+                        if uniform(0,1) > 0.5: fo[i]['rad_change'] = 1
+                        else: fo[i]['rad_change'] = -1
+                else:
+                    fo[i]['rad'] += fo[i]['rad_change']
+                    if fo[i]['rad'] < 15:
+                        fo[i]['rad'] = 15; fo[i]['rad_change'] = 0
+                    elif fo[i]['rad'] > 25:
+                        fo[i]['rad'] = 25; fo[i]['rad_change'] = 0
+        t_old = (perf_counter()-t0)/n_ticks
+        ### FOStore
+        fs = FOStore()
+        fs.init(np.zeros((n,2)), np.full(n, 20), np.full((n,3), 204))
+        fs.set_tracks(np.random.randint(0, 1000, (n, track_len, 2)))
+        t0 = perf_counter()
+        for t in range(n_ticks):
+            fs.advance()
+            fs.step_rad(0.3, 15, 25)
+        t_new = (perf_counter()-t0)/n_ticks
+        print("%5i objects: list of dicts %.3f ms/tick, FOStore %.3f ms/tick"%(
+                n, t_old*1000, t_new*1000))
+
+# ======================================================
+
+if __name__ == '__main__': bench()
@@ -0,0 +1,106 @@
+# coding: UTF-8
+
+"""
+This is a fixed-capacity ring buffer of camera frames for CATOS.
+
+All frames live in one preallocated (N, H, W, 3) uint8 array,
+so reading a new frame does not allocate anything and
+older frames can be handed out as views without copying.
+"""
+
+import numpy as np
+
+# ======================================================
+
+class FrameRing:
+    def __init__(self, n, fSize, buf=None):
+        ''' n: number of frames to keep
+        fSize: frame size (width, height)
+        buf: optional buffer (such as shared memory) to build the array on
+        '''
+        self.n = n
+        shape = (n, fSize[1], fSize[0], 3)
+        if buf is None: self.frames = np.zeros(shape, dtype=np.uint8)
+        else: self.frames = np.ndarray(shape, dtype=np.uint8, buffer=buf)
+        self.m = np.zeros(n, dtype=np.bool_) # meaningful movement flags
+        self.ts = np.zeros(n, dtype=np.float64) # time of each frame
+        self.seq = 0 # number of frames pushed so far; the next frame
+          # goes to slot (seq % n)
+
+    # --------------------------------------------------
+
+    def next_slot(self):
+        ''' returns the array view, where the next frame should be read into
+        '''
+        return self.frames[self.seq % self.n]
+
+    # --------------------------------------------------
+
+    def read(self, cap_cam):
+        ''' read a frame from a cv2.VideoCapture directly into the next slot.
+        returns the result of the read and the slot (view)
+        '''
+        slot = self.next_slot()
+        ret, img = cap_cam.read(image=slot)
+        if ret == False: return False, slot
+        if img is not slot and not np.shares_memory(img, slot):
+        # backend returned a new array (e.g. different size)
+            slot[:] = img
+        return True, slot
+
+    # --------------------------------------------------
+
+    def push(self, ts=0.0, m=False):
+        ''' commit the frame in the next slot, after it's filled
+        '''
+        i = self.seq % self.n
+        self.ts[i] = ts
+        self.m[i] = m
+        self.seq += 1
+        return i
+
+    # --------------------------------------------------
+
+    def set_m(self, m, k=1):
+        ''' set movement flag of the k-th last frame
+        '''
+        self.m[(self.seq-k) % self.n] = m
+
+    # --------------------------------------------------
+
+    def count(self):
+        return min(self.seq, self.n)
+
+    # --------------------------------------------------
+
+    def idx_last(self, k):
+        ''' slot indices of the last k frames, oldest first
+        '''
+        k = min(k, self.count())
+        return (np.arange(self.seq-k, self.seq)) % self.n
+
+    # --------------------------------------------------
+
+    def last(self, k):
+        ''' list of views of the last k frames, oldest first (no copying)
+        '''
+        return [self.frames[i] for i in self.idx_last(k)]
+
+    # --------------------------------------------------
+
+    def last_m(self, k):
+        ''' movement flags of the last k frames, oldest first
+        '''
+        return self.m[self.idx_last(k)]
+
+    # --------------------------------------------------
+
+    def get(self, seq, margin=0):
+        ''' view of the frame with the sequence number 'seq'.
+        None, if it was already overwritten
+          (or would be overwritten within 'margin' frames)
+        '''
+        if seq >= self.seq or seq < self.seq - self.n + margin: return None
+        return self.frames[seq % self.n]
+
+# ======================================================
@@ -0,0 +1,146 @@
+# coding: UTF-8
+
+"""
+This is for pacing the animation of VideoOut by elapsed time
+instead of by the number of timer events.
+
+The wx timer may fire late or coalesce events under load. On each timer
+event, FramePacer.tick returns how many animation steps (1/rate sec each)
+are due since the start, so objects keep their speed in pixels per
+second; frames which couldn't be shown are skipped, not delayed.
+Intervals between ticks are counted in a histogram (jitter).
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+# ======================================================
+
+class FramePacer:
+    def __init__(self, rate=60, clock=perf_counter, max_steps=30,
+                 hist_edges_ms=[0,2,4,6,8,10,12,14,16,18,20,25,30,40,50,
+                                75,100,200]):
+        ''' rate: animation steps per second
+        clock: function returning monotonic time in seconds
+        max_steps: max. steps returned by one tick; after a longer stall,
+          the animation continues from there instead of jumping further
+        hist_edges_ms: edges of histogram bins of tick intervals (ms)
+        '''
+        self.rate = rate
+        self.clock = clock
+        self.max_steps = max_steps
+        self.hist_edges_ms = np.array(hist_edges_ms, dtype=np.float64)
+        self.hist = np.zeros(len(hist_edges_ms), dtype=np.int64) # the last
+          # bin counts intervals longer than the last edge
+        self.start()
+
+    # --------------------------------------------------
+
+    def start(self):
+        self.t0 = self.clock()
+        self.last_t = self.t0
+        self.n_steps = 0 # steps returned since start
+        self.n_ticks = 0
+        self.n_skipped = 0 # steps which were not shown on its own frame
+        self.n_dropped = 0 # steps dropped after stalls (max_steps)
+
+    # --------------------------------------------------
+
+    def tick(self):
+        ''' returns the number of steps to advance now (0 or more)
+        '''
+        t = self.clock()
+        itv_ms = (t - self.last_t) * 1000
+        self.last_t = t
+        self.n_ticks += 1
+        bi = np.searchsorted(self.hist_edges_ms, itv_ms, side='right') - 1
+        self.hist[max(0, bi)] += 1
+        due = int((t - self.t0) * self.rate)
+        k = due - self.n_steps
+        if k > self.max_steps:
+            self.n_dropped += k - self.max_steps
+            k = self.max_steps
+            self.n_steps = due
+        else:
+            self.n_steps += k
+        if k > 1: self.n_skipped += k - 1
+        return k
+
+    # --------------------------------------------------
+
+    def percentile_ms(self, q):
+        ''' approximate percentile of tick intervals (upper bin edge)
+        '''
+        n = self.hist.sum()
+        if n == 0: return 0.0
+        bi = np.searchsorted(np.cumsum(self.hist), n * q / 100.0)
+        if bi+1 < len(self.hist_edges_ms): return self.hist_edges_ms[bi+1]
+        return float('inf')
+
+    # --------------------------------------------------
+
+    def stat_str(self):
+        el = self.last_t - self.t0
+        return "ticks: %i (%.1f/sec), steps: %i, skipped: %i, dropped: %i,"\
+               " interval p50 <= %.0f ms, p95 <= %.0f ms, p99 <= %.0f ms,"\
+               " histogram %s"%(self.n_ticks, self.n_ticks/el if el > 0 else 0,
+                                self.n_steps, self.n_skipped, self.n_dropped,
+                                self.percentile_ms(50), self.percentile_ms(95),
+                                self.percentile_ms(99), str(self.hist.tolist()))
+
+# ======================================================
+
+class FakeClock:
+    ''' clock for checking FramePacer without waiting
+    '''
+    def __init__(self, t=0.0): self.t = t
+    def __call__(self): return self.t
+    def sleep(self, sec): self.t += sec
+
+# ------------------------------------------------------
+
+def self_check():
+    ''' drive FramePacer with a fake clock (no wx, no display)
+    '''
+    rate = 60
+    ### regular ticks at the rate; one step each
+    clk = FakeClock()
+    fp = FramePacer(rate, clk)
+    steps = []
+    for i in range(600):
+        clk.sleep(1.0/rate + 1e-9)
+        steps.append(fp.tick())
+    assert sum(steps) == 600 and max(steps) == 1, steps
+    ### slow timer (every 25 ms); total steps still follow the time
+    clk = FakeClock()
+    fp = FramePacer(rate, clk)
+    total = 0
+    for i in range(400):
+        clk.sleep(0.025)
+        total += fp.tick()
+    assert total == int(clk.t*rate), total
+    assert fp.n_skipped > 0
+    ### jittery, coalesced ticks
+    rs = np.random.RandomState(0)
+    clk = FakeClock()
+    fp = FramePacer(rate, clk)
+    total = 0
+    for i in range(1000):
+        clk.sleep(rs.uniform(0.0, 0.04))
+        total += fp.tick()
+    assert total == int(clk.t*rate), (total, clk.t)
+    assert fp.hist.sum() == 1000
+    ### stall longer than max_steps
+    clk = FakeClock()
+    fp = FramePacer(rate, clk, max_steps=10)
+    clk.sleep(2.0)
+    assert fp.tick() == 10 and fp.n_dropped == 2*rate-10
+    clk.sleep(1.0/rate + 1e-9)
+    assert fp.tick() == 1 # continues normally after the stall
+    print("FramePacer self check passed.")
+    print(fp.stat_str())
+
+# ======================================================
+
+if __name__ == '__main__': self_check()
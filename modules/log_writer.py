@@ -0,0 +1,242 @@
+# coding: UTF-8
+
+"""
+This is for writing log lines of CATOS in a background thread.
+
+Callers (wx main thread, VideoIn threads, Arduino, ...) only push
+lines onto a queue. A single writer thread keeps one open handle
+per log file and flushes the buffered lines when enough bytes
+are pending or when 'flush_intv' seconds passed.
+A write error of a file (such as a full disk) is reported to stderr
+and only drops the handle of that file (it's reopened with the next
+line); if the writer thread is not running, lines are written directly.
+"""
+
+import sys, atexit
+from os import getpid
+from time import time, perf_counter
+from threading import Thread, Event, Lock
+from queue import Queue, Empty
+
+# ======================================================
+
+class LogWriter:
+    def __init__(self, flush_size=32768, flush_intv=0.5, idle_close=60):
+        self.flush_size = flush_size # flush when this many bytes are pending
+        self.flush_intv = flush_intv # max. seconds a line stays in buffer
+        self.idle_close = idle_close # close a file handle after this many
+          # seconds without writing (such as the log of the previous day)
+        self.pid = getpid() # process, which owns the writer thread
+        self.q = Queue() # queue of (file_path, txt) or (None, Event)
+        self.files = {} # key: file path, value: [file handle, last write time]
+        self.pending = 0 # bytes written to handles, but not flushed yet
+        self.last_flush_time = time()
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def write(self, file_path, txt):
+        ''' push a log line; this never blocks the caller
+        (unless the writer thread is not running)
+        '''
+        if not self.thrd.is_alive(): # write it directly
+            f = open(file_path, 'a')
+            f.write(txt)
+            f.close()
+            return
+        self.q.put((file_path, txt), False)
+
+    # --------------------------------------------------
+
+    def flush(self, timeout=5):
+        ''' block until all lines, pushed before this call, are on disk
+        '''
+        if not self.thrd.is_alive(): return
+        ev = Event()
+        self.q.put((None, ev), False)
+        ev.wait(timeout)
+
+    # --------------------------------------------------
+
+    def close(self, timeout=5):
+        ''' flush everything and stop the writer thread
+        '''
+        if not self.thrd.is_alive(): return
+        self.q.put((None, None), False)
+        self.thrd.join(timeout)
+
+    # --------------------------------------------------
+
+    def run(self):
+        while True:
+            if self.pending > 0: timeout = self.flush_intv
+            else: timeout = self.idle_close
+            try: item = self.q.get(True, timeout)
+            except Empty:
+                self.flush_files()
+                self.close_idle_files()
+                continue
+            ### process the item and whatever else is already waiting
+            while True:
+                file_path, txt = item
+                if file_path is None: # flush request or stop signal
+                    self.flush_files()
+                    if txt is None:
+                        self.close_files()
+                        return
+                    txt.set()
+                else:
+                    self.write_line(file_path, txt)
+                try: item = self.q.get(False)
+                except Empty: break
+            if self.pending >= self.flush_size or \
+              time()-self.last_flush_time >= self.flush_intv:
+                self.flush_files()
+
+    # --------------------------------------------------
+
+    def write_line(self, file_path, txt):
+        if file_path not in self.files:
+            try: f = open(file_path, 'a')
+            except OSError as e:
+                sys.stderr.write("[log_writer] %s\n"%(str(e)))
+                return
+            self.files[file_path] = [f, time()]
+        fi = self.files[file_path]
+        try: fi[0].write(txt)
+        except OSError as e:
+            self.drop_file(file_path, e)
+            return
+        fi[1] = time()
+        self.pending += len(txt)
+
+    # --------------------------------------------------
+
+    def drop_file(self, file_path, err):
+        ''' report a write error and drop the handle of 'file_path'
+        (its buffered lines are lost)
+        '''
+        sys.stderr.write("[log_writer] %s; lines to %s were dropped\n"%(
+                                                    str(err), file_path))
+        fi = self.files.pop(file_path, None)
+        if fi is None: return
+        try: fi[0].close()
+        except OSError: pass # (buffered lines can't be written)
+
+    # --------------------------------------------------
+
+    def flush_files(self):
+        for file_path in list(self.files.keys()):
+            try: self.files[file_path][0].flush()
+            except OSError as e: self.drop_file(file_path, e)
+        self.pending = 0
+        self.last_flush_time = time()
+
+    # --------------------------------------------------
+
+    def close_file(self, file_path):
+        try: self.files[file_path][0].close()
+        except OSError as e: self.drop_file(file_path, e)
+        else: self.files.pop(file_path)
+
+    # --------------------------------------------------
+
+    def close_idle_files(self):
+        ct = time()
+        for file_path in list(self.files.keys()):
+            if ct - self.files[file_path][1] >= self.idle_close:
+                self.close_file(file_path)
+
+    # --------------------------------------------------
+
+    def close_files(self):
+        for file_path in list(self.files.keys()): self.close_file(file_path)
+
+# ======================================================
+
+_LOG_WRITER = None
+_lock = Lock()
+
+def get_log_writer():
+    ''' returns the log writer of the current process
+    (a forked child process gets its own writer thread)
+    '''
+    global _LOG_WRITER
+    with _lock:
+        if _LOG_WRITER is None or _LOG_WRITER.pid != getpid():
+            _LOG_WRITER = LogWriter()
+            atexit.register(_LOG_WRITER.close)
+    return _LOG_WRITER
+
+# --------------------------------------------------
+
+def flush_log():
+    if _LOG_WRITER is not None and _LOG_WRITER.pid == getpid():
+        _LOG_WRITER.flush()
+
+# ======================================================
+
+def self_check():
+    ''' a write error of one file doesn't stop lines to other files
+    '''
+    import tempfile
+    from os import path
+    fp = path.join(tempfile.mkdtemp(), 'ok.log')
+    lw = LogWriter()
+    if path.exists('/dev/full'): # (ENOSPC on flush)
+        lw.write('/dev/full', "line to a full disk\n")
+        lw.flush()
+    lw.write(fp, "line 1\n")
+    lw.flush()
+    assert lw.thrd.is_alive()
+    assert open(fp).read() == "line 1\n"
+    lw.close()
+    lw.write(fp, "line 2\n") # written directly
+    assert open(fp).read() == "line 1\nline 2\n"
+    print("LogWriter self check passed.")
+
+# ======================================================
+
+def bench(n_lines=20000):
+    ''' compare the old open/append/close per line with LogWriter
+    '''
+    import tempfile
+    from os import path
+    line = "2015_07_01_10_11_12, [videoIn-0], close_to_screen, left.\n"
+    tmp_dir = tempfile.mkdtemp()
+
+    def _write_old(file_path, txt):
+        f = open(file_path, 'a')
+        f.write(txt)
+        f.close()
+
+    results = {}
+    lw = LogWriter()
+    for name, func in [('open/append/close', _write_old),
+                       ('LogWriter', lw.write)]:
+        fp = path.join(tmp_dir, "%s.log"%(name.replace('/', '_')))
+        lat = []
+        t0 = perf_counter()
+        for i in range(n_lines):
+            _t = perf_counter()
+            func(fp, line)
+            lat.append(perf_counter()-_t)
+        caller_t = perf_counter()-t0
+        if func == lw.write: lw.flush(None)
+        total_t = perf_counter()-t0
+        lat.sort()
+        results[name] = (n_lines/total_t,
+                         caller_t/n_lines*1e6,
+                         lat[int(n_lines*0.99)]*1e6)
+    lw.close()
+    print("%i lines"%(n_lines))
+    for name in results:
+        r = results[name]
+        print("%18s: %10.0f lines/sec, caller latency mean %.2f us, p99 %.2f us"%(name, r[0], r[1], r[2]))
+
+# ======================================================
+
+if __name__ == '__main__':
+    self_check()
+    bench()
@@ -11,6 +11,8 @@ import shlex, queue
 import wx
 import numpy as np
 
+from modules.log_writer import get_log_writer, flush_log
+
 # --------------------------------------------
 
 def GNU_notice(idx=0):
@@ -35,14 +37,21 @@ You can redistribute this program and/or modify it under the terms of the GNU Ge
 # --------------------------------------------
 
 def get_time_stamp(flag_ms=False):
-    ts = datetime.now()
-    ts = ('%.4i_%.2i_%.2i_%.2i_%.2i_%.2i')%(ts.year, ts.month, ts.day, ts.hour, ts.minute, ts.second)
-    if flag_ms == True: ts += '_%.6i'%(ts.microsecond)
+    dt = datetime.now()
+    ts = ('%.4i_%.2i_%.2i_%.2i_%.2i_%.2i')%(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+    if flag_ms == True: ts += '_%.6i'%(dt.microsecond)
     return ts
 
 # --------------------------------------------
 
 def writeFile(file_path, txt, mode='a'):
+    ''' appending goes through the background log writer
+    (see log_writer.py); other modes write directly
+    '''
+    if mode == 'a':
+        get_log_writer().write(file_path, txt)
+        return
+    flush_log() # lines queued before this call should come first
     f = open(file_path, mode)
     f.write(txt)
     f.close()
@@ -143,55 +152,104 @@ def calc_pt_line_dist(pt, line, flag_line_ends=True):
 
 # --------------------------------------------
 
-def make_b_curve_coord(orig, h1, h2, dest, num_of_track_pts=100, accel=False):
-    ''' returns a list of points to make a Bezier curve.
+def make_b_curves(orig, h1, h2, dest, n_pts=100, accel=False, ease=None):
+    ''' returns points of Bezier curves; (n, n_pts, 2) array.
+    orig, h1, h2, dest: (x,y) or (n, 2) arrays of start points, handles
+      and end points. (one point is shared by all curves)
+      h2 = None makes quadratic curves.
     accel = True ; point moves faster as it goes along the curve
+    ease: function mapping an array of t (0.0 <= t < 1.0) to progress
+      along the curve (0.0-1.0). (ignored when accel is True)
+    The arithmetic follows the step-wise construction of the previous
+    per-point loop in the same order, so cubic curves give the same
+    integer pixels; quadratic curves are returned as float.
     '''
     if accel == True:
-        track_idx = []
-        for i in xrange(num_of_track_pts): track_idx.append( int(1.1 ** i) )
-        num_of_track_pts = int( 1.1 ** (num_of_track_pts-1) )
-    else:
-        track_idx = range(num_of_track_pts)
-    p0p1X_step = (h1[0] - orig[0]) / float(num_of_track_pts)
-    p0p1Y_step = (h1[1] - orig[1]) / float(num_of_track_pts)
-    if h2 == None:
-        p1p2X_step = (dest[0] - h1[0]) / float(num_of_track_pts)
-        p1p2Y_step = (dest[1] - h1[1]) / float(num_of_track_pts)
+        idx = np.array([int(1.1 ** i) for i in range(n_pts)], dtype=np.float64)
+        div = float(int(1.1 ** (n_pts-1)))
+    elif ease != None:
+        idx = np.asarray(ease(np.arange(n_pts)/float(n_pts)), 
+                         dtype=np.float64) * n_pts
+        div = float(n_pts)
     else:
-        p1p2X_step = (h2[0] - h1[0]) / float(num_of_track_pts)
-        p1p2Y_step = (h2[1] - h1[1]) / float(num_of_track_pts)
-        p2p3X_step = (dest[0] - h2[0]) / float(num_of_track_pts)
-        p2p3Y_step = (dest[1] - h2[1]) / float(num_of_track_pts)
+        idx = np.arange(n_pts, dtype=np.float64)
+        div = float(n_pts)
+    i = idx[None,:,None] # (1, n_pts, 1)
+    _p = lambda p: np.asarray(p, dtype=np.float64).reshape(-1, 1, 2)
+    orig = _p(orig); h1 = _p(h1); dest = _p(dest)
+    p0p1 = orig + (h1 - orig) / div * i # q0
+    if h2 is None:
+        p1p2 = h1 + (dest - h1) / div * i # q1
+        q0q1 = p0p1 + (p1p2 - p0p1) / div * i # r0
+        n = max(len(orig), len(h1), len(dest))
+        if len(q0q1) < n: q0q1 = np.repeat(q0q1, n, axis=0)
+        return q0q1
+    h2 = _p(h2)
+    p1p2 = h1 + (h2 - h1) / div * i # q1
+    p2p3 = h2 + (dest - h2) / div * i # q2
+    q0q1 = p0p1 + (p1p2 - p0p1) / div * i # r0
+    q1q2 = p1p2 + (p2p3 - p1p2) / div * i # r1
+    r0r1 = q0q1 + (q1q2 - q0q1) / div * i
+    r0r1 = np.trunc(r0r1).astype(np.int32) # int() of the previous loop
+    n = max(len(orig), len(h1), len(h2), len(dest))
+    if len(r0r1) < n: r0r1 = np.repeat(r0r1, n, axis=0)
+    return r0r1
+
+# --------------------------------------------
+
+def make_b_curve_coord(orig, h1, h2, dest, num_of_track_pts=100, accel=False):
+    ''' returns a list of points to make a Bezier curve.
+    accel = True ; point moves faster as it goes along the curve
+    '''
+    track = make_b_curves(orig, h1, h2, dest, num_of_track_pts, accel)[0]
+    return [tuple(pt) for pt in track.tolist()]
+
+# --------------------------------------------
+
+def _b_curve_loop(orig, h1, h2, dest, num_of_track_pts=100):
+    ''' previous per-point implementation of make_b_curve_coord 
+    (cubic, without accel); reference for bench_b_curves
+    '''
+    n = float(num_of_track_pts)
+    p0p1X_step = (h1[0] - orig[0]) / n; p0p1Y_step = (h1[1] - orig[1]) / n
+    p1p2X_step = (h2[0] - h1[0]) / n; p1p2Y_step = (h2[1] - h1[1]) / n
+    p2p3X_step = (dest[0] - h2[0]) / n; p2p3Y_step = (dest[1] - h2[1]) / n
     track = []
-    for i in track_idx:
-        p0p1X = orig[0] + p0p1X_step * i # q0 x
-        p0p1Y = orig[1] + p0p1Y_step * i # q0 y
-        p1p2X = h1[0] + p1p2X_step * i # q1 x
-        p1p2Y = h1[1] + p1p2Y_step * i # q1 y
-        if h2 != None:
-            p2p3X = h2[0] + p2p3X_step * i # q2 x
-            p2p3Y = h2[1] + p2p3Y_step * i # q2 y
-        q0q1X_step = (p1p2X - p0p1X) / float(num_of_track_pts)
-        q0q1Y_step = (p1p2Y - p0p1Y) / float(num_of_track_pts)
-        if h2 != None:
-            q1q2X_step = (p2p3X - p1p2X) / float(num_of_track_pts)
-            q1q2Y_step = (p2p3Y - p1p2Y) / float(num_of_track_pts)
-        q0q1X = p0p1X + q0q1X_step * i # r0 x
-        q0q1Y = p0p1Y + q0q1Y_step * i # r0 y
-        if h2 == None:
-            track_pt = (q0q1X, q0q1Y)
-        else:
-            q1q2X = p1p2X + q1q2X_step * i # r1 x
-            q1q2Y = p1p2Y + q1q2Y_step * i # r1 y
-            r0r1X_step = (q1q2X - q0q1X) / float(num_of_track_pts)
-            r0r1Y_step = (q1q2Y - q0q1Y) / float(num_of_track_pts)
-            r0r1X = int(q0q1X + r0r1X_step * i)
-            r0r1Y = int(q0q1Y + r0r1Y_step * i)
-            track_pt = (r0r1X, r0r1Y)
-        track.append(track_pt)
+    for i in range(num_of_track_pts):
+        p0p1X = orig[0] + p0p1X_step * i; p0p1Y = orig[1] + p0p1Y_step * i
+        p1p2X = h1[0] + p1p2X_step * i; p1p2Y = h1[1] + p1p2Y_step * i
+        p2p3X = h2[0] + p2p3X_step * i; p2p3Y = h2[1] + p2p3Y_step * i
+        q0q1X = p0p1X + (p1p2X - p0p1X) / n * i
+        q0q1Y = p0p1Y + (p1p2Y - p0p1Y) / n * i
+        q1q2X = p1p2X + (p2p3X - p1p2X) / n * i
+        q1q2Y = p1p2Y + (p2p3Y - p1p2Y) / n * i
+        track.append((int(q0q1X + (q1q2X - q0q1X) / n * i), 
+                      int(q0q1Y + (q1q2Y - q0q1Y) / n * i)))
     return track
 
+# --------------------------------------------
+
+def bench_b_curves(n_curves=[1, 10, 100, 1000], n_pts=[60, 500, 2000]):
+    ''' time to make cubic Bezier curves with the per-point loop
+    and with make_b_curves (one call for all curves).
+    also checks that both give the same points.
+    '''
+    from time import perf_counter
+    for nc in n_curves:
+        for npt in n_pts:
+            pts = np.random.randint(0, 5000, (4, nc, 2))
+            t0 = perf_counter()
+            tl = [_b_curve_loop(*[tuple(p[k]) for p in pts], 
+                                num_of_track_pts=npt) for k in range(nc)]
+            t_loop = perf_counter()-t0
+            t0 = perf_counter()
+            tracks = make_b_curves(pts[0], pts[1], pts[2], pts[3], npt)
+            t_np = perf_counter()-t0
+            same = np.array_equal(np.array(tl), tracks)
+            print("%4i curves x %4i points: loop %8.2f ms, make_b_curves"\
+                  " %7.2f ms, same points: %s"%(nc, npt, t_loop*1000, 
+                                                t_np*1000, str(same)))
+
 # --------------------------------------------    
 
 def chk_resource_usage(program_log_path):
@@ -276,5 +334,4 @@ class PopupDialog(wx.Dialog):
 
 #====================================================
 
-
-
+if __name__ == '__main__': bench_b_curves()
@@ -0,0 +1,282 @@
+# coding: UTF-8
+
+"""
+This is the motion analysis pipeline of VideoIn
+(background model, noise reduction, edges and contours).
+
+The analysis can run on the bounding box of the ROI polygon only,
+optionally downscaled by a factor. Resulting rects are always
+given in full-frame coordinates.
+"""
+
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from modules.bg_model import make_bg_model
+
+# ======================================================
+
+class MotionDetector:
+    def __init__(self, fSize, bgm, roi_pts=None, scale=1.0,
+                 contour_threshold=20, contour_method='contours'):
+        ''' fSize: frame size (width, height)
+        bgm: background model (see bg_model.py)
+        roi_pts: points of ROI polygon. None = whole frame
+        scale: factor to resize the cropped image for analysis
+        contour_threshold: threshold (w+h of a bounding rect, in full-frame
+          pixels) for a contour to be counted
+        contour_method: 'contours' or 'cc' (see contour_rects);
+          with 'cc', the foreground mask is used without edge detection
+        '''
+        self.fSize = fSize
+        self.bgm = bgm
+        self.scale = scale
+        self.contour_threshold = contour_threshold
+        self.contour_method = contour_method
+        if roi_pts == None:
+            self.roi = (0, 0, fSize[0], fSize[1])
+        else:
+            x, y, w, h = cv2.boundingRect(np.array(roi_pts, dtype=np.int32))
+            x1 = min(max(0, x), fSize[0]); y1 = min(max(0, y), fSize[1])
+            x2 = min(max(0, x+w), fSize[0]); y2 = min(max(0, y+h), fSize[1])
+            self.roi = (x1, y1, x2-x1, y2-y1) # x, y, w, h
+        self.aSize = (max(1, int(self.roi[2]*scale)),
+                      max(1, int(self.roi[3]*scale))) # size of analysis image
+        if scale != 1.0:
+            self.a_buf = np.zeros((self.aSize[1], self.aSize[0], 3),
+                                  dtype=np.uint8) # buffer for resizing
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+        self.stage_t = None # dict to accumulate seconds spent in each stage
+          # (None: no timing)
+
+    # --------------------------------------------------
+
+    def prep(self, img):
+        ''' returns the image (view of 'img' or a resized buffer) to analyze
+        '''
+        x, y, w, h = self.roi
+        img = img[y:y+h, x:x+w]
+        if self.scale != 1.0:
+            cv2.resize(img, self.aSize, self.a_buf,
+                       interpolation=cv2.INTER_AREA)
+            img = self.a_buf
+        return img
+
+    # --------------------------------------------------
+
+    def init(self, img):
+        ''' initialize the background model with a full frame
+        '''
+        self.bgm.init(self.prep(img))
+
+    # --------------------------------------------------
+
+    def detect(self, img):
+        ''' returns the whole bounding rect of movements
+        and a list of bounding rects of each contour (full-frame coordinates)
+        '''
+        st = self.stage_t
+        if st != None: t0 = perf_counter()
+        a_img = self.prep(img)
+        ### extract subject image by obtaining difference image
+        ###   between the frame and the background model
+        diff = self.bgm.apply(a_img)
+        if st != None: t1 = perf_counter()
+        diff = cv2.morphologyEx(diff,
+                                cv2.MORPH_OPEN,
+                                self.kernel,
+                                iterations=1) # decrease noise and
+                                              # minor features
+        if self.contour_method != 'cc': # (components are labeled
+          # on the binary mask itself)
+            diff = cv2.Canny(diff, 150, 150)
+        if st != None: t2 = perf_counter()
+        brs = self.to_frame(contour_rects(diff, self.contour_method))
+        res = summarize_rects(brs, self.contour_threshold)
+        if st != None:
+            t3 = perf_counter()
+            for k, v in [('bg', t1-t0), ('morph_edge', t2-t1), 
+                         ('contours', t3-t2)]:
+                st[k] = st.get(k, 0.0) + v
+        return res
+
+    # --------------------------------------------------
+
+    def to_frame(self, brs):
+        ''' map (n, 4) rects in the analysis image to the full frame
+        '''
+        if self.scale != 1.0:
+            brs = brs / self.scale
+            brs[:,2:] = np.round(brs[:,2:])
+            brs = brs.astype(np.int32)
+        else:
+            brs = brs.copy()
+        brs[:,0] += self.roi[0]
+        brs[:,1] += self.roi[1]
+        return brs
+
+# ======================================================
+
+def contour_rects(inImage, method='contours'):
+    ''' returns bounding rects (x, y, w, h) of all blobs 
+    in a binary image as an (n, 4) array.
+    'contours': bounding rects of contours (cv2.findContours)
+    'cc': stats of connected components (no contours at all)
+    '''
+    if method == 'cc':
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(
+                                                        inImage, 
+                                                        connectivity=8
+                                                        )
+        return stats[1:, :4] # label 0 is the background
+    contours, hierarchy = cv2.findContours(inImage, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours) == 0: return np.zeros((0, 4), dtype=np.int32)
+    ### min/max of points of each contour in one go
+    pts = np.concatenate(contours).reshape(-1, 2)
+    lens = np.fromiter(map(len, contours), dtype=np.int64, count=len(contours))
+    starts = np.zeros(len(contours), dtype=np.int64)
+    np.cumsum(lens[:-1], out=starts[1:])
+    mn = np.minimum.reduceat(pts, starts, axis=0)
+    mx = np.maximum.reduceat(pts, starts, axis=0)
+    return np.hstack((mn, mx-mn+1)) # same as cv2.boundingRect
+
+# ======================================================
+
+def summarize_rects(brs, contour_threshold):
+    ''' returns the whole rect bounding all rects of which (w+h) is 
+    larger than contour_threshold, and the list of such rects
+    '''
+    brs = brs[brs[:,2]+brs[:,3] > contour_threshold]
+    if len(brs) == 0: return (-1,-1,0,0), []
+    x1 = brs[:,0].min(); y1 = brs[:,1].min()
+    x2 = (brs[:,0]+brs[:,2]).max(); y2 = (brs[:,1]+brs[:,3]).max()
+    wrect = (int(x1), int(y1), int(x2-x1), int(y2-y1))
+    return wrect, list(map(tuple, brs.tolist()))
+
+# ======================================================
+
+def chk_contours(inImage, contour_threshold, method='contours'):
+    ''' returns the whole rect (x, y, w, h) bounding all the blobs, 
+    and the list of rects bounding each blob. (-1,-1,0,0) when nothing 
+    is found. see contour_rects for 'method'.
+    '''
+    return summarize_rects(contour_rects(inImage, method), contour_threshold)
+
+# ======================================================
+
+def close_to_screen(sbr, redY, cam_idx, fSize):
+    ''' returns which screen ('left', 'center' or 'right') the subject 
+    (bounding rect 'sbr') is close to, or None.
+    cam_idx 1 is the camera of the center screen, 
+    0 and 2 are of left and right screens.
+    '''
+    dist_to_s = sbr[1]-redY # distance from red tape(screen) 
+      # to the subject 
+    msg = None
+    if cam_idx == 1: # center screen
+        if dist_to_s < 10: msg = 'center'
+        else:
+            sMid = int(sbr[0] + sbr[2]/2)
+            if sMid < int(fSize[0]/6): msg='left'
+            elif sMid > int(fSize[0]-fSize[0]/6): msg='right'
+    else:
+        if dist_to_s < 100: # close to the screen
+            if cam_idx == 0: msg='left'
+            else: msg='right'
+    return msg
+
+# ======================================================
+
+def find_red_tape(img, color_det, HSV_ranges, contour_threshold):
+    ''' returns the middle y position of the red tape (-1 if not found)
+    color_det: ColorDetector (see color_det.py)
+    '''
+    r = (0, 0, img.shape[1], img.shape[0]) # rect to find the color
+    red_col = color_det.find(img, r, HSV_ranges)
+    wr, rects = chk_contours(red_col, contour_threshold)
+    if wr == (-1,-1,0,0): return -1
+    return int(wr[1]+wr[3]/2)
+
+# ======================================================
+
+def bench_roi(video_path, roi_pts=[(50,50), (750,50), (750,550), (50,550)],
+              warm_up=10):
+    ''' compare the full-frame analysis with ROI-cropped/downscaled ones
+    '''
+    settings = [('full', None, 1.0), ('roi', roi_pts, 1.0),
+                ('roi x0.5', roi_pts, 0.5), ('roi x0.25', roi_pts, 0.25)]
+    base_t = None
+    for name, pts, scale in settings:
+        cap = cv2.VideoCapture(video_path)
+        for i in range(warm_up): ret, img = cap.read()
+        fSize = (img.shape[1], img.shape[0])
+        md = MotionDetector(fSize, make_bg_model('frozen'), pts, scale)
+        md.init(img)
+        t = 0.0; n = 0
+        while True:
+            ret, img = cap.read()
+            if ret == False: break
+            t0 = perf_counter()
+            md.detect(img)
+            t += perf_counter()-t0; n += 1
+        cap.release()
+        if n == 0: print("No frames in %s"%(video_path)); return
+        if base_t == None: base_t = t/n
+        print("%10s: analysis size %s, %.2f ms per frame, speed-up x%.1f"%(
+                name, str(md.aSize), t/n*1000, base_t/(t/n)))
+
+# ======================================================
+
+def bench_contours(n_blobs=[10, 100, 1000, 10000], fSize=(1920, 1080), 
+                   repeat=10):
+    ''' compare the per-contour Python loop with contour_rects/summarize_rects
+    over synthetic masks with 'n_blobs' blobs
+    '''
+    def _chk_contours_loop(inImage, contour_threshold):
+        contours, hierarchy = cv2.findContours(inImage, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        wrect = [-1,-1,-1,-1]
+        rects = []
+        for ci in range(len(contours)):
+            br = cv2.boundingRect(contours[ci])
+            if br[2] + br[3] > contour_threshold:
+                if wrect[0] == -1 and wrect[1] == -1: wrect[0] = br[0]; wrect[1] = br[1]
+                if wrect[2] == -1 and wrect[3] == -1: wrect[2] = br[0]; wrect[3] = br[1]
+                if br[0] < wrect[0]: wrect[0] = br[0]
+                if br[1] < wrect[1]: wrect[1] = br[1]
+                if (br[0]+br[2]) > wrect[2]: wrect[2] = br[0]+br[2]
+                if (br[1]+br[3]) > wrect[3]: wrect[3] = br[1]+br[3]
+                rects.append(br)
+        wrect[2] = wrect[2]-wrect[0]
+        wrect[3] = wrect[3]-wrect[1]
+        return tuple(wrect), rects
+
+    rs = np.random.RandomState(0)
+    funcs = [('loop', lambda m: _chk_contours_loop(m, 5)),
+             ('vectorized', lambda m: chk_contours(m, 5)),
+             ('conn. comp.', lambda m: chk_contours(m, 5, 'cc'))]
+    for n in n_blobs:
+        mask = np.zeros((fSize[1], fSize[0]), dtype=np.uint8)
+        ### blobs on a grid, so that they don't overlap
+        cols = int(np.ceil(np.sqrt(n*fSize[0]/float(fSize[1]))))
+        cs = fSize[0]//cols # cell size
+        cells = rs.permutation((fSize[1]//cs) * cols)[:n]
+        for c in cells:
+            x = (c%cols)*cs + 1; y = (c//cols)*cs + 1
+            bw = rs.randint(2, max(3, cs-2)); bh = rs.randint(2, max(3, cs-2))
+            mask[y:y+bh, x:x+bw] = 255
+        line = "%6i blobs:"%(n)
+        for name, func in funcs:
+            t0 = perf_counter()
+            for i in range(repeat): wrect, rects = func(mask)
+            t = (perf_counter()-t0)/repeat
+            line += "  %s %.3f ms (%i rects)"%(name, t*1000, len(rects))
+        print(line)
+
+# ======================================================
+
+if __name__ == '__main__':
+    from sys import argv
+    bench_contours()
+    if len(argv) > 1: bench_roi(argv[1])
@@ -0,0 +1,261 @@
+# coding: UTF-8
+
+"""
+This is an in-process publish/subscribe bus for messages between
+modules of CATOS (VideoIn, VideoOut, session manager, ...).
+
+A message is a Msg object (source, topic, args, time) instead of a
+slash-delimited string, so nothing is parsed on the receiving side.
+Handlers subscribe to a topic ('*' for all topics).
+
+Handlers subscribed with mode 'wx' are called in the wx (UI) thread.
+Publishing from any thread only appends the message to the pending list
+and, when the list was empty, schedules one dispatch with wx.CallAfter;
+so the UI thread wakes up only when there are messages, and a burst of
+messages is delivered in one go. Handlers with mode 'direct' are called
+immediately in the publishing thread.
+
+For topics in 'coalesce' (such as close_to_screen, published on every
+analyzed frame), only the latest pending message of each
+(source, topic) is delivered.
+
+Msg.from_str / str(Msg) convert from/to the old string form
+('src/topic/arg1/arg2/...').
+"""
+
+from threading import Lock
+from time import perf_counter
+
+# ======================================================
+
+class Msg:
+    __slots__ = ('src', 'topic', 'args', 't')
+
+    def __init__(self, src, topic, *args):
+        self.src = src
+        self.topic = topic
+        self.args = args
+        self.t = perf_counter() # time of publishing
+
+    def __getstate__(self): # (sent through multiprocessing queues)
+        return (self.src, self.topic, self.args, self.t)
+
+    def __setstate__(self, state):
+        self.src, self.topic, self.args, self.t = state
+
+    def __str__(self):
+        return '/'.join([self.src, self.topic] + [str(a) for a in self.args])
+
+    def __repr__(self): return 'Msg(%s)'%(str(self))
+
+    @classmethod
+    def from_str(cls, msg):
+        ''' Msg from the string form; 'src/topic/arg1/arg2/...'
+        '''
+        items = msg.split('/')
+        if len(items) < 2: return cls('', items[0])
+        return cls(items[0], items[1], *items[2:])
+
+# ======================================================
+
+class _TopicStat:
+    __slots__ = ('n_pub', 'n_dlvr', 'n_coal', 'max_depth', 'max_wait',
+                 'sum_wait', 't_first', 't_last')
+
+    def __init__(self):
+        self.n_pub = 0 # published
+        self.n_dlvr = 0 # delivered (dispatched to handlers)
+        self.n_coal = 0 # replaced by a newer message before delivery
+        self.max_depth = 0 # max. number of pending messages of this topic
+        self.max_wait = 0.0 # max. seconds from publishing to delivery
+        self.sum_wait = 0.0
+        self.t_first = -1
+        self.t_last = -1
+
+# ======================================================
+
+class MsgBus:
+    def __init__(self, coalesce=['close_to_screen'], call_after=None):
+        ''' coalesce: topics of which only the latest pending message
+          of each source is delivered
+        call_after: function to call a function in the UI thread
+          (wx.CallAfter, when None)
+        '''
+        if call_after is None:
+            import wx
+            call_after = wx.CallAfter
+        self.call_after = call_after
+        self.coalesce = set(coalesce)
+        self.subs = {} # key: topic, value: list of (handler, mode)
+        self.lock = Lock()
+        self.pending = [] # messages waiting for delivery in the UI thread
+        self.pending_key = {} # key: (src, topic) of coalesced topics,
+          # value: index in self.pending
+        self.depth = {} # number of pending messages per topic
+        self.flag_scheduled = False
+        self.stats = {}
+
+    # --------------------------------------------------
+
+    def subscribe(self, topic, handler, mode='wx'):
+        ''' handler: function taking a Msg
+        mode: 'wx' (called in the UI thread) or 'direct' (called in
+          the publishing thread)
+        '''
+        with self.lock:
+            self.subs.setdefault(topic, []).append((handler, mode))
+
+    # --------------------------------------------------
+
+    def unsubscribe(self, topic, handler):
+        with self.lock:
+            if topic not in self.subs: return
+            self.subs[topic] = [s for s in self.subs[topic] if s[0] != handler]
+
+    # --------------------------------------------------
+
+    def publish(self, msg, *args):
+        ''' publish a Msg, or 'src/topic' (or 'src/topic/args...') with args.
+        (thread-safe)
+        '''
+        if not isinstance(msg, Msg):
+            msg = Msg.from_str(msg)
+            if args: msg.args += args
+        topic = msg.topic
+        flag_schedule = False
+        with self.lock:
+            st = self.stats.get(topic)
+            if st is None: st = self.stats[topic] = _TopicStat()
+            st.n_pub += 1
+            if st.t_first == -1: st.t_first = msg.t
+            st.t_last = msg.t
+            subs = self.subs.get(topic, []) + self.subs.get('*', [])
+            direct = [h for h, mode in subs if mode == 'direct']
+            if len(direct) < len(subs): # there's a handler in the UI thread
+                key = (msg.src, topic)
+                if topic in self.coalesce and key in self.pending_key:
+                    self.pending[self.pending_key[key]] = msg
+                    st.n_coal += 1
+                else:
+                    if topic in self.coalesce:
+                        self.pending_key[key] = len(self.pending)
+                    self.pending.append(msg)
+                    d = self.depth.get(topic, 0) + 1
+                    self.depth[topic] = d
+                    if d > st.max_depth: st.max_depth = d
+                if not self.flag_scheduled:
+                    self.flag_scheduled = True
+                    flag_schedule = True
+        for handler in direct: handler(msg)
+        if flag_schedule: self.call_after(self.dispatch)
+
+    # --------------------------------------------------
+
+    def dispatch(self):
+        ''' deliver pending messages to handlers of 'wx' mode
+        (called in the UI thread)
+        '''
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            self.pending_key = {}
+            self.depth = {}
+            self.flag_scheduled = False
+            subs = dict([(k, [h for h, mode in self.subs[k] if mode == 'wx'])
+                         for k in self.subs])
+        t = perf_counter()
+        for msg in pending:
+            st = self.stats[msg.topic]
+            wait = t - msg.t
+            st.n_dlvr += 1
+            st.sum_wait += wait
+            if wait > st.max_wait: st.max_wait = wait
+            for handler in subs.get(msg.topic, []) + subs.get('*', []):
+                handler(msg)
+
+    # --------------------------------------------------
+
+    def stat_str(self):
+        ''' per-topic message rates, coalescing and queue-depth
+        '''
+        lines = []
+        with self.lock:
+            for topic in sorted(self.stats.keys()):
+                st = self.stats[topic]
+                el = st.t_last - st.t_first
+                lines.append("%s: published %i (%.1f/sec), delivered %i,"\
+                  " coalesced %i, max. depth %i, mean wait %.3f ms,"\
+                  " max. wait %.3f ms"%(topic, st.n_pub,
+                                        st.n_pub/el if el > 0 else 0,
+                                        st.n_dlvr, st.n_coal, st.max_depth,
+                                        st.sum_wait/max(1, st.n_dlvr)*1000,
+                                        st.max_wait*1000))
+        return '; '.join(lines)
+
+# ======================================================
+
+def self_check():
+    ''' run the bus with a fake UI thread (no wx)
+    '''
+    calls = []
+    bus = MsgBus(call_after=calls.append)
+    got = []
+    direct = []
+    bus.subscribe('foMove', got.append)
+    bus.subscribe('close_to_screen', got.append)
+    bus.subscribe('close_to_screen', direct.append, 'direct')
+    bus.publish('videoOut/foMove/1/0/0')
+    bus.publish(Msg('videoOut', 'foMove', 0, 1, 0))
+    for i in range(100):
+        bus.publish(Msg('videoIn-00', 'close_to_screen', 'left', i))
+        bus.publish(Msg('videoIn-01', 'close_to_screen', 'right', i))
+    bus.publish('videoOut/stim_touched/3') # no subscriber
+    assert len(calls) == 1 # one wake-up for the burst
+    assert len(direct) == 200
+    calls.pop()()
+    assert [str(m) for m in got] == ['videoOut/foMove/1/0/0',
+                                     'videoOut/foMove/0/1/0',
+                                     'videoIn-00/close_to_screen/left/99',
+                                     'videoIn-01/close_to_screen/right/99']
+    assert bus.stats['close_to_screen'].n_coal == 198
+    assert bus.stats['foMove'].max_depth == 2
+    bus.publish('videoOut/foMove/0/0/1')
+    assert len(calls) == 1
+    import pickle
+    m = pickle.loads(pickle.dumps(got[2]))
+    assert m.src == 'videoIn-00' and m.args == ('left', 99)
+    print("MsgBus self check passed.")
+    print(bus.stat_str())
+
+# ------------------------------------------------------
+
+def bench(n_msgs=100000):
+    ''' publishing & delivery cost per message vs. queue.Queue + chk_msg_q
+    '''
+    from queue import Queue
+    calls = []
+    bus = MsgBus(coalesce=[], call_after=calls.append)
+    n = [0]
+    def handler(msg): n[0] += int(msg.args[0])
+    bus.subscribe('foMove', handler)
+    t0 = perf_counter()
+    for i in range(n_msgs):
+        bus.publish(Msg('videoOut', 'foMove', 1, 0, 0))
+        if calls: calls.pop()()
+    t_bus = (perf_counter()-t0)/n_msgs
+    q = Queue()
+    t0 = perf_counter()
+    for i in range(n_msgs):
+        q.put('videoOut/foMove/%i/%i/%i'%(1, 0, 0), True, None)
+        while not q.empty(): # (as chk_msg_q)
+            items = q.get(False).split('/')
+            n[0] += int(items[2])
+    t_q = (perf_counter()-t0)/n_msgs
+    print("per message; MsgBus %.2f us, Queue + string parsing %.2f us"%(
+            t_bus*1e6, t_q*1e6))
+
+# ======================================================
+
+if __name__ == '__main__':
+    self_check()
+    bench()
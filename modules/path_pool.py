@@ -0,0 +1,265 @@
+# coding: UTF-8
+
+"""
+This is for pre-generating group trajectories of floating objects (FO)
+of VideoOut on a background thread.
+
+A group trajectory is a cubic Bezier curve (start, h1, h2, dest) of the
+group center, planned the same way VideoOut.onTimer did it. Paths of
+'movements' and 'immersion' are chained; each path starts at the
+destination of the previous one. 'center' paths (the session manager
+pulls the group to the center screen) don't depend on the group position.
+
+Because a Bezier curve is linear in its control points, the track of
+each object is the group curve plus its own offsets weighted by the
+Bernstein basis; b0*(orig - start) moves the curve to the object's
+current position and b1, b2, b3 weight random jitter of h1, h2 and dest.
+So a track of an object costs one small matrix product in the UI thread.
+"""
+
+from threading import Thread, Condition
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+
+KINDS = ['movements', 'immersion', 'center']
+CTR_JITTER = (50, 50, 50)
+
+# ======================================================
+
+def plan_group_path(kind, gctr, geom, rs):
+    ''' returns (h1, h2, dest, number of track points) of a group path
+    starting at 'gctr'.
+    geom: dict of screen geometry & speed; wSize, s_w, s_h, ctr_rect,
+      refresh_rate, fo_min_spd, fo_max_spd
+    rs: np.random.RandomState
+    '''
+    _r = lambda a, b: int(rs.randint(int(a), int(b)+1)) # inclusive
+    wSize = geom['wSize']; s_w = geom['s_w']; s_h = min(geom['s_h'])
+    ctr_rect = geom['ctr_rect']
+    if kind == 'center':
+        h1 = (_r(ctr_rect[0]-50, ctr_rect[2]+50),
+              _r(ctr_rect[1]-50, ctr_rect[3]+50))
+        h2 = (_r(ctr_rect[0]-50, ctr_rect[2]+50),
+              _r(ctr_rect[1]-50, ctr_rect[3]+50))
+        dest = (_r(ctr_rect[0], ctr_rect[2]), _r(ctr_rect[1], ctr_rect[3]))
+        return h1, h2, dest, _r(70, 120)
+    tBuff = 50 # buffer (pixels) for determining track
+    if kind == 'immersion':
+        if rs.random_sample() < 0.33:
+            range_ = (tBuff, wSize[0]-tBuff)
+        else:
+            if gctr[0] < wSize[0]/2:
+                range_ = (tBuff, s_w[0]-tBuff) # remain in left screen
+            elif gctr[0] > wSize[0]/2:
+                range_ = (s_w[0]+s_w[1]+tBuff,
+                          wSize[0]-tBuff) # remain in right screen
+            else: range_ = (tBuff, wSize[0]-tBuff)
+    else: # stimulus moves in the center only
+        range_ = (ctr_rect[0], ctr_rect[2])
+    dest = (_r(range_[0], range_[1]), _r(tBuff, s_h-tBuff))
+    if gctr[0] < dest[0]:
+        h1 = (_r(gctr[0], gctr[0]+(dest[0]-gctr[0])*0.666),
+              _r(tBuff, s_h-tBuff))
+        h2 = (_r(gctr[0]+(dest[0]-gctr[0])*0.333, dest[0]),
+              _r(tBuff, s_h-tBuff))
+    else:
+        h1 = (_r(dest[0]+(gctr[0]-dest[0])*0.333, gctr[0]),
+              _r(tBuff, s_h-tBuff))
+        h2 = (_r(dest[0], dest[0]+(gctr[0]-dest[0])*0.666),
+              _r(tBuff, s_h-tBuff))
+    ### travel distance
+    t_dist = np.sqrt((gctr[0]-h1[0])**2 + (gctr[1]-h1[1])**2)
+    t_dist += np.sqrt((h1[0]-h2[0])**2 + (h1[1]-h2[1])**2)
+    t_dist += np.sqrt((h2[0]-dest[0])**2 + (h2[1]-dest[1])**2)
+    n_pts = _r(t_dist/geom['fo_max_spd'],
+               t_dist/geom['fo_min_spd']) # this determines speed of movements
+    n_pts = max(geom['refresh_rate'], n_pts) # minimum track points
+    return h1, h2, dest, n_pts
+
+# ------------------------------------------------------
+
+def bernstein(n_pts):
+    ''' cubic Bernstein basis at t = i/n_pts; (n_pts, 4)
+    '''
+    t = np.arange(n_pts) / float(n_pts)
+    s = 1.0 - t
+    return np.column_stack((s**3, 3*s*s*t, 3*s*t*t, t**3))
+
+# ======================================================
+
+class PathPool:
+    def __init__(self, geom, kinds=['movements'], depth=8, seed=None,
+                 jitter=(200, 200, 50)):
+        ''' geom: see plan_group_path
+        kinds: kinds of paths to keep in the pool
+        depth: number of paths to keep ready for each kind
+        seed: seed of random numbers (None: not reproducible)
+        jitter: max. per-object jitter of (h1, h2, dest) in pixels
+          ('center' paths use CTR_JITTER)
+        '''
+        self.geom = geom
+        self.kinds = list(kinds)
+        self.depth = depth
+        self.jitter = jitter
+        # separate random states, so that the sequence of paths doesn't
+        # depend on when the background thread runs
+        _rs = lambda i: np.random.RandomState(None if seed is None else seed+i)
+        self.rs = dict([(k, _rs(i)) for i, k in enumerate(self.kinds)])
+        self.jitter_rs = _rs(len(self.kinds))
+        self.q = dict([(k, deque()) for k in self.kinds]) # ready paths
+        self.start = dict([(k, (0,0)) for k in self.kinds]) # start of the
+          # next path to generate
+        self.stats = dict(hits=0, misses=0, gen_n=0, gen_sec=0.0)
+        self.cond = Condition()
+        self.flag_stop = False
+        self.thrd = None
+
+    # --------------------------------------------------
+
+    def start_thread(self):
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def stop(self):
+        with self.cond:
+            self.flag_stop = True
+            self.cond.notify_all()
+        if self.thrd is not None: self.thrd.join(1)
+
+    # --------------------------------------------------
+
+    def reset(self, origin):
+        ''' discard ready paths and chain new paths from 'origin'
+        (call when the group was moved by something else than this pool)
+        '''
+        with self.cond:
+            for k in self.kinds:
+                self.q[k].clear()
+                self.start[k] = (int(origin[0]), int(origin[1]))
+            self.cond.notify_all()
+
+    # --------------------------------------------------
+
+    def _generate(self, kind):
+        ''' make a path of 'kind'. should be called with self.cond acquired
+        '''
+        t0 = perf_counter()
+        start = self.start[kind]
+        h1, h2, dest, n_pts = plan_group_path(kind, start, self.geom,
+                                              self.rs[kind])
+        if kind != 'center': self.start[kind] = dest
+        basis = bernstein(n_pts)
+        path = dict(kind=kind,
+                    start=np.array(start),
+                    h1=h1,
+                    h2=h2,
+                    dest=dest,
+                    n_pts=n_pts,
+                    jitter=CTR_JITTER if kind == 'center' else self.jitter,
+                    base=basis.dot(np.array([start, h1, h2, dest], 
+                                            dtype=np.float64)), # group curve
+                    basis=basis)
+        self.stats['gen_n'] += 1
+        self.stats['gen_sec'] += perf_counter()-t0
+        return path
+
+    # --------------------------------------------------
+
+    def run(self):
+        ''' background thread; keeps 'depth' paths of each kind ready
+        '''
+        while True:
+            with self.cond: # (released between paths for 'get')
+                kind = None
+                while not self.flag_stop:
+                    for k in self.kinds:
+                        if len(self.q[k]) < self.depth: kind = k; break
+                    if kind is not None: break
+                    self.cond.wait()
+                if self.flag_stop: break
+                self.q[kind].append(self._generate(kind))
+
+    # --------------------------------------------------
+
+    def get(self, kind):
+        ''' returns the next path of 'kind'.
+        (generated here, when no path is ready)
+        '''
+        with self.cond:
+            if len(self.q[kind]) > 0:
+                self.stats['hits'] += 1
+                path = self.q[kind].popleft()
+            else:
+                self.stats['misses'] += 1
+                path = self._generate(kind)
+            self.cond.notify_all()
+        return path
+
+    # --------------------------------------------------
+
+    def tracks(self, path, orig):
+        ''' tracks of objects currently at 'orig' ((n, 2) array)
+        along 'path'; (n, n_pts, 2) int32 array
+        '''
+        orig = np.asarray(orig).reshape(-1, 2)
+        n = len(orig)
+        offs = np.empty((n, 4, 2))
+        offs[:,0] = orig - path['start']
+        for k in range(3):
+            j = path['jitter'][k]
+            offs[:,k+1] = self.jitter_rs.randint(-j, j+1, (n, 2))
+        tr = path['base'][None] + np.einsum('pc,ncd->npd', path['basis'], offs)
+        return np.trunc(tr).astype(np.int32)
+
+    # --------------------------------------------------
+
+    def stat_str(self):
+        s = self.stats
+        return "path pool hits: %i, misses: %i, mean generation time: %.3f ms"%(
+                s['hits'], s['misses'], s['gen_sec']/max(1, s['gen_n'])*1000)
+
+# ======================================================
+
+def bench(n_objs=[5, 50, 500], n_paths=200):
+    ''' time spent in the UI thread when a track runs out;
+    planning and making Bezier tracks on the spot vs. PathPool
+    '''
+    from modules.misc_funcs import make_b_curves
+    geom = dict(wSize=(5760, 1040), s_w=[1920]*3, s_h=[1080]*3,
+                ctr_rect=[2830, 470, 2930, 570], refresh_rate=60,
+                fo_min_spd=25, fo_max_spd=30)
+    for n in n_objs:
+        rs = np.random.RandomState(0)
+        pos = np.full((n,2), (2880, 520))
+        t0 = perf_counter()
+        for i in range(n_paths):
+            gctr = tuple(pos.mean(axis=0).astype(int))
+            h1, h2, dest, n_pts = plan_group_path('immersion', gctr, geom, rs)
+            sh = (n, 2)
+            tr = make_b_curves(pos, np.array(h1)+rs.randint(-200, 201, sh),
+                               np.array(h2)+rs.randint(-200, 201, sh),
+                               np.array(dest)+rs.randint(-50, 51, sh), n_pts)
+            pos = tr[:,-1]
+        t_sync = (perf_counter()-t0)/n_paths
+
+        pool = PathPool(geom, ['immersion'], depth=8, seed=0)
+        pool.reset((2880, 520))
+        pool.start_thread()
+        pos = np.full((n,2), (2880, 520))
+        t_get = 0.0
+        for i in range(n_paths):
+            t0 = perf_counter()
+            tr = pool.tracks(pool.get('immersion'), pos)
+            t_get += perf_counter()-t0
+            pos = tr[:,-1]
+        pool.stop()
+        print("%4i objects: on the spot %.3f ms, PathPool %.3f ms per new track"\
+              " (%s)"%(n, t_sync*1000, t_get/n_paths*1000, pool.stat_str()))
+
+# ======================================================
+
+if __name__ == '__main__': bench()
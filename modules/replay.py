@@ -0,0 +1,203 @@
+# coding: UTF-8
+
+"""
+This is for running the detection pipeline of VideoIn offline,
+on a recorded video file or a directory of frame images.
+
+It uses the same components as VideoIn.run (background model,
+MotionDetector, red tape detection and close_to_screen decision)
+without wx, webcams or sleeps, so it runs as fast as the CPU allows.
+Per-frame detections are saved as CSV and .npz, and throughput
+(frames/sec, milliseconds per stage) is reported.
+
+Usage: python -m modules.replay input [options]
+"""
+
+import argparse
+from os import path
+from glob import glob
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from modules.bg_model import make_bg_model, BG_MODELS
+from modules.motion import MotionDetector, close_to_screen, find_red_tape
+from modules.color_det import ColorDetector
+
+MSG_CODES = {None: 0, 'left': 1, 'center': 2, 'right': 3}
+IMG_EXTS = ['.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff']
+
+# ======================================================
+
+def iter_frames(src):
+    ''' yields frames of a video file or image files in a directory
+    (sorted by file name)
+    '''
+    if path.isdir(src):
+        fps = sorted(glob(path.join(src, '*')))
+        for fp in fps:
+            if path.splitext(fp)[1].lower() not in IMG_EXTS: continue
+            img = cv2.imread(fp)
+            if img is not None: yield img
+    else:
+        cap = cv2.VideoCapture(src)
+        while True:
+            ret, img = cap.read()
+            if ret == False: break
+            yield img
+        cap.release()
+
+# ======================================================
+
+class Replay:
+    def __init__(self, src, cam_idx=0, bg_model='frozen', bg_update_intv=5,
+                 diff_th=50, analysis_mode='full',
+                 roi_pts=[(50,50), (750,50), (750,550), (50,550)],
+                 analysis_scale=1.0, contour_method='contours',
+                 contour_threshold=20, red_contour_threshold=40,
+                 red_HSV_ranges=[((175,100,90), (180,255,255))],
+                 warm_up=10):
+        ''' parameters have the same meaning as attributes of VideoIn
+        warm_up: number of frames to skip (as VideoIn does);
+          the last of them is used as the background
+          and for finding the red tape.
+        '''
+        self.src = src
+        self.cam_idx = cam_idx
+        self.bg_model = bg_model
+        self.bg_update_intv = bg_update_intv
+        self.diff_th = diff_th
+        self.analysis_mode = analysis_mode
+        self.roi_pts = roi_pts
+        self.analysis_scale = analysis_scale
+        self.contour_method = contour_method
+        self.contour_threshold = contour_threshold
+        self.red_contour_threshold = red_contour_threshold
+        self.red_HSV_ranges = red_HSV_ranges
+        self.warm_up = warm_up
+        self.redY = -1
+        self.det = None # detections; (n, 8) array
+        self.stats = {}
+
+    # --------------------------------------------------
+
+    def run(self):
+        ''' returns detections; each row is
+        (frame index, x, y, w, h, number of rects, msg code, dist_to_s)
+        msg code: 0 = None, 1 = left, 2 = center, 3 = right
+        '''
+        rows = []
+        md = None
+        t_read = 0.0; t_decide = 0.0
+        t_start = perf_counter()
+        t0 = perf_counter()
+        for fi, img in enumerate(iter_frames(self.src)):
+            t_read += perf_counter()-t0
+            if fi < self.warm_up-1:
+                t0 = perf_counter()
+                continue
+            if md == None:
+                fSize = (img.shape[1], img.shape[0])
+                self.redY = find_red_tape(img,
+                                          ColorDetector(),
+                                          self.red_HSV_ranges,
+                                          self.red_contour_threshold)
+                bgm = make_bg_model(self.bg_model,
+                                    update_intv=self.bg_update_intv,
+                                    diff_th=self.diff_th)
+                if self.analysis_mode == 'roi': roi_pts = self.roi_pts
+                else: roi_pts = None
+                md = MotionDetector(fSize,
+                                    bgm,
+                                    roi_pts,
+                                    self.analysis_scale,
+                                    self.contour_threshold,
+                                    self.contour_method)
+                md.stage_t = {}
+                md.init(img)
+                t0 = perf_counter()
+                continue
+            sbr, rects = md.detect(img)
+            _t = perf_counter()
+            msg = None; dist_to_s = 0
+            if sbr != (-1,-1,0,0):
+                msg = close_to_screen(sbr, self.redY, self.cam_idx, fSize)
+                dist_to_s = sbr[1]-self.redY
+            rows.append((fi,) + tuple(sbr) + (len(rects), MSG_CODES[msg],
+                                              dist_to_s))
+            t_decide += perf_counter()-_t
+            t0 = perf_counter()
+        t_total = perf_counter()-t_start
+        self.det = np.array(rows, dtype=np.int64).reshape(-1, 8)
+        n = max(1, len(rows))
+        self.stats = dict(frames=len(rows),
+                          total_sec=t_total,
+                          fps=len(rows)/t_total if t_total > 0 else 0.0,
+                          read_ms=t_read/n*1000,
+                          decide_ms=t_decide/n*1000)
+        if md != None:
+            for k in md.stage_t: self.stats[k+'_ms'] = md.stage_t[k]/n*1000
+        return self.det
+
+    # --------------------------------------------------
+
+    def save(self, out_prefix):
+        ''' save detections as CSV and .npz (with the stats)
+        '''
+        header = "frame,x,y,w,h,n_rects,msg,dist_to_s"
+        np.savetxt(out_prefix+'.csv', self.det, fmt='%i', delimiter=',',
+                   header=header, comments='')
+        np.savez(out_prefix+'.npz', det=self.det, redY=self.redY,
+                 **dict([('stat_'+k, v) for k, v in self.stats.items()]))
+
+    # --------------------------------------------------
+
+    def print_stats(self):
+        s = self.stats
+        print("%i frames in %.2f sec, %.1f frames/sec"%(s["frames"],
+                                                       s["total_sec"],
+                                                       s["fps"]))
+        for k in sorted(s.keys()):
+            if k.endswith('_ms'): print("  %12s: %.3f ms"%(k[:-3], s[k]))
+        if self.det is not None and len(self.det) > 0:
+            for m in ['left', 'center', 'right']:
+                print("  close_to_screen %s: %i frames"%(m,
+                        int((self.det[:,6] == MSG_CODES[m]).sum())))
+
+# ======================================================
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description="Run VideoIn detection"\
+                                 " on a video file or a directory of frames")
+    ap.add_argument("input")
+    ap.add_argument("--out", default=None,
+                    help="prefix of output files (default: input name)")
+    ap.add_argument("--cam-idx", type=int, default=0)
+    ap.add_argument("--bg-model", default='frozen', choices=BG_MODELS)
+    ap.add_argument("--bg-update-intv", type=int, default=5)
+    ap.add_argument("--diff-th", type=int, default=50)
+    ap.add_argument("--roi", action='store_true', help="analyze only ROI")
+    ap.add_argument("--scale", type=float, default=1.0)
+    ap.add_argument("--contour-method", default='contours',
+                    choices=['contours', 'cc'])
+    ap.add_argument("--contour-threshold", type=int, default=20)
+    args = ap.parse_args(args)
+    rp = Replay(args.input,
+                cam_idx=args.cam_idx,
+                bg_model=args.bg_model,
+                bg_update_intv=args.bg_update_intv,
+                diff_th=args.diff_th,
+                analysis_mode='roi' if args.roi else 'full',
+                analysis_scale=args.scale,
+                contour_method=args.contour_method,
+                contour_threshold=args.contour_threshold)
+    rp.run()
+    out = args.out
+    if out == None: out = path.splitext(args.input.rstrip('/\\'))[0]+'_det'
+    rp.save(out)
+    rp.print_stats()
+
+# ======================================================
+
+if __name__ == '__main__': main()
@@ -0,0 +1,814 @@
+# coding: UTF-8
+
+"""
+This is a serial transport for messages from/to an Arduino-chip.
+
+A reader thread reads whatever arrived (in_waiting bytes; blocking up to
+'read_timeout' for the first byte, so it doesn't spin while the board is
+quiet) into a bytearray and cuts messages at 'EOM' (End Of Message)
+or a newline. A message is parsed once into a list of strings
+(comma-separated items, without 'EOM'), such as ['ack', 'feed'],
+and kept in a bounded queue.
+
+receive(header, timeout) waits on a condition variable for a message
+which includes 'header'. Handlers subscribed to a header are called
+in the reader thread for each matching message.
+
+CommandPipeline writes queued commands in a writer thread, so that
+the UI thread never waits for serial I/O; each command gets a sequence
+number and, optionally, waits for its reply (ack) with a timeout and
+retries. Round-trip times are recorded.
+
+ArduinoManager opens boards on candidate ports at the same time, gives
+each board its role (feeder, sensors, lights, ...; by a map of ports,
+or by asking firmware which answers the role query) and routes send
+and receive by role. A lost board (such as unplugged USB) is reconnected
+with backoff.
+
+Usage: python -m modules.serial_io
+  checks the transport, the pipeline and the manager against
+  pseudo-terminals standing in for boards
+"""
+
+import re
+from threading import Thread, Condition, Lock, Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+import serial
+
+from modules.trace import get_tracer, SER_WRITE, SER_FLUSH, ACK
+
+_FRAME_END = re.compile(rb'EOM|\n')
+ID_CMD = b'id' # query of the role of a board
+
+# ======================================================
+
+def parse_msg(data):
+    ''' list of items of a message (bytes); [] for an empty message
+    '''
+    msg = data.decode('ascii', 'replace').strip("\r\n")
+    return [m.strip() for m in msg.split(",") if m.strip() != '']
+
+# ======================================================
+
+class SerialTransport:
+    def __init__(self, conn, read_timeout=0.1, q_len=256, read_size=4096):
+        ''' conn: opened serial port (serial.Serial)
+        read_timeout: max. seconds a read waits for the first byte
+        q_len: max. number of received messages to keep
+          (the oldest ones are dropped)
+        read_size: max. bytes to read at once
+        '''
+        self.conn = conn
+        self.conn.timeout = read_timeout
+        self.read_size = read_size
+        self.buf = bytearray()
+        self.scan_pos = 0 # position in buf to look for the end of a message
+        self.q = deque(maxlen=q_len) # received messages; (time, items)
+        self.cond = Condition()
+        self.wlock = Lock()
+        self.subs = {} # key: header, value: list of handlers
+        self.on_msg = [] # handlers called with every message
+        self.stats = dict(reads=0, bytes=0, msgs=0, dropped=0, errors=0)
+        self.flag_stop = False
+        self.thrd = None
+
+    # --------------------------------------------------
+
+    def start(self):
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def stop(self):
+        self.flag_stop = True
+        if self.thrd is not None: self.thrd.join(1)
+        with self.cond: self.cond.notify_all()
+
+    # --------------------------------------------------
+
+    def run(self):
+        ''' reader thread
+        '''
+        while not self.flag_stop:
+            try:
+                n = self.conn.in_waiting
+                data = self.conn.read(min(max(1, n), self.read_size))
+            except Exception: # port is gone (such as unplugged USB)
+                self.stats['errors'] += 1
+                break
+            if len(data) == 0: continue
+            self.stats['reads'] += 1
+            self.stats['bytes'] += len(data)
+            self.feed(data)
+        with self.cond:
+            self.flag_stop = True
+            self.cond.notify_all() # wake up receivers
+
+    # --------------------------------------------------
+
+    def feed(self, data):
+        ''' add received bytes and pass on complete messages
+        '''
+        self.buf += data
+        msgs = []
+        start = 0
+        while True:
+            m = _FRAME_END.search(self.buf, max(start, self.scan_pos))
+            if m is None: break
+            items = parse_msg(self.buf[start:m.start()])
+            if len(items) > 0: msgs.append(items)
+            start = m.end()
+            self.scan_pos = start
+        if start > 0: del self.buf[:start]
+        self.scan_pos = max(0, len(self.buf)-2) # 'EOM' could be cut
+        if len(msgs) == 0: return
+        t = perf_counter()
+        with self.cond:
+            for items in msgs:
+                if len(self.q) == self.q.maxlen: self.stats['dropped'] += 1
+                self.q.append((t, items))
+            self.stats['msgs'] += len(msgs)
+            self.cond.notify_all()
+        for items in msgs:
+            for handler in self.on_msg: handler(items)
+            for header in dict.fromkeys(items): # (once for each header)
+                for handler in self.subs.get(header, []): handler(items)
+
+    # --------------------------------------------------
+
+    def subscribe(self, header, handler):
+        ''' call handler(items) in the reader thread
+        for every message including 'header'
+        '''
+        self.subs.setdefault(header, []).append(handler)
+
+    # --------------------------------------------------
+
+    def receive(self, header, timeout):
+        ''' wait for a message including 'header' (None: any message)
+        for 'timeout' seconds (None: no limit).
+        returns items from the header to the end, or None.
+        (the message and older ones are removed from the queue)
+        '''
+        end_time = None if timeout is None else perf_counter() + timeout
+        with self.cond:
+            while True:
+                for i, (t, items) in enumerate(self.q):
+                    if header is None or header in items:
+                        for j in range(i+1): self.q.popleft()
+                        if header is None: return items
+                        return items[items.index(header):]
+                if self.flag_stop: return None
+                if end_time is None: self.cond.wait()
+                else:
+                    remaining = end_time - perf_counter()
+                    if remaining <= 0: return None
+                    self.cond.wait(remaining)
+
+    # --------------------------------------------------
+
+    def write(self, data):
+        with self.wlock: self.conn.write(data)
+
+    # --------------------------------------------------
+
+    def close(self):
+        self.stop()
+        self.conn.close()
+
+# ======================================================
+
+class Command:
+    __slots__ = ('seq', 'data', 'ack', 'timeout', 'retries', 'cid',
+                 'callback', 'status', 'n_tries', 'reply', 't_queued',
+                 't_sent', 't_ack')
+
+    def __init__(self, seq, data, ack, timeout, retries, cid, callback):
+        self.seq = seq # sequence number
+        self.data = data # bytes to write
+        self.ack = ack # header of the reply acknowledging this command
+          # (None: no reply expected)
+        self.timeout = timeout # seconds to wait for the reply
+        self.retries = retries # number of writing again after a timeout
+        self.cid = cid # correlation ID for tracing (0: not traced)
+        self.callback = callback # called with this command in the writer
+          # thread when it's finished
+        self.status = 'queued' # queued, sent, acked, timeout, failed 
+          # or cancelled
+        self.n_tries = 0
+        self.reply = None # items of the reply
+        self.t_queued = perf_counter()
+        self.t_sent = -1 # time when the last try was written
+        self.t_ack = -1
+
+    def rtt(self):
+        ''' round-trip time (sec) of the last try; -1 without a reply
+        '''
+        if self.t_ack == -1: return -1
+        return self.t_ack - self.t_sent
+
+# ======================================================
+
+class CommandPipeline:
+    def __init__(self, sio, ack_timeout=1.0, retries=2, q_len=64):
+        ''' sio: SerialTransport (started)
+        ack_timeout: default seconds to wait for a reply
+        retries: default number of retries after a timeout
+        q_len: max. number of commands waiting to be written
+          (submit returns None when it's full)
+
+        Commands are written in order by the writer thread. A command
+        expecting a reply (ack) holds the following commands until the
+        reply arrives or it times out; the board doesn't echo sequence
+        numbers, so a reply is matched to the command by its header.
+        '''
+        self.sio = sio
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.q = deque()
+        self.q_len = q_len
+        self.cond = Condition()
+        self.waiting = None # command waiting for its reply
+        self.trace_cid = 0 # traced command without ack; the first reply
+          # after it is stamped as ACK
+        self.last_seq = 0
+        self.rtts = deque(maxlen=1000) # recent round-trip times (sec)
+        self.stats = dict(sent=0, acked=0, retried=0, timeout=0, failed=0,
+                          cancelled=0, full=0)
+        self.flag_stop = False
+        self.sio.on_msg.append(self.on_msg)
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def submit(self, data, ack=None, timeout=None, retries=None, cid=0,
+               callback=None):
+        ''' queue a command to write; returns Command (None when the
+        queue is full). never blocks on serial I/O.
+        '''
+        if timeout is None: timeout = self.ack_timeout
+        if retries is None: retries = self.retries
+        with self.cond:
+            if len(self.q) >= self.q_len:
+                self.stats['full'] += 1
+                return None
+            self.last_seq += 1
+            cmd = Command(self.last_seq, data, ack, timeout, retries, cid,
+                          callback)
+            self.q.append(cmd)
+            self.cond.notify_all()
+        return cmd
+
+    # --------------------------------------------------
+
+    def on_msg(self, items):
+        ''' every message from the board (reader thread)
+        '''
+        t = perf_counter()
+        with self.cond:
+            if self.trace_cid:
+                get_tracer().stamp(self.trace_cid, ACK, int(t*1e9))
+                self.trace_cid = 0
+            cmd = self.waiting
+            if cmd is None or cmd.ack not in items: return
+            cmd.t_ack = t
+            cmd.reply = items[items.index(cmd.ack):]
+            self.waiting = None
+            self.cond.notify_all()
+        get_tracer().stamp(cmd.cid, ACK, int(t*1e9))
+
+    # --------------------------------------------------
+
+    def run(self):
+        ''' writer thread
+        '''
+        while True:
+            with self.cond:
+                while not self.flag_stop and len(self.q) == 0:
+                    self.cond.wait()
+                if self.flag_stop: break
+                cmd = self.q.popleft()
+            self.process(cmd)
+            if cmd.callback is not None: cmd.callback(cmd)
+        ### commands queued before stopping; commands without ack are
+        ###   still written (as 'send' did before the pipeline), others
+        ###   are cancelled
+        with self.cond:
+            left = list(self.q)
+            self.q.clear()
+        for cmd in left:
+            if cmd.ack is None: self.process(cmd)
+            else:
+                cmd.status = 'cancelled'
+                self.stats['cancelled'] += 1
+            if cmd.callback is not None: cmd.callback(cmd)
+
+    # --------------------------------------------------
+
+    def process(self, cmd):
+        ''' write 'cmd' (and wait for its reply) in the writer thread
+        '''
+        while cmd.n_tries <= cmd.retries:
+            cmd.n_tries += 1
+            if cmd.n_tries > 1: self.stats['retried'] += 1
+            with self.cond:
+                self.waiting = None if cmd.ack is None else cmd
+            try:
+                self.sio.write(cmd.data)
+                cmd.t_sent = perf_counter() # (a reply may come during flush)
+                get_tracer().stamp(cmd.cid, SER_WRITE)
+                self.sio.conn.flush() # wait until the bytes are sent
+            except Exception: # port is gone
+                with self.cond: self.waiting = None
+                cmd.status = 'failed'
+                self.stats['failed'] += 1
+                return
+            get_tracer().stamp(cmd.cid, SER_FLUSH)
+            self.stats['sent'] += 1
+            if cmd.ack is None:
+                with self.cond:
+                    if cmd.cid: self.trace_cid = cmd.cid
+                cmd.status = 'sent'
+                return
+            end_time = perf_counter() + cmd.timeout # (after flush)
+            with self.cond:
+                while self.waiting is cmd and not self.flag_stop:
+                    remaining = end_time - perf_counter()
+                    if remaining <= 0: break
+                    self.cond.wait(remaining)
+                self.waiting = None
+            if cmd.t_ack != -1:
+                cmd.status = 'acked'
+                self.stats['acked'] += 1
+                self.rtts.append(cmd.rtt())
+                return
+            if self.flag_stop: break
+        cmd.status = 'timeout'
+        self.stats['timeout'] += 1
+
+    # --------------------------------------------------
+
+    def stop(self):
+        with self.cond:
+            self.flag_stop = True
+            self.cond.notify_all()
+        self.thrd.join(2)
+
+    # --------------------------------------------------
+
+    def stat_str(self):
+        s = "commands; " + ", ".join(["%s: %i"%(k, self.stats[k]) for k in
+                        ['sent', 'acked', 'retried', 'timeout', 'failed',
+                         'cancelled', 'full']])
+        if len(self.rtts) > 0:
+            rtts = np.array(self.rtts) * 1000
+            s += ", RTT p50 %.1f ms, p95 %.1f ms, max %.1f ms"%(
+                    np.percentile(rtts, 50), np.percentile(rtts, 95),
+                    rtts.max())
+        return s
+
+# ======================================================
+
+class Board:
+    ''' a connected Arduino-chip
+    '''
+    def __init__(self, port, baud, conn, sio, cmds, role=''):
+        self.port = port
+        self.baud = baud
+        self.conn = conn
+        self.sio = sio # SerialTransport
+        self.cmds = cmds # CommandPipeline
+        self.role = role
+        self.answered = False # whether it answered the role query
+        self.t_open = perf_counter()
+
+    def alive(self):
+        ''' False when the reader thread stopped (such as unplugged USB)
+        '''
+        return not self.sio.flag_stop
+
+    def close(self):
+        self.cmds.stop()
+        self.sio.stop()
+        try: self.conn.close()
+        except Exception: pass
+
+# ------------------------------------------------------
+
+def open_board(port, baud=9600, role=None, id_cmd=None, id_timeout=0.5,
+               id_retries=4, default_role='feeder'):
+    ''' open 'port'. the role of the board is 'role', if it's given.
+    otherwise, when 'id_cmd' is given, the board is asked its role
+    ('id,<role>,EOM' is expected as the reply to 'id_cmd'); the chip may
+    be booting after the port was opened, so the query is retried.
+    (firmware without the query never sees 'id_cmd', when it's None)
+    returns Board (with 'default_role' when there was no role or reply;
+    board.answered tells whether it replied) or None when the port can't
+    be opened
+    '''
+    try: conn = serial.Serial(port, baud, timeout=0)
+    except (serial.SerialException, OSError): return None
+    sio = SerialTransport(conn)
+    sio.start()
+    cmds = CommandPipeline(sio)
+    board = Board(port, baud, conn, sio, cmds)
+    board.role = default_role if role is None else role
+    if role is not None or id_cmd is None: return board
+    done = Event()
+    cmd = cmds.submit(id_cmd, 'id', id_timeout, id_retries,
+                      callback=lambda c: done.set())
+    done.wait(id_timeout*(id_retries+1) + 1)
+    if cmd.status == 'failed': board.close(); return None
+    if cmd.reply is not None and len(cmd.reply) > 1:
+        board.role = cmd.reply[1]
+        board.answered = True
+    return board
+
+# ======================================================
+
+class ArduinoManager:
+    def __init__(self, ports, baud=9600, roles={}, id_query=False,
+                 id_cmd=ID_CMD, id_timeout=0.5, id_retries=4,
+                 default_role='feeder', backoff=(0.5, 10.0), log=None):
+        ''' ports: function returning paths of candidate serial ports
+        baud: baud rate (a number, or dict of port path and baud rate 
+          with 'default' key)
+        roles: dict of port path and role of its board
+        id_query: ask boards on other ports their roles with 'id_cmd'
+          (only for firmware answering it; a board which didn't answer
+          is not asked again). without it, they are 'default_role'.
+        id_cmd, id_timeout, id_retries, default_role: see open_board
+        backoff: (first, max.) seconds between reconnection attempts of 
+          a lost board; doubled after each failed attempt
+        log: function to log a string (None: print)
+        '''
+        self.ports = ports
+        self.baud = baud
+        self.roles = roles
+        self.id_query = id_query
+        self.id_args = dict(id_cmd=id_cmd, id_timeout=id_timeout,
+                            id_retries=id_retries, default_role=default_role)
+        self.silent = set() # ports of boards which didn't answer id_cmd
+        self.backoff = backoff
+        self.log = print if log is None else log
+        self.lock = Lock()
+        self.boards = {} # key: role, value: Board
+        self.on_msg = [] # handlers called with every message from any board
+          # (in the reader thread of the board)
+        self.lost = {} # key: role, value: [port, next try time, backoff]
+        t0 = perf_counter()
+        for board in self.probe(self.ports()): self.register(board)
+        self.startup_sec = perf_counter()-t0 # time spent for finding boards
+        self.log("%i board(s) found in %.3f sec; %s"%(len(self.boards),
+                                            self.startup_sec, self.roles_str()))
+        self.flag_stop = Event()
+        self.thrd = Thread(target=self.watch, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def port_baud(self, port):
+        if isinstance(self.baud, dict):
+            return self.baud.get(port, self.baud.get('default', 9600))
+        return self.baud
+
+    # --------------------------------------------------
+
+    def _open(self, port):
+        args = dict(self.id_args)
+        if not self.id_query or port in self.silent: args['id_cmd'] = None
+        board = open_board(port, self.port_baud(port), self.roles.get(port),
+                           **args)
+        if board is not None and args['id_cmd'] is not None and \
+          not board.answered:
+            self.silent.add(port)
+        return board
+
+    # --------------------------------------------------
+
+    def probe(self, ports):
+        if len(ports) == 0: return []
+        with ThreadPoolExecutor(max_workers=len(ports)) as ex:
+            boards = list(ex.map(self._open, ports))
+        return [b for b in boards if b is not None]
+
+    # --------------------------------------------------
+
+    def register(self, board):
+        ''' add 'board' to the registry by its role. another board with
+        the same role gets a number after the role (such as 'feeder2')
+        '''
+        with self.lock:
+            role = board.role
+            i = 2
+            while role in self.boards and self.boards[role].alive():
+                role = '%s%i'%(board.role, i)
+                i += 1
+            if role in self.boards: self.boards[role].close() # lost one
+            board.role = role
+            board.sio.on_msg.append(self._on_board_msg)
+            self.boards[role] = board
+            if role in self.lost: del self.lost[role]
+
+    # --------------------------------------------------
+
+    def _on_board_msg(self, items):
+        for handler in self.on_msg: handler(items)
+
+    # --------------------------------------------------
+
+    def roles_str(self):
+        with self.lock:
+            return ', '.join(["%s: %s (%i)"%(r, b.port, b.baud) for r, b in
+                              sorted(self.boards.items())])
+
+    # --------------------------------------------------
+
+    def watch(self):
+        ''' thread to reconnect lost boards with backoff
+        '''
+        while not self.flag_stop.wait(0.5):
+            t = perf_counter()
+            with self.lock:
+                for role in list(self.boards.keys()):
+                    board = self.boards[role]
+                    if board.alive(): continue
+                    del self.boards[role]
+                    self.lost[role] = [board.port, t+self.backoff[0],
+                                       self.backoff[0]]
+                    self.log("%s board (%s) is lost."%(role, board.port))
+                    board.close()
+                due = [r for r in self.lost if self.lost[r][1] <= t]
+                used = [b.port for b in self.boards.values()]
+            if len(due) == 0: continue
+            ports = [p for p in self.ports() if p not in used]
+            found = self.probe(ports)
+            for board in found:
+                self.register(board)
+                self.log("%s board is connected at %s."%(board.role,
+                                                         board.port))
+            with self.lock:
+                for role in due:
+                    if role not in self.lost: continue
+                    lt = self.lost[role]
+                    lt[2] = min(lt[2]*2, self.backoff[1])
+                    lt[1] = perf_counter() + lt[2]
+
+    # --------------------------------------------------
+
+    def get(self, role):
+        ''' Board of 'role' (None, if there isn't)
+        '''
+        with self.lock: return self.boards.get(role)
+
+    # --------------------------------------------------
+
+    def send(self, msg, role='feeder', ack=None, cid=0, callback=None):
+        ''' queue 'msg' to the board of 'role'; returns Command or None
+        '''
+        board = self.get(role)
+        if board is None or not board.alive(): return None
+        return board.cmds.submit(msg, ack, cid=cid, callback=callback)
+
+    # --------------------------------------------------
+
+    def receive(self, header, timeout, role='feeder'):
+        ''' see SerialTransport.receive
+        '''
+        board = self.get(role)
+        if board is None: return None
+        return board.sio.receive(header, timeout)
+
+    # --------------------------------------------------
+
+    def close(self):
+        self.flag_stop.set()
+        self.thrd.join(2)
+        with self.lock:
+            for role in self.boards:
+                self.log("%s board (%s); %s"%(role, self.boards[role].port,
+                                            self.boards[role].cmds.stat_str()))
+                self.boards[role].close()
+            self.boards = {}
+
+# ======================================================
+
+def open_pty():
+    ''' (file descriptor of the board side, path of the port side)
+    of a new pseudo-terminal in raw mode
+    '''
+    import os, tty
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return master, os.ttyname(slave)
+
+# ------------------------------------------------------
+
+def self_check():
+    ''' run the transport against a pseudo-terminal (no Arduino-chip)
+    '''
+    import os, serial
+    from time import sleep
+    board, port = open_pty()
+    st = SerialTransport(serial.Serial(port, 9600, timeout=0))
+    sensed = []
+    st.subscribe('motion', sensed.append)
+    st.start()
+    ### a message cut into pieces, several messages in one write
+    os.write(board, b'ack,fe')
+    sleep(0.05)
+    os.write(board, b'ed,EO')
+    sleep(0.05)
+    os.write(board, b'M\r\nmotion,1,EOM\r\nmotion,0\ntemp, 24.5 ,EOM')
+    assert st.receive('ack', 1) == ['ack', 'feed']
+    assert st.receive('temp', 1) == ['temp', '24.5']
+    assert sensed == [['motion', '1'], ['motion', '0']], sensed
+    assert st.receive('ack', 0.1) is None # (motion messages were removed)
+    ### waiting doesn't spin
+    t0 = perf_counter()
+    cpu0 = os.times()
+    assert st.receive('ack', 0.5) is None
+    cpu = sum(os.times()[:2]) - sum(cpu0[:2])
+    assert perf_counter()-t0 >= 0.5 and cpu < 0.1, cpu
+    ### a reply while waiting
+    def reply(): sleep(0.1); os.write(board, b'ack,feed,EOM')
+    Thread(target=reply).start()
+    t0 = perf_counter()
+    assert st.receive('ack', 2) == ['ack', 'feed']
+    assert perf_counter()-t0 < 0.5
+    ### writing
+    st.write(b'feed')
+    sleep(0.05)
+    assert os.read(board, 100) == b'feed'
+    st.close()
+    os.close(board)
+    print("SerialTransport self check passed; %s"%(str(st.stats)))
+
+# ------------------------------------------------------
+
+def _fake_board(board, flag_stop, role=None, boot_sec=0):
+    ''' scripted Arduino-chip on the board side of a pseudo-terminal;
+    commands end with ';'. replies 'ack,<command>(,<role>),EOM' after 
+    20 ms, except that it ignores the first 'drop' and every 'mute'.
+    replies 'id,<role>,EOM' to 'id', if 'role' is given (otherwise, it's
+    like a firmware without the query). ignores anything for 'boot_sec'
+    seconds at first.
+    '''
+    import os, select
+    from time import sleep
+    t0 = perf_counter()
+    tag = b'' if role is None else b',' + role.encode()
+    buf = b''
+    n_drop = 0
+    while not flag_stop:
+        try:
+            if not select.select([board], [], [], 0.05)[0]: continue
+            data = os.read(board, 100)
+        except (OSError, ValueError): break # closed
+        if perf_counter()-t0 < boot_sec: continue
+        buf += data
+        while b';' in buf:
+            cmd, buf = buf.split(b';', 1)
+            if cmd == b'mute': continue
+            if cmd == b'drop':
+                n_drop += 1
+                if n_drop == 1: continue
+            if cmd == b'id':
+                if role is not None: os.write(board, b'id' + tag + b',EOM')
+                continue
+            sleep(0.02)
+            os.write(board, b'ack,' + cmd + tag + b',EOM\r\n')
+
+# ------------------------------------------------------
+
+def self_check_pipeline():
+    ''' run CommandPipeline against a scripted board over a pseudo-terminal
+    '''
+    import os, serial
+    from time import sleep
+    board, port = open_pty()
+    flag_stop = []
+    Thread(target=_fake_board, args=(board, flag_stop), daemon=True).start()
+    st = SerialTransport(serial.Serial(port, 9600, timeout=0))
+    st.start()
+    cp = CommandPipeline(st, ack_timeout=0.2, retries=1)
+    done = []
+    t0 = perf_counter()
+    cmds = [cp.submit(b'feed;', 'ack', callback=done.append),
+            cp.submit(b'drop;', 'ack', callback=done.append),
+            cp.submit(b'mute;', 'ack', callback=done.append),
+            cp.submit(b'light;', callback=done.append),
+            cp.submit(b'feed;', 'ack', callback=done.append)]
+    t_submit = perf_counter()-t0
+    assert t_submit < 0.01, t_submit # submitting doesn't wait for I/O
+    while len(done) < len(cmds) and perf_counter()-t0 < 5: sleep(0.01)
+    assert [c.seq for c in done] == [1, 2, 3, 4, 5]
+    assert [c.status for c in done] == ['acked', 'acked', 'timeout', 'sent',
+                                        'acked'], [c.status for c in done]
+    assert [c.n_tries for c in done] == [1, 2, 2, 1, 1]
+    assert done[0].reply == ['ack', 'feed'] and done[0].rtt() >= 0.02
+    ### stopping with queued commands
+    sleep(0.1) # (a late reply to 'light' shouldn't be taken as the ack)
+    done = []
+    cmds = [cp.submit(b'mute;', 'ack', callback=done.append),
+            cp.submit(b'feed;', callback=done.append),
+            cp.submit(b'light;', 'ack', callback=done.append)]
+    sleep(0.05)
+    cp.stop()
+    assert [c.status for c in done] == ['timeout', 'sent', 'cancelled'], \
+            [c.status for c in done]
+    assert cp.stats['cancelled'] == 1
+    st.close()
+    flag_stop.append(True)
+    os.close(board)
+    print("CommandPipeline self check passed; %s"%(cp.stat_str()))
+
+# ------------------------------------------------------
+
+def self_check_manager():
+    ''' find boards on pseudo-terminals with ArduinoManager;
+    routing by role, startup time and reconnection
+    '''
+    import os
+    from time import sleep
+    flag_stop = []
+    def new_board(role, boot_sec=0):
+        board, port = open_pty()
+        Thread(target=_fake_board, args=(board, flag_stop, role, boot_sec),
+               daemon=True).start()
+        return board, port
+    boards = dict(feeder=new_board('feeder', 0.3),
+                  sensors=new_board('sensors'),
+                  legacy=new_board(None))
+    ports = [boards[k][1] for k in ['feeder', 'sensors', 'legacy']]
+    ports.append('/dev/no_such_port')
+    logs = []
+    ### defaults (no role query); every board is a feeder and nothing
+    ###   is written to them
+    am = ArduinoManager(lambda: ports, log=logs.append)
+    assert sorted(am.boards.keys()) == ['feeder', 'feeder2', 'feeder3']
+    assert sum([b.cmds.stats['sent'] for b in am.boards.values()]) == 0
+    t_default = am.startup_sec
+    am.close()
+    ### roles by a map of ports
+    am = ArduinoManager(lambda: ports[1:3], roles={ports[1]: 'sensors'},
+                        log=logs.append)
+    assert am.get('sensors').port == ports[1]
+    assert am.get('feeder').port == ports[2]
+    am.close()
+    ### role query; one by one (as before) for comparison
+    args = dict(id_cmd=b'id;', id_timeout=0.3, id_retries=3)
+    t0 = perf_counter()
+    for p in ports:
+        b = open_board(p, **args)
+        if b is not None: b.close()
+    t_serial = perf_counter()-t0
+    am = ArduinoManager(lambda: ports, backoff=(0.2, 1.0), log=logs.append,
+                        id_query=True, **args)
+    roles = dict([(r, am.boards[r].port) for r in am.boards])
+    assert roles == dict(feeder=ports[0], sensors=ports[1], 
+                         feeder2=ports[2]), roles
+    assert am.startup_sec < 0.3*4 + 0.5, am.startup_sec # bounded by 
+      # the slowest board, not by the number of boards
+    assert am.silent == set([ports[2]]) # (not asked again)
+    ### routing by role
+    done = Event()
+    cmd = am.send(b'light;', 'sensors', 'ack', callback=lambda c: done.set())
+    assert done.wait(2) and cmd.reply == ['ack', 'light', 'sensors']
+    assert am.send(b'feed;', 'lights') is None # no such board
+    ### the sensor board is unplugged and comes back on another port
+    os.close(boards['sensors'][0])
+    t0 = perf_counter()
+    while am.get('sensors') is not None and perf_counter()-t0 < 3: sleep(0.05)
+    assert am.get('sensors') is None
+    boards['sensors'] = new_board('sensors')
+    ports[1] = boards['sensors'][1]
+    while am.get('sensors') is None and perf_counter()-t0 < 5: sleep(0.05)
+    assert am.get('sensors') is not None and am.get('sensors').port == ports[1]
+    t_reconn = perf_counter()-t0
+    done.clear()
+    cmd = am.send(b'light;', 'sensors', 'ack', callback=lambda c: done.set())
+    assert done.wait(2) and cmd.status == 'acked'
+    am.close()
+    flag_stop.append(True)
+    for k in boards: 
+        try: os.close(boards[k][0])
+        except OSError: pass
+    print("ArduinoManager self check passed; startup %.3f sec with defaults,"\
+          " %.3f sec with role query (one by one %.3f sec), reconnected"\
+          " in %.3f sec"%(t_default, am.startup_sec, t_serial, t_reconn))
+    for line in logs: print("  " + line)
+
+# ======================================================
+
+if __name__ == '__main__':
+    self_check()
+    self_check_pipeline()
+    self_check_manager()
@@ -0,0 +1,113 @@
+# coding: UTF-8
+
+"""
+This is a uniform grid of circles (floating objects) for hit-testing
+touches on VideoOut.
+
+The grid is rebuilt from the position/radius arrays with one argsort
+of cell keys (no Python loop over objects), so it is cheap enough to
+rebuild on every timer tick. A query looks only at the cells around
+the touch point.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+_OFF = 1 << 15 # offset for negative cell indices (objects off the screen)
+_K = 1 << 16
+
+# ======================================================
+
+class SpatialGrid:
+    def __init__(self, cell=64):
+        ''' cell: width (and height) of a cell in pixels
+        '''
+        self.cell = cell
+        self.build(np.zeros((0,2)), np.zeros(0))
+
+    # --------------------------------------------------
+
+    def build(self, pos, rad):
+        ''' pos: (n, 2) positions, rad: (n,) radii of objects
+        '''
+        self.pos = np.asarray(pos).reshape(-1, 2)
+        self.rad = np.asarray(rad).reshape(-1)
+        c = self.pos // self.cell + _OFF
+        keys = c[:,0].astype(np.int64) * _K + c[:,1]
+        self.order = np.argsort(keys, kind='stable') # object indices
+          # sorted by cell
+        self.keys = keys[self.order]
+        self.max_rad = int(self.rad.max()) if len(self.rad) > 0 else 0
+
+    # --------------------------------------------------
+
+    def candidates(self, pt, r):
+        ''' indices of objects in cells within 'r' pixels of 'pt'
+        '''
+        if len(self.keys) == 0: return np.zeros(0, dtype=np.int64)
+        x1 = int((pt[0]-r) // self.cell) + _OFF
+        x2 = int((pt[0]+r) // self.cell) + _OFF
+        y1 = int((pt[1]-r) // self.cell) + _OFF
+        y2 = int((pt[1]+r) // self.cell) + _OFF
+        idx = []
+        for cx in range(x1, x2+1):
+        # cells of a column are consecutive keys
+            lo = np.searchsorted(self.keys, cx*_K+y1, 'left')
+            hi = np.searchsorted(self.keys, cx*_K+y2, 'right')
+            if hi > lo: idx.append(self.order[lo:hi])
+        if len(idx) == 0: return np.zeros(0, dtype=np.int64)
+        return np.concatenate(idx)
+
+    # --------------------------------------------------
+
+    def query(self, pt, pad=0):
+        ''' objects touched at 'pt'; within (radius + pad) from its center.
+        returns (sorted indices of touched objects, index of the nearest
+        object, distance from 'pt' to the edge of the nearest object
+        (0 when inside)). (nearest is -1 and distance is -1 without objects)
+        '''
+        c = self.candidates(pt, self.max_rad + pad)
+        d = np.hypot(self.pos[c,0]-pt[0], self.pos[c,1]-pt[1])
+        touched = np.sort(c[d <= self.rad[c] + pad])
+        if len(self.pos) == 0: return touched, -1, -1.0
+        ### nearest object (all objects; a touch is rare)
+        d_all = np.hypot(self.pos[:,0]-pt[0], self.pos[:,1]-pt[1]) - self.rad
+        ni = int(np.argmin(d_all))
+        return touched, ni, float(max(0.0, d_all[ni]))
+
+# ======================================================
+
+def bench(n_objs=[5, 50, 500, 5000], size=(5760, 1040), n_queries=1000):
+    ''' grid rebuild time (per tick) and query time vs. linear scan
+    '''
+    for n in n_objs:
+        pos = np.column_stack((np.random.randint(0, size[0], n),
+                               np.random.randint(0, size[1], n)))
+        rad = np.random.randint(1, 26, n)
+        grid = SpatialGrid()
+        t0 = perf_counter()
+        for i in range(100): grid.build(pos, rad)
+        t_build = (perf_counter()-t0)/100
+        pts = np.column_stack((np.random.randint(0, size[0], n_queries),
+                               np.random.randint(0, size[1], n_queries)))
+        t0 = perf_counter()
+        res_g = [grid.candidates(p, grid.max_rad+50) for p in pts]
+        t_grid = (perf_counter()-t0)/n_queries
+        t0 = perf_counter()
+        for p in pts:
+            d = np.hypot(pos[:,0]-p[0], pos[:,1]-p[1])
+            res_l = np.where(d <= rad + 50)[0]
+        t_lin = (perf_counter()-t0)/n_queries
+        ### check results are the same
+        for p in pts[:100]:
+            d = np.hypot(pos[:,0]-p[0], pos[:,1]-p[1])
+            assert np.array_equal(grid.query(p, 50)[0],
+                                  np.where(d <= rad + 50)[0])
+        print("%5i objects: rebuild %.3f ms, candidates query %.4f ms,"\
+              " linear scan %.4f ms"%(n, t_build*1000, t_grid*1000,
+                                       t_lin*1000))
+
+# ======================================================
+
+if __name__ == '__main__': bench()
@@ -0,0 +1,433 @@
+# coding: UTF-8
+
+"""
+This is the visual stimulus of CATOS (floating objects or a static image)
+without any window; VideoOut shows it on the screens.
+
+StimulusModel holds the state (floating objects, group rect/center,
+screen section of the group, screen geometry) and updates it.
+Screen geometry is given as widths and heights of screens, so it can be
+any virtual multi-screen setup. ArrayRenderer draws the stimulus into
+a NumPy image (BGR, with OpenCV), so the stimulus can be simulated,
+benchmarked or pre-rendered as a video without wx or a display.
+
+Usage: python -m modules.stimulus [options]
+"""
+
+import argparse
+from random import uniform
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from modules.fo_store import FOStore, linear_tracks
+from modules.path_pool import PathPool
+from modules.spatial_grid import SpatialGrid
+
+# ======================================================
+
+class StimulusModel:
+    def __init__(self, s_w, s_h, wSize=None, refresh_rate=60,
+                 path_pool_depth=8, path_seed=None):
+        ''' s_w, s_h: widths and heights of screens (left to right)
+        wSize: size of the whole stimulus area
+          (None: all screens side by side, 40 pixels less in height)
+        refresh_rate: animation steps (track points) per second
+        '''
+        self.s_w = list(s_w) # widths of screens
+        self.s_h = list(s_h) # heights of screens
+        if wSize == None: wSize = (sum(self.s_w), max(self.s_h)-40)
+        self.wSize = (int(wSize[0]), int(wSize[1]))
+        self.ctr_rect = [self.wSize[0]//2-50, self.wSize[1]//2-50, self.wSize[0]//2+50, self.wSize[1]//2+50] # center rect; x1,y1,x2,y2
+        self.refresh_rate = refresh_rate
+        self.scr_sec = [11, 5] # number of sections in screen [horizontal, vertical]
+        self.fo = FOStore() # floating objects
+        self.fo_col = (204, 204, 204) # fill color of floating objects
+        self.fo_min_rad = 15 # minimum radius of an object
+        self.fo_max_rad = 25 # maximum radius
+        self.fo_min_spd = 25 # minimum number of pixels to move per frame
+        self.fo_max_spd = 30 # maximum number of pixels
+        self.chance_to_change_rad = 0.3
+        self.flag_rad_change = True # random radius change
+        self.gr = (-1,-1,-1,-1) # group rect (x,y,w,h)
+        self.gctr = (-1,-1) # center point of group
+        self.fo_pos_idx = [-1,-1] # screen section of the group
+        self.static_rect = None # rect of the static image (x,y,w,h)
+        self.path_pool = None # pre-generated group trajectories
+        self.path_pool_depth = path_pool_depth # number of trajectories
+          # to keep ready
+        self.path_seed = path_seed # seed for reproducible trajectories
+        self.path_kind = 'movements'
+        self.grid = SpatialGrid(64) # for hit-testing objects
+        self.touch_pad = 50 # touch within (radius + touch_pad) of an object
+          # counts as a touch on it
+
+    # --------------------------------------------------
+
+    def init_static_img(self):
+        rad = int(min(self.s_h)/3)
+        x = int(self.wSize[0]/2-rad)
+        y = int(self.wSize[1]/2-rad)
+        w = rad*2
+        h = rad*2
+        self.fo.init(np.zeros((0,2)), np.zeros(0), np.zeros((0,3)))
+        self.update_grid()
+        self.static_rect = (x,y,w,h)
+        self.gr = (x,y,w,h)
+        return self.static_rect
+
+    # --------------------------------------------------
+
+    def init_floating_obj(self, session_type, num_of_fo=5):
+        self.static_rect = None
+        if session_type == 'immersion':
+            if uniform(0,1) < 0.5:
+                minX = self.fo_max_rad
+                maxX = self.wSize[0]/self.scr_sec[0]-self.fo_max_rad
+            else:
+                minX = self.wSize[0]-self.wSize[0]/self.scr_sec[0]+self.fo_max_rad
+                maxX = self.wSize[0]-self.fo_max_rad
+        else: # stimulus will appear only on the center screen (touchscreen)
+            minX = self.ctr_rect[0]
+            maxX = self.ctr_rect[2]
+        pos = np.column_stack((
+                np.random.randint(int(minX), int(maxX)+1, num_of_fo),
+                np.random.randint(self.fo_max_rad,
+                                  min(self.s_h)-self.fo_max_rad+1,
+                                  num_of_fo)
+                ))
+        rad = np.random.randint(self.fo_min_rad, self.fo_max_rad+1, num_of_fo)
+        self.fo.init(pos, rad, [self.fo_col]*num_of_fo)
+        self.update_grid()
+        self.calc_group_rect()
+        self.init_path_pool(session_type)
+        self.fo_pos_idx = [ int(float(self.gctr[0]) / self.wSize[0] * 5) - 2, int(float(self.gctr[1]) / self.wSize[1] * 5) - 2 ] # -2 ~ 2
+        self.flag_rad_change = True # random radius change
+
+    # --------------------------------------------------
+
+    def init_path_pool(self, session_type):
+        ''' (re)start the path pool for the session type
+        and chain its trajectories from the current group center
+        '''
+        if session_type == 'immersion':
+            self.path_kind = 'immersion'
+            kinds = ['immersion', 'center']
+        else:
+            self.path_kind = 'movements'
+            kinds = ['movements']
+        if self.path_pool == None or self.path_pool.kinds != kinds:
+            if self.path_pool != None: self.path_pool.stop()
+            geom = dict(wSize=self.wSize,
+                        s_w=self.s_w,
+                        s_h=self.s_h,
+                        ctr_rect=self.ctr_rect,
+                        refresh_rate=self.refresh_rate,
+                        fo_min_spd=self.fo_min_spd,
+                        fo_max_spd=self.fo_max_spd)
+            self.path_pool = PathPool(geom,
+                                      kinds,
+                                      self.path_pool_depth,
+                                      self.path_seed)
+            self.path_pool.start_thread()
+        self.path_pool.reset(self.gctr)
+
+    # --------------------------------------------------
+
+    def update_grid(self):
+        self.grid.build(self.fo.pos, self.fo.rad)
+
+    # --------------------------------------------------
+
+    def calc_group_rect(self):
+        margin = 50
+        x1, y1, x2, y2 = self.fo.bounds()
+        minX = x1 - margin
+        minY = y1 - margin
+        w = x2 - minX + margin # width of group
+        h = y2 - minY + margin # height of group
+        self.gr = (minX, minY, w, h)
+        self.gctr = ( minX+w//2, minY+h//2 )
+
+    # --------------------------------------------------
+
+    def step(self, k=1):
+        ''' advance floating objects 'k' steps.
+        returns (x,y,z) index for audio when the screen section
+        of the group changed, otherwise None
+        '''
+        self.calc_group_rect() # calculate center point of the group
+        fo_pos_idx_ = [
+                int(float(self.gctr[0])/self.wSize[0]*self.scr_sec[0])+1,
+                int(float(self.gctr[1])/self.wSize[1]*self.scr_sec[1])
+                ]
+        idxAO = None
+        if self.fo_pos_idx != fo_pos_idx_:
+        # if FO group's position area is changed
+            self.fo_pos_idx = [fo_pos_idx_[0], fo_pos_idx_[1]] # update the info
+            idxAO = [fo_pos_idx_[0] - (self.scr_sec[0]/2),
+                     fo_pos_idx_[1] - (self.scr_sec[1]/2)]
+            idxAO[0] *= -1 # change symbol (left <-> right)
+            idxAO.append(0) # z index depends on x index
+              # in our three screen configuration
+
+        done = np.where(self.fo.remaining() < k)[0] # objects running out
+          # of track
+        self.fo.advance(k) # move 'k' coordinates along each track
+        if len(done) > 0:
+        ### ran out of track data.
+        ###   get a new group trajectory (pre-generated by the path pool)
+        ###   with individual randomness of each object
+            path = self.path_pool.get(self.path_kind)
+            tracks = self.path_pool.tracks(path, self.fo.pos[done])
+            self.fo.set_tracks(tracks, done)
+
+        if self.flag_rad_change == True:
+            ### random radius change of each fo
+            for i in range(k):
+                self.fo.step_rad(self.chance_to_change_rad,
+                                 self.fo_min_rad,
+                                 self.fo_max_rad)
+        self.update_grid()
+        return idxAO
+
+    # --------------------------------------------------
+
+    def touch(self, pt):
+        ''' hit-test a touch at 'pt' (x,y).
+        returns dict; 'ids': indices of touched objects,
+          'nearest': index of the nearest object (-1: none),
+          'dist': distance (pixels) to the edge of the nearest object,
+          'hit': whether the stimulus is touched
+        (with the static image, 'hit' is whether 'pt' is in its rect)
+        '''
+        ids, ni, dist = self.grid.query(pt, self.touch_pad)
+        if self.static_rect != None:
+            r = self.static_rect
+            hit = (r[0] <= pt[0] <= r[0]+r[2]) and (r[1] <= pt[1] <= r[1]+r[3])
+        else:
+            hit = len(ids) > 0
+        return dict(ids=ids.tolist(), nearest=ni, dist=dist, hit=hit)
+
+    # --------------------------------------------------
+
+    def hit_test(self, pt):
+        ''' whether the stimulus is touched at 'pt' (x,y)
+        '''
+        return self.touch(pt)['hit']
+
+    # --------------------------------------------------
+
+    def scatter(self):
+        ''' break objects into small pieces, flying away from the group center
+        '''
+        steps = int(self.refresh_rate/4)
+        self.fo.scatter(10, self.fo_min_rad//2)
+        self.update_grid()
+        self.calc_group_rect()
+        self.flag_rad_change = False
+        ### set track points; straight away from the group center
+        orig = self.fo.pos
+        sign = np.sign(orig - np.array(self.gctr))
+        dest = orig + sign * np.random.randint(1, 501, orig.shape)
+        self.fo.set_tracks(linear_tracks(orig, dest, steps))
+
+    # --------------------------------------------------
+
+    def move_straight(self, dest, steps):
+        ''' move objects straight to around 'dest' in 'steps' steps
+        '''
+        orig = self.fo.pos
+        dest_ = np.array(dest) + np.random.randint(-50, 51, orig.shape)
+        self.fo.set_tracks(linear_tracks(orig, dest_, steps))
+        self.path_pool.reset(dest) # next paths start here
+
+    # --------------------------------------------------
+
+    def curve_to_center(self):
+        ''' move objects along a curve to the center screen
+        '''
+        path = self.path_pool.get('center')
+        self.fo.set_tracks(self.path_pool.tracks(path, self.fo.pos))
+        self.path_pool.reset(path['dest'])
+
+    # --------------------------------------------------
+
+    def stop(self):
+        if self.path_pool != None: self.path_pool.stop()
+
+# ======================================================
+
+class ArrayRenderer:
+    def __init__(self, size, bgCol=(119,119,119), scale=1.0, n_pens=64,
+                 pen_width=2):
+        ''' size: size of the stimulus area (width, height)
+        bgCol: background color (r,g,b)
+        scale: scale of the image to the stimulus area
+        '''
+        self.scale = scale
+        self.size = (int(size[0]*scale), int(size[1]*scale))
+        self.bg = tuple(bgCol[::-1]) # BGR
+        self.img = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self.pen_width = max(1, int(round(pen_width*scale)))
+        self.pens = [tuple(int(v) for v in np.random.randint(0, 256, 3))
+                     for i in range(n_pens)] # random outline colors
+        self.prev_bounds = None
+        self.clear()
+
+    # --------------------------------------------------
+
+    def clear(self):
+        self.img[:] = self.bg
+        self.prev_bounds = None
+
+    # --------------------------------------------------
+
+    def bounds(self, pos, rad):
+        ''' rect (x1,y1,x2,y2) bounding all circles in the image, or None
+        (None also when all circles are outside the image)
+        '''
+        if len(pos) == 0: return None
+        m = self.pen_width + 1
+        x1, y1 = ((pos - rad[:,None]).min(axis=0) * self.scale).astype(int) - m
+        x2, y2 = ((pos + rad[:,None]).max(axis=0) * self.scale).astype(int) + m
+        w, h = self.size
+        x1, x2 = min(max(0, x1), w), min(max(0, x2+1), w)
+        y1, y2 = min(max(0, y1), h), min(max(0, y2+1), h)
+        if x2 <= x1 or y2 <= y1: return None
+        return (int(x1), int(y1), int(x2), int(y2))
+
+    # --------------------------------------------------
+
+    def draw_fo(self, pos, rad, col):
+        ''' draw circles; pos: (n, 2) array, rad: (n,) array,
+        col: (n, 3) RGB fill colors.
+        only the previous and the new bounds of objects are cleared.
+        returns the changed rect (x1,y1,x2,y2); union of the previous and
+        the new bounds, or None
+        '''
+        pos = np.asarray(pos).reshape(-1, 2)
+        rad = np.asarray(rad)
+        b = self.bounds(pos, rad)
+        rs = [r for r in [self.prev_bounds, b] if r is not None]
+        for r in rs: self.img[r[1]:r[3], r[0]:r[2]] = self.bg
+        self.prev_bounds = b
+        if len(rs) == 0: dirty = None
+        else: dirty = (min([r[0] for r in rs]), min([r[1] for r in rs]),
+                       max([r[2] for r in rs]), max([r[3] for r in rs]))
+        pl = np.round(pos * self.scale).astype(int).tolist()
+        rl = np.maximum(1, np.round(rad * self.scale)).astype(int).tolist()
+        cl = [tuple(c[::-1]) for c in np.asarray(col).reshape(-1, 3).tolist()]
+        pi = np.random.randint(0, len(self.pens), len(pl))
+        for i in range(len(pl)):
+            cv2.circle(self.img, tuple(pl[i]), rl[i], cl[i], -1, cv2.LINE_AA)
+            cv2.circle(self.img, tuple(pl[i]), rl[i], self.pens[pi[i]],
+                       self.pen_width, cv2.LINE_AA)
+        return dirty
+
+    # --------------------------------------------------
+
+    def draw_rect(self, rect, penCol=(0,0,0), brushCol=(51,51,51)):
+        ''' draw a rectangle (static image); rect: (x,y,w,h)
+        '''
+        self.clear()
+        x, y, w, h = [int(v*self.scale) for v in rect]
+        cv2.rectangle(self.img, (x,y), (x+w,y+h), tuple(brushCol[::-1]), -1)
+        cv2.rectangle(self.img, (x,y), (x+w,y+h), tuple(penCol[::-1]), 1)
+
+# ======================================================
+
+def simulate(session_type='movements', seconds=10, num_of_fo=1,
+             s_w=[1920]*3, s_h=[1080]*3, rate=60, scale=0.25, seed=None,
+             touch_at=None, out=None, fourcc='XVID'):
+    ''' run the stimulus of a session type for 'seconds'
+    (as fast as possible) and render each step.
+    touch_at: time (sec) to touch the group (scatter)
+    out: file path to save the rendered video
+    returns stats
+    '''
+    if seed is not None: np.random.seed(seed)
+    stim = StimulusModel(s_w, s_h, refresh_rate=rate, path_seed=seed)
+    rndr = ArrayRenderer(stim.wSize, scale=scale)
+    if session_type == 'static':
+        rndr.draw_rect(stim.init_static_img())
+    else:
+        stim.init_floating_obj(session_type, num_of_fo)
+    writer = None
+    if out != None:
+        writer = cv2.VideoWriter(out, cv2.VideoWriter_fourcc(*fourcc), rate,
+                                 rndr.size)
+    n_steps = int(seconds*rate)
+    n_fo_move = 0; n_touched = 0
+    t_step = 0.0; t_draw = 0.0; t_write = 0.0
+    for i in range(n_steps):
+        t0 = perf_counter()
+        if session_type != 'static':
+            if touch_at is not None and i == int(touch_at*rate):
+                if stim.hit_test(stim.fo.pos[0]):
+                    stim.scatter()
+                    n_touched += 1
+            if stim.step(1) is not None: n_fo_move += 1
+        t1 = perf_counter()
+        if session_type != 'static':
+            rndr.draw_fo(stim.fo.pos, stim.fo.rad, stim.fo.col)
+        t2 = perf_counter()
+        if writer != None: writer.write(rndr.img)
+        t_write += perf_counter()-t2
+        t_step += t1-t0; t_draw += t2-t1
+    if writer != None: writer.release()
+    stim.stop()
+    n = max(1, n_steps)
+    return dict(steps=n_steps,
+                fo_move=n_fo_move,
+                touched=n_touched,
+                step_ms=t_step/n*1000,
+                draw_ms=t_draw/n*1000,
+                write_ms=t_write/n*1000,
+                fps=n/max(1e-9, t_step+t_draw+t_write),
+                img_size=rndr.size,
+                path_pool=stim.path_pool.stat_str() if stim.path_pool else '')
+
+# ------------------------------------------------------
+
+def bench(n_objs=[1, 5, 50, 500], scales=[0.25, 1.0], seconds=10):
+    ''' steps per second of the stimulus model and the renderer
+    at virtual three-screen geometry
+    '''
+    for session_type in ['movements', 'immersion']:
+        for scale in scales:
+            for n in n_objs:
+                s = simulate(session_type, seconds, n, scale=scale, seed=0)
+                print("%10s, %s, %4i objects: step %.3f ms, draw %.3f ms,"\
+                      " %.0f steps/sec"%(session_type, str(s['img_size']), n,
+                                         s['step_ms'], s['draw_ms'], s['fps']))
+
+# ======================================================
+
+def main(args=None):
+    ap = argparse.ArgumentParser(description="Simulate/render the CATOS"\
+                                 " stimulus without a display")
+    ap.add_argument("--session", default='movements',
+                    choices=['movements', 'immersion', 'static'])
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--objects", type=int, default=1)
+    ap.add_argument("--screens", default='1920x1080,1920x1080,1920x1080',
+                    help="virtual screens; WxH separated by comma")
+    ap.add_argument("--rate", type=int, default=60)
+    ap.add_argument("--scale", type=float, default=0.25)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--touch-at", type=float, default=None)
+    ap.add_argument("--out", default=None, help="video file to write")
+    ap.add_argument("--bench", action='store_true')
+    args = ap.parse_args(args)
+    if args.bench: bench(); return
+    scr = [tuple(int(v) for v in s.split('x')) for s in args.screens.split(',')]
+    s = simulate(args.session, args.seconds, args.objects,
+                 [w for w, h in scr], [h for w, h in scr], args.rate,
+                 args.scale, args.seed, args.touch_at, args.out)
+    for k in sorted(s.keys()): print("%10s: %s"%(k, str(s[k])))
+
+# ======================================================
+
+if __name__ == '__main__': main()
@@ -0,0 +1,269 @@
+# coding: UTF-8
+
+"""
+This is for recording sensor data streamed by Arduino-chips
+('header, v1, v2, ..., EOM' frames) in a session.
+
+Each frame is timestamped on arrival (perf_counter_ns) and appended
+to preallocated NumPy chunks of its header; a (chunk_len,) record array
+of TELEMETRY_DTYPE(n) with 't_ns' and 'v' (n values). A background
+thread spills filled rows to .npy segments every 'spill_intv' seconds
+(or when a chunk is full):
+  <folder>/<header>/seg_00000.npy, seg_00001.npy, ...
+  <folder>/meta.json; wall-clock time and perf_counter_ns at the start
+Readers memory-map the segments (load / segments), so nothing goes
+through the text log and nothing has to be parsed after a session.
+
+Frames which are not numeric (such as 'ack, feed') are ignored.
+
+Usage: python -m modules.telemetry [folder ...]
+  prints headers, number of rows and rate of telemetry folders
+  (without a folder, runs a benchmark)
+"""
+
+import json
+from os import path, mkdir, listdir
+from glob import glob
+from time import time, perf_counter, perf_counter_ns
+from threading import Thread, Event, Lock
+
+import numpy as np
+
+# ======================================================
+
+def TELEMETRY_DTYPE(n_vals):
+    return np.dtype([('t_ns', '<i8'), ('v', '<f8', (n_vals,))])
+
+# ======================================================
+
+class _Column:
+    ''' chunks of a header
+    '''
+    def __init__(self, folder, n_vals, chunk_len):
+        self.folder = folder
+        self.dtype = TELEMETRY_DTYPE(n_vals)
+        self.n_vals = n_vals
+        self.chunk_len = chunk_len
+        self.chunk = np.zeros(chunk_len, dtype=self.dtype)
+        self.n = 0 # filled rows of the current chunk
+        self.full = [] # filled chunks waiting to be spilled
+        self.n_seg = 0
+        self.n_rows = 0
+
+    def append(self, t_ns, vals):
+        row = self.chunk[self.n]
+        row['t_ns'] = t_ns
+        row['v'] = vals
+        self.n += 1
+        self.n_rows += 1
+        if self.n == self.chunk_len:
+            self.full.append(self.chunk)
+            self.chunk = np.zeros(self.chunk_len, dtype=self.dtype)
+            self.n = 0
+
+    def take(self):
+        ''' filled rows to spill; should be called with the lock
+        '''
+        arrs = self.full
+        self.full = []
+        if self.n > 0:
+            arrs.append(self.chunk[:self.n].copy())
+            self.n = 0 # (the chunk is reused)
+        return arrs
+
+# ======================================================
+
+class TelemetryStore:
+    def __init__(self, folder, chunk_len=4096, spill_intv=5.0, headers=None):
+        ''' folder: folder to write segments (created, if necessary)
+        chunk_len: rows of a preallocated chunk
+        spill_intv: seconds between writing segments
+        headers: headers to record (None: every numeric frame)
+        '''
+        self.folder = folder
+        if not path.isdir(folder): mkdir(folder)
+        self.chunk_len = chunk_len
+        self.spill_intv = spill_intv
+        self.headers = None if headers is None else set(headers)
+        self.cols = {} # key: header, value: _Column
+        self.lock = Lock() # for cols (frames may come from several boards)
+        self.wlock = Lock() # for writing segments
+        self.stats = dict(frames=0, ignored=0, mismatch=0, segments=0)
+        with open(path.join(folder, 'meta.json'), 'w') as f:
+            json.dump(dict(wall_time=time(), t_ns=perf_counter_ns()), f)
+        self.wake = Event() # wakes up the spilling thread
+        self.flag_stop = False
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+
+    # --------------------------------------------------
+
+    def ingest(self, items, t_ns=None):
+        ''' a parsed frame (list of strings; header first)
+        (called in the reader thread of a board)
+        '''
+        if t_ns is None: t_ns = perf_counter_ns()
+        header = items[0]
+        if len(items) < 2 or \
+          (self.headers is not None and header not in self.headers):
+            self.stats['ignored'] += 1
+            return
+        try: vals = [float(v) for v in items[1:]]
+        except ValueError:
+            self.stats['ignored'] += 1
+            return
+        with self.lock:
+            col = self.cols.get(header)
+            if col is None:
+                if header in ['.', '..'] or '/' in header or '\\' in header:
+                    self.stats['ignored'] += 1
+                    return
+                col = _Column(path.join(self.folder, header), len(vals),
+                              self.chunk_len)
+                self.cols[header] = col
+            if len(vals) != col.n_vals: # keep the columns of the header
+                self.stats['mismatch'] += 1
+                vals = (vals + [np.nan]*col.n_vals)[:col.n_vals]
+            col.append(t_ns, vals)
+            self.stats['frames'] += 1
+            flag_full = len(col.full) > 0
+        if flag_full: self.wake.set()
+
+    # --------------------------------------------------
+
+    def run(self):
+        ''' spilling thread
+        '''
+        while not self.flag_stop:
+            self.wake.wait(self.spill_intv)
+            self.wake.clear()
+            self.spill()
+        self.spill()
+
+    # --------------------------------------------------
+
+    def spill(self):
+        ''' write filled rows to segments
+        '''
+        with self.wlock:
+            with self.lock:
+                todo = [(col, col.take()) for col in self.cols.values()]
+            for col, arrs in todo:
+                if len(arrs) == 0: continue
+                if not path.isdir(col.folder): mkdir(col.folder)
+                arr = arrs[0] if len(arrs) == 1 else np.concatenate(arrs)
+                np.save(path.join(col.folder, 'seg_%.5i.npy'%(col.n_seg)), arr)
+                col.n_seg += 1
+                self.stats['segments'] += 1
+
+    # --------------------------------------------------
+
+    def close(self):
+        ''' write the rest and stop the spilling thread
+        '''
+        self.flag_stop = True
+        self.wake.set()
+        self.thrd.join(10)
+
+    # --------------------------------------------------
+
+    def stat_str(self):
+        with self.lock:
+            rows = ', '.join(["%s: %i"%(h, self.cols[h].n_rows) for h in
+                              sorted(self.cols.keys())])
+        return "telemetry frames: %i (%s), ignored: %i, mismatched: %i,"\
+               " segments: %i"%(self.stats['frames'], rows,
+                                self.stats['ignored'], self.stats['mismatch'],
+                                self.stats['segments'])
+
+# ======================================================
+
+def headers(folder):
+    ''' headers recorded in a telemetry folder
+    '''
+    return sorted([h for h in listdir(folder)
+                   if path.isdir(path.join(folder, h))])
+
+# --------------------------------------------------
+
+def segments(folder, header):
+    ''' memory-mapped segments (record arrays) of 'header'
+    '''
+    fps = sorted(glob(path.join(folder, header, 'seg_*.npy')))
+    return [np.load(fp, mmap_mode='r') for fp in fps]
+
+# --------------------------------------------------
+
+def load(folder, header, t_range=None):
+    ''' rows of 'header' (record array; 't_ns', 'v');
+    only rows in t_range (t_ns from, t_ns to), if it's given
+    '''
+    segs = segments(folder, header)
+    if t_range is not None:
+        segs = [s for s in segs if len(s) > 0 and
+                s['t_ns'][0] <= t_range[1] and s['t_ns'][-1] >= t_range[0]]
+    if len(segs) == 0: return np.zeros(0, dtype=TELEMETRY_DTYPE(1))
+    arr = np.concatenate(segs)
+    if t_range is not None:
+        arr = arr[(arr['t_ns'] >= t_range[0]) & (arr['t_ns'] <= t_range[1])]
+    return arr
+
+# --------------------------------------------------
+
+def summarize(folder):
+    for h in headers(folder):
+        arr = load(folder, h)
+        if len(arr) == 0: continue
+        el = (arr['t_ns'][-1] - arr['t_ns'][0]) / 1e9
+        print("  %-12s rows: %8i, values: %i, %.1f Hz"%(h, len(arr),
+                        arr['v'].shape[1], len(arr)/el if el > 0 else 0))
+
+# ======================================================
+
+def bench(rate=500, duration=600, n_vals=4):
+    ''' ingestion cost per frame and loading time of a session
+    vs. parsing the same frames from text log lines
+    '''
+    import tempfile, shutil
+    n = rate * duration
+    frames = [['motion'] + ['%.2f'%(v) for v in np.random.rand(n_vals)]
+              for i in range(1000)]
+    tmp_dir = tempfile.mkdtemp()
+    ts = TelemetryStore(path.join(tmp_dir, 'telemetry'), spill_intv=1.0)
+    t0 = perf_counter()
+    for i in range(n): ts.ingest(frames[i % 1000], i*(10**9//rate))
+    t_ingest = (perf_counter()-t0)/n
+    ts.close()
+    t0 = perf_counter()
+    arr = load(ts.folder, 'motion')
+    t_load = perf_counter()-t0
+    assert len(arr) == n and arr['v'].shape == (n, n_vals)
+    ### the same frames as text log lines
+    fp = path.join(tmp_dir, 'sensor.log')
+    with open(fp, 'w') as f:
+        for i in range(n):
+            f.write("2016_01_01_10_11_12, [arduino], %i, %s\n"%(i,
+                                                ', '.join(frames[i % 1000])))
+    t0 = perf_counter()
+    rows = []
+    with open(fp) as f:
+        for line in f:
+            items = [m.strip() for m in line.split(',')]
+            if items[3] != 'motion': continue
+            rows.append([float(v) for v in items[4:]])
+    arr_txt = np.array(rows)
+    t_parse = perf_counter()-t0
+    assert np.allclose(arr_txt, arr['v'])
+    shutil.rmtree(tmp_dir)
+    print("%i frames (%i Hz, %i sec); ingestion %.2f us/frame,"\
+          " loading %.1f ms (text log parsing %.1f ms)"%(n, rate, duration,
+                                    t_ingest*1e6, t_load*1000, t_parse*1000))
+
+# ======================================================
+
+if __name__ == '__main__':
+    from sys import argv
+    if len(argv) < 2: bench()
+    for folder in argv[1:]:
+        print(folder)
+        summarize(folder)
@@ -0,0 +1,184 @@
+# coding: UTF-8
+
+"""
+This is for tracing the latency from a touch on the stimulus to the
+reward (feeder) across VideoOut, the session manager and Arduino.
+
+Each touch gets a correlation ID (cid), which travels in the message
+args (such as 'videoOut/stim_touched/<cid>'). Each hop stamps
+(cid, hop, monotonic time in ns) into the trace file of the session;
+a binary file of fixed-size records (TRACE_DTYPE) after a short header.
+Stamps are buffered and written when a touch reaches its last hops,
+so a crash loses no finished touch.
+
+Usage: python -m modules.trace trace_file [trace_file ...]
+  prints latency percentiles of each segment per session (file)
+"""
+
+import sys
+from os import getpid
+from threading import Lock
+from time import perf_counter_ns
+
+import numpy as np
+
+TRACE_MAGIC = b'CATOSTR1'
+TRACE_DTYPE = np.dtype([('cid', '<u4'), ('hop', 'u1'), ('t_ns', '<i8')])
+HOPS = ['touch', 'q_put', 'q_get', 'ser_write', 'ser_flush', 'ack']
+TOUCH, Q_PUT, Q_GET, SER_WRITE, SER_FLUSH, ACK = range(len(HOPS))
+END_HOPS = (SER_FLUSH, ACK) # hops which end a touch
+
+# ======================================================
+
+class Tracer:
+    def __init__(self, buf_records=256):
+        ''' buf_records: number of records to buffer before writing
+        '''
+        self.pid = getpid()
+        self.buf_records = buf_records
+        self.lock = Lock()
+        self.f = None # trace file of the current session
+        self.file_path = ''
+        self.buf = np.zeros(buf_records, dtype=TRACE_DTYPE)
+        self.n_buf = 0
+        self.last_cid = 0
+
+    # --------------------------------------------------
+
+    def start_session(self, file_path):
+        ''' start writing stamps to 'file_path'
+        '''
+        with self.lock:
+            self._close()
+            self.f = open(file_path, 'wb')
+            self.f.write(TRACE_MAGIC)
+            self.file_path = file_path
+
+    # --------------------------------------------------
+
+    def end_session(self):
+        with self.lock: self._close()
+
+    # --------------------------------------------------
+
+    def _close(self):
+        if self.f is None: return
+        self._write_buf()
+        self.f.close()
+        self.f = None
+
+    # --------------------------------------------------
+
+    def _write_buf(self):
+        if self.n_buf > 0:
+            self.f.write(self.buf[:self.n_buf].tobytes())
+            self.n_buf = 0
+        self.f.flush()
+
+    # --------------------------------------------------
+
+    def new_cid(self):
+        ''' returns a new correlation ID (1 or larger)
+        '''
+        with self.lock:
+            self.last_cid += 1
+            return self.last_cid
+
+    # --------------------------------------------------
+
+    def stamp(self, cid, hop, t_ns=None):
+        ''' record that 'cid' reached 'hop' now (or at 't_ns').
+        does nothing without a session or a cid (0 or None)
+        (the last hops of a touch, SER_FLUSH and ACK, are written to
+        the file immediately)
+        '''
+        if t_ns is None: t_ns = perf_counter_ns()
+        if self.f is None or not cid: return
+        with self.lock:
+            if self.f is None: return
+            self.buf[self.n_buf] = (cid, hop, t_ns)
+            self.n_buf += 1
+            if self.n_buf == self.buf_records or hop in END_HOPS:
+                self._write_buf()
+
+    # --------------------------------------------------
+
+    def flush(self):
+        with self.lock:
+            if self.f is not None: self._write_buf()
+
+# ======================================================
+
+_TRACER = None
+_lock = Lock()
+
+def get_tracer():
+    ''' returns the tracer of the current process
+    '''
+    global _TRACER
+    with _lock:
+        if _TRACER is None or _TRACER.pid != getpid(): _TRACER = Tracer()
+    return _TRACER
+
+# --------------------------------------------------
+
+def cid_from_args(args, idx=0):
+    ''' correlation ID in message args (list of strings); 0 if there's none
+    '''
+    try: return int(args[idx])
+    except (IndexError, TypeError, ValueError): return 0
+
+# ======================================================
+
+def read_trace(file_path):
+    ''' returns records of a trace file (TRACE_DTYPE array)
+    '''
+    with open(file_path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("Not a trace file: %s"%(file_path))
+        data = f.read()
+    n = len(data) // TRACE_DTYPE.itemsize # (ignore a cut-off last record)
+    return np.frombuffer(data[:n*TRACE_DTYPE.itemsize], dtype=TRACE_DTYPE)
+
+# --------------------------------------------------
+
+def hop_table(rec):
+    ''' returns (cids, (n_cids, n_hops) array of times in ns; -1 = missing)
+    (the first stamp of each hop of a cid is used)
+    '''
+    cids = np.unique(rec['cid'])
+    tbl = np.full((len(cids), len(HOPS)), -1, dtype=np.int64)
+    ci = np.searchsorted(cids, rec['cid'])
+    for k in range(len(rec)-1, -1, -1): # reversed; the first stamp remains
+        tbl[ci[k], rec['hop'][k]] = rec['t_ns'][k]
+    return cids, tbl
+
+# --------------------------------------------------
+
+def summarize(file_path, pcts=[50, 90, 99]):
+    ''' print latency percentiles (ms) of each segment between
+    consecutive hops and touch-to-flush/ack of a trace file
+    '''
+    rec = read_trace(file_path)
+    cids, tbl = hop_table(rec)
+    print("%s: %i touches traced"%(file_path, len(cids)))
+    if len(cids) == 0: return
+    segs = [(HOPS[i], HOPS[i+1], i, i+1) for i in range(len(HOPS)-1)]
+    segs += [('touch', 'ser_flush', TOUCH, SER_FLUSH),
+             ('touch', 'ack', TOUCH, ACK)]
+    hdr = "  %-22s %6s"%('segment', 'n')
+    for p in pcts: hdr += " %9s"%('p%i'%p)
+    print(hdr + " %9s"%('max'))
+    for name1, name2, h1, h2 in segs:
+        ok = (tbl[:,h1] >= 0) & (tbl[:,h2] >= 0)
+        if ok.sum() == 0: continue
+        d = (tbl[ok,h2] - tbl[ok,h1]) / 1e6
+        line = "  %-22s %6i"%(name1+' > '+name2, ok.sum())
+        for p in pcts: line += " %9.3f"%(np.percentile(d, p))
+        print(line + " %9.3f"%(d.max()))
+
+# ======================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2: print("Usage: python -m modules.trace trace_file [trace_file ...]")
+    for fp in sys.argv[1:]: summarize(fp)
@@ -8,45 +8,95 @@ sessions with common marmoset monkeys by Jinook Oh
 in CogBio dept. University of Vienna in 2016
 """
 
-from time import time, sleep
+from time import time, sleep, perf_counter
 from datetime import datetime
 from copy import copy
 from os import path, mkdir
-from queue import Queue
+from queue import Queue, Empty
 
 import cv2
-import numpy as np
 
-from modules.misc_funcs import get_time_stamp, writeFile, chk_fps, chk_msg_q, calc_pt_line_dist
+from modules.misc_funcs import get_time_stamp, writeFile, chk_fps, chk_msg_q
+from modules.frame_buffer import FrameRing
+from modules.video_rec import VideoRecorder
+from modules.bg_model import make_bg_model
+from modules.motion import MotionDetector, chk_contours
+from modules.motion import close_to_screen, find_red_tape
+from modules.color_det import ColorDetector
+from modules.msg_bus import Msg
 
 # ======================================================
 
 class VideoIn:
-    def __init__(self, parent, cam_idx, pos=(300, 25)):
+    def __init__(self, parent, cam_idx, pos=(300, 25), bg_model='frozen',
+                 frame_q=None, cap_pos=0, fSize=None, src=None):
+        ''' src: webcam index or video file path to open
+          (None: same as cam_idx)
+        frame_q: queue of FrameSets from CaptureCoordinator
+          (None: this instance opens the webcam by itself)
+        cap_pos: index of this camera in a FrameSet
+        fSize: frame size, when frames come from frame_q
+        '''
         self.flagWindow = False # create an opencv window or not
         self.contour_threshold = 40
+        # background model; 'frozen', 'running_avg', 'mog2' or 'knn'
+        self.bg_model_type = bg_model
+        self.bg_update_intv = 5 # update background model on every n-th frame
+        self.diff_th = 50 # threshold of difference to the background
         # points for Region Of Interest 
         self.roi_pts = [(50,50), (750,50), (750,550), (50,550)] 
+        # 'full': analyze the whole frame, 
+        # 'roi': analyze only the bounding box of roi_pts
+        self.analysis_mode = 'full'
+        self.analysis_scale = 1.0 # factor to resize image for analysis
+        # 'contours': bounding rects of contours, 
+        # 'cc': connected components of the motion mask (no contours)
+        self.contour_method = 'contours'
+        # HSV ranges of the red tape (attached on bottom of side monitors)
+        self.red_HSV_ranges = [((175,100,90), (180,255,255))]
+        self.red_track_intv = 0 # detect the red tape again on every n-th
+          # frame (0: only once at the beginning)
+        self.color_det = ColorDetector() # keeps scratch buffers
         # min & max threshold for wrect (whole bounding rect) of movement
         self.m_wrectTh = (100, 1000) 
         #self.fourcc = cv2.VideoWriter_fourcc('x', 'v', 'i', 'd')
         self.fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
         self.video_rec = None # video recorder
+        self.vr_fps = 30 # FPS of recorded video
         # time (seconds) of no-motion to stop video recording
         self.time2stop_vr = 3 
+        self.n_recent = 60 # number of recent frames to keep
+        self.pre_roll = 30 # number of frames before the motion-trigger
+          # to include in a recorded video
+        # number of frames with meaningful movement (m_frames_th[0]) in
+        #   the recent frames (m_frames_th[1]) to start video recording
+        self.m_frames_th = (10, 30)
         self.parent = parent
         self.cam_idx = cam_idx
-        self.cap_cam = cv2.VideoCapture()
-        self.cap_cam.open(cam_idx)
-        sleep(0.5)
-        for i in range(3):
-            ret, frame = self.cap_cam.read()
-            if ret == True: break
-            sleep(0.1)
-        self.fSize = (int(frame.shape[1]), int(frame.shape[0]))
-        #self.cap_cam.set(3, self.fSize[0]) # set the width of frame
-        #self.cap_cam.set(4, self.fSize[1]) # set the height of frame
-        self.cap_cam.set(5, 30) # set FPS
+        self.frame_q = frame_q
+        self.cap_pos = cap_pos
+        self.frame_ts = -1 # monotonic timestamp of the current frame
+        self.n_frames = 0 # number of processed frames
+        self.t_first_frame = -1 # frame_ts of the first processed frame
+        self.sbr = (-1,-1,0,0) # subject bounding rect of the current frame
+        self.ring_buf = None # buffer (such as shared memory) for FrameRing
+        if src == None: src = cam_idx
+        self.flag_file_src = type(src) == str # rewind a video file at its end
+        if frame_q != None:
+            self.cap_cam = None
+            self.fSize = fSize
+        else:
+            self.cap_cam = cv2.VideoCapture()
+            self.cap_cam.open(src)
+            sleep(0.5)
+            for i in range(3):
+                ret, frame = self.cap_cam.read()
+                if ret == True: break
+                sleep(0.1)
+            self.fSize = (int(frame.shape[1]), int(frame.shape[0]))
+            #self.cap_cam.set(3, self.fSize[0]) # set the width of frame
+            #self.cap_cam.set(4, self.fSize[1]) # set the height of frame
+            self.cap_cam.set(5, 30) # set FPS
         self.msg_q = Queue()
         if self.flagWindow:
             cv2.namedWindow('CATOS_CAM%.2i'%self.cam_idx, cv2.WINDOW_NORMAL)
@@ -59,9 +109,9 @@ class VideoIn:
         fps=0; prev_fps=[]; prev_fps_time=time()
         mod_name = 'videoIn-%i'%(self.cam_idx)
         first_run = True
-        recent_imgs = [] # buffer to store 60 recent frames
-        recent_m = [] # storing whether meaningful movements 
-          # happened in the recent 60 frames
+        # buffer to store recent frames and whether meaningful movements
+        #   happened in them
+        self.fr = FrameRing(self.n_recent, fSz, self.ring_buf)
         recent_m_time = -1 # time when movements were enough 
           # to start video recording
         log = "%s, [%s],"%(get_time_stamp(), mod_name)
@@ -70,136 +120,174 @@ class VideoIn:
         writeFile(self.parent.log_file_path, log)
         sleep(1)
         for i in range(10):
-            ret, frame_arr = self.cap_cam.read() # retrieve some images 
-              # giving some time to camera to adjust
+            ret, frame_arr = self.read_frame() # retrieve some 
+              # images giving some time to camera to adjust
         ### find ROI with red color 
         ###   (red tape is attached on bottom of side monitors)
-        r = (0, 0) + fSz # rect to find the color
-        HSV_min = (175,100,90)
-        HSV_max = (180,255,255)
-        red_col = self.find_color(r, frame_arr, HSV_min, HSV_max, (0,0,0))
-        wr, rects = self.chk_contours(red_col, self.contour_threshold)
-        if wr == (-1,-1,0,0):
+        redY = self.find_red_tape(frame_arr)
+        if redY == -1:
             writeFile(self.parent.log_file_path, "%s, [%s], Red color detection failed.\n"%(get_time_stamp(), mod_name))
-            redY = -1
-        else:
-            redY = int(wr[1]+wr[3]/2) # middle y position of red tape
-        bgImg = frame_arr.copy() # store background image
+        bgm = make_bg_model(self.bg_model_type, 
+                            update_intv=self.bg_update_intv,
+                            diff_th=self.diff_th)
+        if self.analysis_mode == 'roi': roi_pts = self.roi_pts
+        else: roi_pts = None
+        self.md = MotionDetector(fSz, 
+                                 bgm, 
+                                 roi_pts, 
+                                 self.analysis_scale, 
+                                 contour_threshold=20, 
+                                 contour_method=self.contour_method)
+        self.md.init(frame_arr) # store background image
         while True:
             fps, prev_fps, prev_fps_time = chk_fps(mod_name, 
                                                    fps, 
                                                    prev_fps, 
                                                    prev_fps_time, 
                                                    self.parent.log_file_path)
-            ret, frame_arr = self.cap_cam.read() # get a new frame
+            ret, frame_arr = self.read_frame() # get a new frame
             if ret == False: sleep(0.1); continue
-
-            recent_imgs.append(frame_arr)
-            if len(recent_imgs) > 60: recent_imgs.pop(0)
-            recent_m.append(False)
-            if len(recent_m) > 60: recent_m.pop(0)
+            self.fr.push(self.frame_ts)
+            if self.n_frames == 0: self.t_first_frame = self.frame_ts
+            self.n_frames += 1
+            if self.flagWindow: disp_arr = frame_arr.copy() # image to show.
+              # (frame_arr stays clean in the buffer for video recording)
 
             if flag_chk_cam_view == False:
-                ### extract subject image by obtaining difference image 
-                ###   between the frame_arr and bgImg
-                diff = cv2.absdiff(frame_arr, bgImg) 
-                diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-                __, diff = cv2.threshold(diff, 50, 255, cv2.THRESH_BINARY)
-                kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
-                diff = cv2.morphologyEx(diff, 
-                                        cv2.MORPH_OPEN, 
-                                        kernel, 
-                                        iterations=1) # decrease noise and
-                                                      # minor features
-                #M = cv2.moments(diff)
-                #print self.cam_idx, M['m00']/255
-                diff = cv2.Canny(diff, 150, 150)
-                sbr, rects = self.chk_contours(diff.copy(), 20) # sbr = subject
-                                                                # bounding rect
+                if self.red_track_intv > 0 and \
+                  self.fr.seq % self.red_track_intv == 0:
+                    _y = self.find_red_tape(frame_arr)
+                    if _y != -1: redY = _y
+                ### extract subject by the background model and contours
+                ###   (in ROI, if analysis_mode is 'roi')
+                sbr, rects = self.md.detect(frame_arr) # sbr = subject
+                                                       # bounding rect
+                self.sbr = sbr
                 if sbr != (-1,-1,0,0):
-                    cv2.rectangle(frame_arr, 
-                                  sbr[:2], 
-                                  (sbr[0]+sbr[2],sbr[1]+sbr[3]), 
-                                  (0,255,0), 
-                                  2)
-                    dist_to_s = sbr[1]-redY # distance from red tape(screen) 
-                      # to the subject 
-                    msg = None
-                    if self.cam_idx == 1: # center screen
-                        if dist_to_s < 10: msg = 'center'
-                        else:
-                            sMid = int(sbr[0] + sbr[2]/2)
-                            if sMid < int(fSz[0]/6): msg='left'
-                            elif sMid > int(fSz[0]-fSz[0]/6): msg='right'
-                    else:
-                        if dist_to_s < 100: # close to the screen
-                            if self.cam_idx == 0: msg='left'
-                            else: msg='right'
-                            
-                    if msg != None and self.parent.mods["session_mngr"] != None:
-                        self.parent.mods["session_mngr"].msg_q.put(
-                                        "%s/close_to_screen/%s"%(mod_name,msg), 
-                                        True, 
-                                        None
-                                        )
-                # red color bottom line
-                cv2.line(frame_arr, (0,redY), (640,redY), (0,255,255), 2) 
+                    if self.flagWindow:
+                        cv2.rectangle(disp_arr, 
+                                      sbr[:2], 
+                                      (sbr[0]+sbr[2],sbr[1]+sbr[3]), 
+                                      (0,255,0), 
+                                      2)
+                    if self.m_wrectTh[0] <= sbr[2]+sbr[3] <= self.m_wrectTh[1]:
+                    # meaningful movement
+                        self.fr.set_m(True)
+                        _m = self.fr.last_m(self.m_frames_th[1])
+                        if _m.sum() >= self.m_frames_th[0]:
+                            recent_m_time = time()
+                    msg = close_to_screen(sbr, redY, self.cam_idx, fSz)
+                    if msg != None:
+                        self.parent.bus.publish(Msg(mod_name, 
+                                                    'close_to_screen', 
+                                                    msg, 
+                                                    self.frame_ts))
+                if self.flagWindow: # red color bottom line
+                    cv2.line(disp_arr, (0,redY), (640,redY), (0,255,255), 2) 
+                self.proc_video_rec(recent_m_time, mod_name)
             else: # chk_cam_view
                 pass
                                 
             if self.flagWindow:
-                if flag_chk_cam_view:
-                    cv2.imshow("CATOS_CAM%.2i"%(self.cam_idx), frame_arr)
-                else:
-                    cv2.imshow("CATOS_CAM%.2i"%(self.cam_idx), frame_arr)
+                cv2.imshow("CATOS_CAM%.2i"%(self.cam_idx), disp_arr)
             
-            cv2.waitKey(5)
+                cv2.waitKey(5)
             # listen to a message
             msg_src, msg_body, msg_details = chk_msg_q(self.msg_q) 
             if msg_body == 'quit': break
             
-        self.cap_cam.release()
+        if self.cap_cam != None: self.cap_cam.release()
         if self.flagWindow: cv2.destroyWindow("CATOS_CAM%.2i"%(self.cam_idx))
         log = "%s, [%s],"%(get_time_stamp(), mod_name)
         log += " webcam %i stopped.\n"%(self.cam_idx)
         writeFile(self.parent.log_file_path, log)
-        if self.video_rec != None: self.video_rec.release()
+        if self.video_rec != None:
+            self.video_rec.stop(wait=True) # finish the clip before quitting
+            self.video_rec = None
+
+    # --------------------------------------------------
+
+    def read_frame(self):
+        ''' read a new frame into the next slot of the frame buffer
+        (from the webcam or from the queue of CaptureCoordinator)
+        '''
+        if self.frame_q == None:
+            ret, frame_arr = self.fr.read(self.cap_cam)
+            if ret == False and self.flag_file_src:
+                self.cap_cam.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame_arr = self.fr.read(self.cap_cam)
+            self.frame_ts = perf_counter()
+            return ret, frame_arr
+        try: fs = self.frame_q.get(True, 0.5)
+        except Empty: return False, None
+        frame = fs.frames[self.cap_pos]
+        if frame is None: return False, None
+        frame_arr = self.fr.next_slot()
+        frame_arr[:] = frame
+        self.frame_ts = fs.ts # timestamp, common to all cameras
+        return True, frame_arr
+
+    # --------------------------------------------------
+
+    def proc_video_rec(self, recent_m_time, mod_name):
+        ''' start, continue or stop video recording 
+        depending on the last time of enough movements
+        '''
+        if recent_m_time == -1: return
+        if self.video_rec == None:
+            if time()-recent_m_time < self.time2stop_vr:
+                fn = "%s_cam%.2i.mp4"%(get_time_stamp(), self.cam_idx)
+                fp = path.join(self.parent.output_folder, fn)
+                self.video_rec = VideoRecorder(fp, 
+                                               self.fourcc, 
+                                               self.vr_fps, 
+                                               self.fSize, 
+                                               self.fr, 
+                                               self.pre_roll, 
+                                               on_finish=self.on_video_rec_finish)
+                log = "%s, [%s],"%(get_time_stamp(), mod_name)
+                log += " video recording starts. %s\n"%(fn)
+                writeFile(self.parent.log_file_path, log)
+        else:
+            self.video_rec.put(self.fr.seq-1) # the current frame
+            if time()-recent_m_time > self.time2stop_vr:
+                self.video_rec.stop()
+                self.video_rec = None
+
+    # --------------------------------------------------
+
+    def on_video_rec_finish(self, file_path, stats):
+        ''' called from the writer thread of VideoRecorder
+        '''
+        log = "%s, [videoIn-%i],"%(get_time_stamp(), self.cam_idx)
+        log += " video recording stopped. %s,"%(path.basename(file_path))
+        log += " frames written: %i,"%(stats["written"])
+        log += " dropped (queue full): %i,"%(stats["dropped_q"])
+        log += " dropped (overwritten): %i\n"%(stats["dropped_late"])
+        writeFile(self.parent.log_file_path, log)
+
+    # --------------------------------------------------
+
+    def find_red_tape(self, frame_arr):
+        ''' returns the middle y position of the red tape (-1 if not found)
+        '''
+        return find_red_tape(frame_arr, 
+                             self.color_det, 
+                             self.red_HSV_ranges, 
+                             self.contour_threshold)
 
     # --------------------------------------------------
 
     def find_color(self, rect, inImage, HSV_min, HSV_max, bgColor=(0,0,0)):
     # Find a color(range: 'HSV_min' ~ 'HSV_max') in an area('rect') of an image('inImage')
-    # 'bgcolor' is a background color of the masked image
     # 'rect' here is (x1,y1,x2,y2)
-        tmp_grey_img = np.zeros( (inImage.shape[0], inImage.shape[1]) , dtype=np.uint8 )
-        tmp_col_img = np.zeros( (inImage.shape[0], inImage.shape[1], 3), dtype=np.uint8 )
-        HSV_img = np.zeros( (inImage.shape[0], inImage.shape[1], 3), dtype=np.uint8 )
-        tmp_col_img[:,:,:] = bgColor
-        tmp_col_img[ rect[1]:rect[3], rect[0]:rect[2], : ] = inImage[ rect[1]:rect[3], rect[0]:rect[2], : ].copy()
-        #tmp_col_img = self.preprocessing(tmp_col_img)
-        cv2.cvtColor(tmp_col_img, cv2.COLOR_BGR2HSV, HSV_img)
-        cv2.inRange(HSV_img, HSV_min, HSV_max, tmp_grey_img)
-        return tmp_grey_img
+    # The returned mask is zero outside 'rect' ('bgColor' is not used any more)
+    #   and it's a reused buffer, valid until the next call.
+        return self.color_det.find(inImage, rect, [(HSV_min, HSV_max)])
 
     # --------------------------------------------------
 
     def chk_contours(self, inImage, contour_threshold):
-        contours, hierarchy = cv2.findContours(inImage, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        wrect = [-1,-1,-1,-1] # whole rect, bounding all the contours
-        rects = [] # rects, bounding each contour piece
-        for ci in range(len(contours)):
-            #M = cv2.moments(contours[ci])
-            br = cv2.boundingRect(contours[ci])
-            if br[2] + br[3] > contour_threshold:
-                if wrect[0] == -1 and wrect[1] == -1: wrect[0] = br[0]; wrect[1] = br[1]
-                if wrect[2] == -1 and wrect[3] == -1: wrect[2] = br[0]; wrect[3] = br[1]
-                if br[0] < wrect[0]: wrect[0] = br[0]
-                if br[1] < wrect[1]: wrect[1] = br[1]
-                if (br[0]+br[2]) > wrect[2]: wrect[2] = br[0]+br[2]
-                if (br[1]+br[3]) > wrect[3]: wrect[3] = br[1]+br[3]
-                rects.append(br)
-        wrect[2] = wrect[2]-wrect[0]
-        wrect[3] = wrect[3]-wrect[1]
-        return tuple(wrect), rects
+        return chk_contours(inImage, contour_threshold)
     
     # --------------------------------------------------
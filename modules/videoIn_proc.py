@@ -0,0 +1,224 @@
+# coding: UTF-8
+
+"""
+This is for running VideoIn (capture and motion analysis of a camera)
+in its own worker process, away from the GIL of the wx process.
+
+The worker process runs the same VideoIn.run. Its frame buffer (FrameRing)
+lives in multiprocessing.shared_memory, so the main process can look at
+frames without copying them through a pipe. Only compact results
+(close_to_screen Msg with its timestamp, subject bounding rect and
+sequence number of the frame) come back to the main process,
+where VideoInProc.run publishes them on the message bus.
+'main/quit/True' on msg_q stops the worker as it does with VideoIn.
+
+* multiprocessing.shared_memory requires Python 3.8 or later.
+"""
+
+from time import sleep
+from threading import Thread
+from queue import Empty
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from modules.misc_funcs import flush_log
+from modules.frame_buffer import FrameRing
+from modules.msg_bus import MsgBus
+
+MP_CTX = mp.get_context('spawn') # don't fork the wx process
+
+# ======================================================
+
+class _BusRelay:
+    ''' stands for the message bus (MsgBus) in the worker process
+    '''
+    def __init__(self, res_q):
+        self.res_q = res_q
+        self.vi = None
+
+    def publish(self, msg):
+        if self.vi is None: sbr = (-1,-1,0,0); seq = -1
+        else: sbr = self.vi.sbr; seq = self.vi.fr.seq-1
+        self.res_q.put(('msg', msg, sbr, seq))
+
+# ======================================================
+
+class _ProcParent:
+    ''' stands for CATOSFrame in the worker process
+    '''
+    def __init__(self, log_file_path, output_folder, res_q):
+        self.log_file_path = log_file_path
+        self.output_folder = output_folder
+        self.bus = _BusRelay(res_q)
+
+# ======================================================
+
+def _listen_ctrl(ctrl_q, parent):
+    while True:
+        item = ctrl_q.get(True, None)
+        if item[0] == 'log_file_path': parent.log_file_path = item[1]
+        elif item[0] == 'end': break
+
+# --------------------------------------------------
+
+def _proc_main(cam_idx, src, bg_model, attrs, log_file_path, output_folder,
+               msg_q, res_q, ctrl_q, flag_chk_cam_view, flag_feeder):
+    ''' main function of the worker process
+    '''
+    from modules.videoIn import VideoIn
+    parent = _ProcParent(log_file_path, output_folder, res_q)
+    vi = VideoIn(parent, cam_idx, bg_model=bg_model, src=src)
+    for k in attrs: setattr(vi, k, attrs[k])
+    vi.msg_q = msg_q
+    parent.bus.vi = vi
+    n = vi.n_recent
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=n*vi.fSize[0]*vi.fSize[1]*3)
+    vi.ring_buf = shm.buf
+    res_q.put(('shm', shm.name, n, vi.fSize))
+    Thread(target=_listen_ctrl, args=(ctrl_q, parent), daemon=True).start()
+    try:
+        vi.run(flag_chk_cam_view, flag_feeder)
+    finally:
+        if vi.n_frames > 0: frames_el = vi.frame_ts - vi.t_first_frame
+        else: frames_el = 0.0
+        res_q.put(('stat', vi.n_frames, frames_el))
+        flush_log()
+        vi.fr = None # release the array on the shared memory
+        try: shm.close()
+        except BufferError: pass # still used by a video recording thread
+        shm.unlink()
+        res_q.put(('end', None))
+
+# ======================================================
+
+class VideoInProc:
+    def __init__(self, parent, cam_idx, pos=(300, 25), bg_model='frozen',
+                 src=None, attrs={}):
+        ''' attrs: attributes to set on VideoIn in the worker process
+          (such as analysis_mode or contour_method)
+        '''
+        self.parent = parent
+        self.cam_idx = cam_idx
+        self.src = src
+        self.bg_model = bg_model
+        self.attrs = attrs
+        self.msg_q = MP_CTX.Queue() # messages to VideoIn in worker process
+        self.res_q = MP_CTX.Queue() # results from the worker process
+        self.ctrl_q = MP_CTX.Queue() # control messages to the worker process
+        self.proc = None
+        self.shm = None # shared memory of the frame buffer
+        self.frames = None # frame buffer array (view on self.shm)
+        self.last_seq = -1 # sequence number of the frame with the last result
+        self.last_sbr = (-1,-1,0,0) # subject bounding rect of the last result
+        self.n_frames = 0 # number of frames processed by the worker
+        self.frames_el = 0.0 # seconds from its first frame to the last
+
+    # --------------------------------------------------
+
+    def run(self, flag_chk_cam_view=False, flag_feeder=False):
+        ''' start the worker process and relay its results until it finishes
+        (this runs in a thread of the main process)
+        '''
+        log_file_path = self.parent.log_file_path
+        self.proc = MP_CTX.Process(target=_proc_main,
+                                   args=(self.cam_idx,
+                                         self.src,
+                                         self.bg_model,
+                                         self.attrs,
+                                         log_file_path,
+                                         self.parent.output_folder,
+                                         self.msg_q,
+                                         self.res_q,
+                                         self.ctrl_q,
+                                         flag_chk_cam_view,
+                                         flag_feeder),
+                                   daemon=True)
+        self.proc.start()
+        while True:
+            if self.parent.log_file_path != log_file_path:
+                log_file_path = self.parent.log_file_path
+                self.ctrl_q.put(('log_file_path', log_file_path))
+            try: item = self.res_q.get(True, 0.5)
+            except Empty:
+                if not self.proc.is_alive(): break
+                continue
+            if item[0] == 'msg':
+                self.last_sbr = item[2]
+                self.last_seq = item[3]
+                self.parent.bus.publish(item[1])
+            elif item[0] == 'shm':
+                self.shm = shared_memory.SharedMemory(name=item[1])
+                n, fSize = item[2], item[3]
+                self.frames = FrameRing(n, fSize, self.shm.buf).frames
+            elif item[0] == 'stat':
+                self.n_frames, self.frames_el = item[1], item[2]
+            elif item[0] == 'end':
+                break
+        self.ctrl_q.put(('end', None))
+        self.proc.join(2)
+        self.frames = None
+        if self.shm != None:
+            self.shm.close()
+            self.shm = None
+
+    # --------------------------------------------------
+
+    def get_frame(self, seq):
+        ''' view of the frame with the sequence number 'seq'
+        in the shared frame buffer of the worker
+        (valid until the worker overwrites the slot)
+        '''
+        if self.frames is None or seq < 0: return None
+        return self.frames[seq % len(self.frames)]
+
+# ======================================================
+
+class _BenchParent:
+    def __init__(self, log_file_path, output_folder):
+        self.log_file_path = log_file_path
+        self.output_folder = output_folder
+        self.bus = MsgBus(call_after=lambda func: None) # (no subscriber)
+
+# --------------------------------------------------
+
+def bench(video_path, n_cams=[1, 3, 6], duration=10):
+    ''' FPS of each simulated camera (a video file)
+    with threads (VideoIn) and with worker processes (VideoInProc);
+    from the first frame to the last, so starting a worker process
+    (spawning, imports, shared memory) is not counted
+    '''
+    import tempfile
+    from os import path
+    from modules.videoIn import VideoIn
+    tmp_dir = tempfile.mkdtemp()
+    parent = _BenchParent(path.join(tmp_dir, 'bench.log'), tmp_dir)
+    for n in n_cams:
+        for mode in ['thread', 'process']:
+            mods = []
+            for i in range(n):
+                if mode == 'thread':
+                    mods.append(VideoIn(parent, i, src=video_path))
+                else:
+                    mods.append(VideoInProc(parent, i, src=video_path))
+                mods[-1].thrd = Thread(target=mods[-1].run)
+                mods[-1].thrd.start()
+            sleep(duration)
+            for m in mods: m.msg_q.put('main/quit/True', True, None)
+            for m in mods: m.thrd.join()
+            fps = []
+            for m in mods:
+                if mode == 'thread': el = m.frame_ts - m.t_first_frame
+                else: el = m.frames_el
+                fps.append((m.n_frames-1)/el if el > 0 else 0.0)
+            print("%i camera(s), %7s: mean FPS per camera %.1f (%s)"%(n,
+                    mode, np.mean(fps), str([round(f, 1) for f in fps])))
+
+# ======================================================
+
+if __name__ == '__main__':
+    from sys import argv
+    if len(argv) < 2: print("Usage: python -m modules.videoIn_proc video_file")
+    else: bench(argv[1])
@@ -0,0 +1,83 @@
+# coding: UTF-8
+
+"""
+This is for writing video clips of VideoIn in a separate thread.
+
+The capture loop only puts sequence numbers of frames (in FrameRing)
+onto a bounded queue. The writer thread copies each frame from the ring
+and encodes it, so cv2.VideoWriter.write never slows down the capture.
+A frame is dropped (and counted), when the queue is full or when the
+frame in the ring was already overwritten before it could be written.
+"""
+
+from threading import Thread, Event
+from queue import Queue, Full, Empty
+
+import cv2
+
+# ======================================================
+
+class VideoRecorder:
+    def __init__(self, file_path, fourcc, fps, fSize, fr, pre_roll=30,
+                 margin=10, on_finish=None):
+        ''' fr: FrameRing of the camera
+        pre_roll: number of buffered frames to write at the beginning
+        margin: number of frames kept free in the ring as a safety margin
+          against the capture loop overwriting a frame being encoded
+        on_finish: function, called with (file_path, stats) when it's done
+        '''
+        self.file_path = file_path
+        self.fr = fr
+        self.margin = margin
+        self.on_finish = on_finish
+        self.stats = dict(written=0, dropped_q=0, dropped_late=0)
+        self.q = Queue(maxsize=max(1, fr.n-margin-1))
+        self.stop_ev = Event()
+        self.video_rec = cv2.VideoWriter(file_path, fourcc, fps, fSize)
+        self.thrd = Thread(target=self.run, daemon=True)
+        self.thrd.start()
+        pre_roll = min(pre_roll, fr.count(), self.q.maxsize)
+        for seq in range(fr.seq-pre_roll, fr.seq): self.put(seq)
+
+    # --------------------------------------------------
+
+    def put(self, seq):
+        ''' queue the frame with the sequence number 'seq' to be written
+        '''
+        try: self.q.put(seq, False)
+        except Full: self.stats["dropped_q"] += 1
+
+    # --------------------------------------------------
+
+    def stop(self, wait=False, timeout=10):
+        ''' finish writing (queued frames are still written).
+        wait: wait (up to 'timeout' seconds) until the writer thread
+          released the file (when the program is about to quit)
+        '''
+        self.stop_ev.set()
+        if wait: self.thrd.join(timeout)
+
+    # --------------------------------------------------
+
+    def run(self):
+        while True:
+            try: seq = self.q.get(True, 0.1)
+            except Empty:
+                if self.stop_ev.is_set(): break
+                continue
+            img = self.fr.get(seq, self.margin//2)
+            if img is not None:
+                img = img.copy() # (the capture loop may overwrite the slot
+                  # while it's encoded)
+                if self.fr.get(seq, 1) is None: img = None # overwritten
+                  # (or being overwritten; the slot is filled before
+                  # push) during copying; torn frame
+            if img is None: # already overwritten in the ring
+                self.stats["dropped_late"] += 1
+                continue
+            self.video_rec.write(img)
+            self.stats["written"] += 1
+        self.video_rec.release()
+        if self.on_finish != None: self.on_finish(self.file_path, self.stats)
+
+# ======================================================